@@ -0,0 +1,260 @@
+# benchmarks/fakes.py
+# 離線替身：gspread worksheet / yfinance / Gemini GenerativeModel
+# 每個替身都可設定延遲 (latency)、錯誤率 (error_rate) 與資料量 (payload_size)，
+# 讓基準測試與壓力測試不需要網路與金鑰就能跑完整流程。
+import json
+import random
+import re
+import threading
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+TICKERS = ["NVDA", "TSM", "AMD", "AVGO", "ASML", "MU", "VRT", "SMCI", "ANET", "MSFT", "GOOGL", "META"]
+PACER_TYPES = ["P", "A", "C", "E", "R"]
+DECISIONS = ["Strong Buy", "Buy", "Watch", "Sell", "Risk Off (避險)"]
+KEYWORDS = ["#L2擴張", "#L3緊縮", "#MFR壟斷", "#液冷散熱", "#HBM", "#CoWoS", "#電力瓶頸", "#去庫存"]
+
+
+class FakeServiceError(Exception):
+    # 模擬 429 / 5xx；帶 response.status_code 與 code，與真實例外的判斷方式一致
+    def __init__(self, status_code=503, message="fake service error"):
+        super().__init__(f"{status_code} {message}")
+        self.code = status_code
+        self.response = types.SimpleNamespace(status_code=status_code)
+
+
+class _Behavior:
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def hit(self, latency=None):
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.error_rate
+        time.sleep(self.latency if latency is None else latency)
+        if fail:
+            raise FakeServiceError()
+
+
+# --- 1. Google Sheets ---
+def make_row(i, payload_size=200):
+    # 第 i 筆決策 (可重現)；欄位順序同 memory_mirror.MEMORY_COLUMNS
+    r = random.Random(i)
+    ticker = TICKERS[i % len(TICKERS)] if i % 3 else f"T{i % 5000:04d}"
+    day = 1 + (i // 10) % 28
+    month = 1 + (i // 280) % 12
+    return [
+        f"2025{month:02d}{day:02d}-{ticker}",
+        f"2025-{month:02d}-{day:02d} {i % 24:02d}:{i % 60:02d}",
+        ticker,
+        r.choice(DECISIONS),
+        f"{ticker} {r.choice(['物理瓶頸', '產能限制', '轉換成本', '估值過高'])} 第 {i} 筆",
+        str(r.randint(0, 100)),
+        f"{r.uniform(10, 1000):.2f}",
+        "Unknown",
+        " ".join(r.sample(KEYWORDS, 2)),
+        r.choice(PACER_TYPES),
+        ("分析內容 " * (payload_size // 5 + 1))[:payload_size],
+    ]
+
+
+class FakeWorksheet:
+    # 第 1 列為標題，資料列依需要即時產生 (1M 列也不會先佔用記憶體)
+    def __init__(self, n_rows=100, payload_size=200, latency=0.0, error_rate=0.0, seed=0):
+        self.n_rows = n_rows
+        self.payload_size = payload_size
+        self.behavior = _Behavior(latency, error_rate, seed)
+        self.appended = []
+        self.cells_read = 0
+        self.spreadsheet = types.SimpleNamespace(url="https://example.invalid/fake-sheet")
+        self._lock = threading.Lock()
+
+    @property
+    def total_rows(self):
+        return 1 + self.n_rows + len(self.appended)
+
+    def _row(self, row_num):
+        if row_num == 1:
+            return ["log_id", "timestamp", "ticker", "decision", "rationale", "risk_score",
+                    "entry_price", "cycle_position", "keywords", "pacer_type", "full_analysis"]
+        if row_num <= 1 + self.n_rows:
+            return make_row(row_num - 2, self.payload_size)
+        return list(self.appended[row_num - 2 - self.n_rows])
+
+    def get_values(self, range_name="A1:K"):
+        self.behavior.hit()
+        return self._values(range_name)
+
+    def _values(self, range_name):
+        match = re.match(r"([A-Z]+)(\d+)?:([A-Z]+)(\d+)?", range_name)
+        first_col = ord(match.group(1)) - ord("A")
+        last_col = ord(match.group(3)) - ord("A")
+        start = int(match.group(2) or 1)
+        end = int(match.group(4) or self.total_rows)
+        with self._lock:
+            end = min(end, self.total_rows)
+            rows = [self._row(r)[first_col:last_col + 1] for r in range(start, end + 1)]
+        self.cells_read += sum(len(r) for r in rows)
+        return rows
+
+    def batch_get(self, ranges, **kwargs):
+        # 真正的 API 是一次 HTTP 請求 (values.batchGet)，延遲只算一次
+        self.behavior.hit()
+        return [self._values(r) for r in ranges]
+
+    def get_all_records(self):
+        values = self.get_values("A1:K")
+        return [dict(zip(values[0], row)) for row in values[1:]]
+
+    def append_rows(self, rows, **kwargs):
+        self.behavior.hit()
+        with self._lock:
+            first = self.total_rows + 1
+            self.appended.extend([str(v) for v in row] for row in rows)
+            last = self.total_rows
+        return {"updates": {"updatedRange": f"Sheet1!A{first}:K{last}", "updatedRows": len(rows)}}
+
+    def append_row(self, row, **kwargs):
+        return self.append_rows([row])
+
+
+# --- 2. yfinance ---
+def _price_of(symbol, day):
+    seed = sum(ord(c) for c in symbol)
+    return round(50 + seed % 400 + 5 * np.sin(day / 7 + seed), 2)
+
+
+class FakeTicker:
+    def __init__(self, symbol, yf):
+        self.symbol = symbol.upper()
+        self._yf = yf
+
+    @property
+    def info(self):
+        self._yf.behavior.hit()
+        return {
+            "shortName": f"{self.symbol} Corp",
+            "sector": "Technology",
+            "marketCap": 10 ** 9 * (1 + len(self.symbol)),
+            "currentPrice": _price_of(self.symbol, 0),
+            "previousClose": _price_of(self.symbol, -1),
+            "longBusinessSummary": ("Fake company profile. " * (self._yf.payload_size // 22 + 1))[:self._yf.payload_size],
+        }
+
+    def history(self, start=None, end=None, period=None, interval="1d", **kwargs):
+        return self._yf.download(self.symbol, start=start, end=end, period=period)
+
+
+class FakeYFinance:
+    # 介面同 yfinance 模組：download() / Ticker()
+    __version__ = "fake"
+
+    def __init__(self, latency=0.0, error_rate=0.0, payload_size=500, seed=0, history_days=400):
+        self.behavior = _Behavior(latency, error_rate, seed)
+        self.payload_size = payload_size
+        self.history_days = history_days
+        self.downloads = 0
+
+    def Ticker(self, symbol):
+        return FakeTicker(symbol, self)
+
+    def download(self, tickers, start=None, end=None, period=None, interval="1d", **kwargs):
+        self.behavior.hit()
+        self.downloads += 1
+        symbols = [tickers] if isinstance(tickers, str) else list(tickers)
+        today = pd.Timestamp.today().normalize()
+        dates = pd.bdate_range(end=today, periods=self.history_days)
+        if start is not None:
+            dates = dates[dates >= pd.Timestamp(start)]
+        if end is not None:
+            dates = dates[dates < pd.Timestamp(end)]
+        if period == "5d":
+            dates = dates[-5:]
+        offsets = (dates - today).days.to_numpy()
+        close = pd.DataFrame({s: [_price_of(s, d) for d in offsets] for s in symbols}, index=dates)
+        return pd.concat({"Close": close, "Adj Close": close}, axis=1)
+
+
+# --- 3. Gemini ---
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    # 回應內容會回顯 prompt 中的【指揮官指令】，壓力測試可據此檢查結果是否串到別的 session
+    def __init__(self, latency=0.0, error_rate=0.0, payload_size=2000, seed=0, chunk_size=200, model_name="fake-gemini"):
+        self.behavior = _Behavior(latency, error_rate, seed)
+        self.payload_size = payload_size
+        self.chunk_size = chunk_size
+        self.model_name = model_name
+
+    def _answer(self, prompt):
+        instruction = str(prompt).split("【指揮官指令】")[-1].strip()
+        if "供應鏈拆解" in instruction:
+            # 協議 G fan-out 的第一步 (tools/fanout.py)：固定拆成三層
+            return json.dumps({"layers": [
+                {"layer": "晶片", "tickers": TICKERS[0:4]},
+                {"layer": "設備", "tickers": TICKERS[4:6]},
+                {"layer": "散熱 / 電源", "tickers": TICKERS[6:9]},
+            ]}, ensure_ascii=False)
+        tickers = re.findall(r"\b[A-Z][A-Z0-9.\-]{1,9}\b", instruction)
+        return json.dumps({
+            "decision": "Buy",
+            "pacer_type": "P",
+            "target_price": "123.45",
+            "risk_score": "42",
+            "rationale": f"echo: {instruction[:80]}",
+            "keywords": "#MFR壟斷 #Fake",
+            "tickers": tickers,
+            "cycle_coords": {"L1_Inventory": "Neutral", "L2_CapEx": "Expansion",
+                             "L3_Liquidity": "Easing", "L4_Tech": "Deployment"},
+            "ari_signals": {"status": "Green (Safe)", "main_threat": "無"},
+            "full_analysis": (f"[{instruction[:40]}] " + "分析內容 " * (self.payload_size // 5 + 1))[:self.payload_size],
+        }, ensure_ascii=False)
+
+    def generate_content(self, contents, stream=False, request_options=None, generation_config=None, **kwargs):
+        text = self._answer(contents)
+        if not stream:
+            self.behavior.hit()
+            return _FakeResponse(text)
+        # 串流：第一個 chunk 前先付延遲的一半，其餘平均分攤到每個 chunk
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        self.behavior.hit(self.behavior.latency / 2)
+        return self._stream(chunks)
+
+    def _stream(self, chunks):
+        per_chunk = self.behavior.latency / 2 / max(1, len(chunks))
+        for chunk in chunks:
+            time.sleep(per_chunk)
+            yield _FakeResponse(chunk)
+
+
+class FakeGenAI:
+    # 介面同 google.generativeai 模組：configure() / GenerativeModel()
+    def __init__(self, **model_kwargs):
+        self.model_kwargs = model_kwargs
+        self.api_key = None
+
+    def configure(self, api_key=None, **kwargs):
+        self.api_key = api_key
+
+    def GenerativeModel(self, model_name="fake-gemini", **kwargs):
+        return FakeModel(model_name=model_name, **self.model_kwargs)
+
+
+# --- 4. 安裝到 tools/ ---
+def install(worksheet=None, yf=None):
+    # 把替身接到共用連線與行情模組；model 直接傳給呼叫端使用
+    from tools import market_data, sheets
+    if worksheet is not None:
+        sheets.install(worksheet)
+    if yf is not None:
+        market_data.yf = yf
@@ -0,0 +1,261 @@
+# benchmarks/load_test.py
+# 多使用者壓力測試：以 Streamlit AppTest 無頭驅動 dashboard.py，模擬多位分析師同時按下「🚀 執行推演」
+# Sheets / yfinance / Gemini 全部換成本地替身 (benchmarks/fakes.py)，盤後也能重現戰情室的壅塞。
+# 每個 session 固定一個協議 (A / C / F / G 輪流)，每輪在輸入中放一個唯一標記 (例如 LT4S02R1)；
+# 假模型會回顯指令，結果裡出現別的 session 的標記 (或找不到自己的) 即視為串到別的 session。
+#
+#   python -m benchmarks.load_test                           # 並行 1,2,4,8 個 session
+#   python -m benchmarks.load_test --concurrency 16 --rounds 3 --gemini-latency 1.0
+#   python -m benchmarks.load_test --json load.json          # 另存各並行等級的結果
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+# 所有本地檔案 (鏡像 / spool / 快取) 寫到暫存目錄，必須在載入 tools 之前設定
+_TMP_DIR = tempfile.mkdtemp(prefix="system_v14_load_")
+os.environ["SYSTEM_V14_DATA_DIR"] = _TMP_DIR
+os.environ.setdefault("GOOGLE_API_KEY", "fake-key")
+# 假服務沒有配額：放寬限流 (tools/rate_limit.py)，量測的是 Dashboard 本身在並行下的行為
+for _service in ("SHEETS", "YAHOO", "GEMINI"):
+    os.environ.setdefault(f"SYSTEM_V14_{_service}_RPM", "1000000")
+    os.environ.setdefault(f"SYSTEM_V14_{_service}_BURST", "1000000")
+    os.environ.setdefault(f"SYSTEM_V14_{_service}_CONCURRENCY", "64")
+
+from benchmarks import fakes  # noqa: E402
+from tools.telemetry import percentile  # noqa: E402
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dashboard.py")
+PROTOCOLS = ["協議 A: 情報解碼 (Intel)", "協議 C: 宏觀診斷 (Macro)", "協議 F: 個股偵察 (Scout)", "協議 G: 趨勢獵殺 (Hunt)"]
+MARKER = re.compile(r"LT\d+S\d+R\d+")
+
+
+# --- 1. 替身安裝 ---
+def install_fakes(args):
+    fakes.install(
+        worksheet=fakes.FakeWorksheet(args.rows, latency=args.sheets_latency, error_rate=args.error_rate),
+        yf=fakes.FakeYFinance(latency=args.yahoo_latency, error_rate=args.error_rate),
+    )
+    # Dashboard 在第一次推演時才 import google.generativeai，先把假模組放進 sys.modules
+    genai = fakes.FakeGenAI(latency=args.gemini_latency, error_rate=args.error_rate)
+    sys.modules["google.generativeai"] = genai
+    google = sys.modules.setdefault("google", types.ModuleType("google"))
+    google.generativeai = genai
+
+
+def share_streamlit_runtime():
+    # AppTest 是為單一 session 設計的：每次 run 換一個全域 Runtime 實例、結束時清成 None，
+    # 暫時打開全域設定 global.appTest 後再還原，並各自重新編譯腳本。
+    # 多個 session 同時跑會互相清掉對方的 Runtime / 設定，也會同時 ast.parse 而互相干擾。
+    # 真正的伺服器只有一個 Runtime、所有 session 共用一份編譯好的 dashboard.py，這裡改成同樣的行為。
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    config.set_option("global.appTest", True)   # 每次 run 結束都還原成 True
+
+    shared = ScriptCache()
+    get_bytecode = ScriptCache.get_bytecode
+    ScriptCache.get_bytecode = lambda self, script_path: get_bytecode(shared, script_path)
+
+    last = []
+
+    def instance(cls):
+        current = cls.__dict__["_instance"]
+        if current is not None:
+            last[:] = [current]
+        elif last:
+            current = last[0]   # 被別的 session 的 run 結束時清掉了，沿用同一個
+        else:
+            raise RuntimeError("Runtime hasn't been created!")
+        return current
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls.__dict__["_instance"] is not None or bool(last))
+
+
+# --- 2. 單一 session ---
+def _fill_input(at, protocol, marker):
+    # 把標記放進各協議會送進【指揮官指令】的輸入欄位
+    if protocol.startswith("協議 F"):
+        at.sidebar.text_input[0].set_value(marker)
+    elif protocol.startswith("協議 G"):
+        at.sidebar.text_input[0].set_value(f"液冷散熱 {marker}")
+    elif protocol.startswith("協議 A"):
+        at.sidebar.text_area[0].set_value(f"{marker} 新聞：先進封裝產能吃緊")
+    else:
+        at.sidebar.text_area[0].set_value(f"{marker} Fed 維持利率不變")
+
+
+def _ai_result(at):
+    # 「查看 AI Response JSON」裡的推演結果
+    for element in at.json:
+        try:
+            value = json.loads(element.value)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(value, dict) and "decision" in value:
+            return value
+    return None
+
+
+def run_session(level, sid, args, start_barrier):
+    from streamlit.testing.v1 import AppTest
+
+    protocol = PROTOCOLS[sid % len(PROTOCOLS)]
+    runs = []
+    try:
+        at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+        at.run()
+        at.sidebar.selectbox[0].set_value(protocol).run()
+        at.sidebar.toggle[-1].set_value(args.stream)    # ⚡ 串流輸出 (協議 G 另有展開開關在前面)
+    except Exception:
+        start_barrier.abort()   # 其他 session 不再等這個已經掛掉的
+        raise
+    try:
+        start_barrier.wait()    # 所有 session 都載入完才同時開始按
+    except threading.BrokenBarrierError:
+        pass
+    for round_no in range(args.rounds):
+        marker = f"LT{level}S{sid:02d}R{round_no}"
+        _fill_input(at, protocol, marker)
+        at.sidebar.button[0].click()
+        start = time.perf_counter()
+        error = None
+        try:
+            at.run()
+            if at.exception:
+                error = at.exception[0].message
+            elif at.error:
+                error = at.error[0].value
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+        seconds = time.perf_counter() - start
+
+        result = None if error else _ai_result(at)
+        found = set(MARKER.findall(json.dumps(result, ensure_ascii=False))) if result else set()
+        runs.append({
+            "session": sid, "protocol": protocol[:4], "round": round_no, "seconds": seconds,
+            "error": error or (None if result else "找不到推演結果"),
+            "contaminated": bool(result) and (marker not in found or bool(found - {marker})),
+            "foreign": sorted(found - {marker}),
+        })
+    return runs
+
+
+# --- 3. 單一並行等級 ---
+def run_level(level, args):
+    barrier = threading.Barrier(level)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=level, thread_name_prefix="load-session") as pool:
+        futures = [pool.submit(run_session, level, sid, args, barrier) for sid in range(level)]
+        runs, crashed = [], 0
+        for future in futures:
+            try:
+                runs.extend(future.result())
+            except Exception as e:
+                crashed += 1
+                print(f"⚠️ session 啟動失敗: {e}", file=sys.__stdout__)
+    # 牆鐘時間包含各 session 的首次載入；吞吐量只算推演本身
+    wall = time.perf_counter() - start
+    busy = max((sum(r["seconds"] for r in runs if r["session"] == sid) for sid in range(level)), default=0)
+
+    seconds = [r["seconds"] for r in runs if not r["error"]]
+    errors = [r for r in runs if r["error"]]
+    by_protocol = {}
+    for r in runs:
+        if not r["error"]:
+            by_protocol.setdefault(r["protocol"], []).append(r["seconds"])
+    return {
+        "concurrency": level,
+        "runs": len(runs),
+        "crashed_sessions": crashed,
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(runs), 3) if runs else None,
+        "contaminated": sum(r["contaminated"] for r in runs),
+        "throughput_per_min": round(len(seconds) / busy * 60, 2) if busy else 0.0,
+        "wall_seconds": round(wall, 3),
+        "p50": _round(percentile(seconds, 50)),
+        "p95": _round(percentile(seconds, 95)),
+        "p99": _round(percentile(seconds, 99)),
+        "p50_by_protocol": {k: _round(percentile(v, 50)) for k, v in sorted(by_protocol.items())},
+        "sample_errors": sorted({r["error"] for r in errors})[:3],
+        "sample_foreign": [r["foreign"] for r in runs if r["foreign"]][:3],
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+def print_level(stats, out):
+    print(f"  {stats['concurrency']:>4}  {stats['runs']:>5}  {stats['throughput_per_min']:>9.1f}  "
+          f"{stats['p50'] or 0:>7.3f}  {stats['p95'] or 0:>7.3f}  {stats['p99'] or 0:>7.3f}  "
+          f"{stats['error_rate'] or 0:>6.1%}  {stats['contaminated']:>5}", file=out)
+    by_protocol = "  ".join(f"{k} {v:.3f}s" for k, v in stats["p50_by_protocol"].items())
+    if by_protocol:
+        print(f"        p50 by protocol: {by_protocol}", file=out)
+    for error in stats["sample_errors"]:
+        print(f"        ❌ {error[:160]}", file=out)
+    for foreign in stats["sample_foreign"]:
+        print(f"        ☣️ 出現其他 session 的結果: {foreign}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="System v14 Dashboard 多使用者壓力測試 (離線)")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="同時執行的 session 數，逗號分隔")
+    parser.add_argument("--rounds", type=int, default=2, help="每個 session 連續推演幾次")
+    parser.add_argument("--rows", type=int, default=1000, help="假記憶庫列數")
+    parser.add_argument("--sheets-latency", type=float, default=0.05)
+    parser.add_argument("--yahoo-latency", type=float, default=0.05)
+    parser.add_argument("--gemini-latency", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="關閉串流輸出")
+    parser.add_argument("--timeout", type=float, default=120, help="單次推演逾時 (秒)")
+    parser.add_argument("--json", help="另存各並行等級的結果 (JSON)")
+    parser.add_argument("--verbose", action="store_true", help="顯示 Dashboard 與 tools 自己的輸出")
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",")]
+    out = sys.stdout
+    if not args.verbose:
+        from streamlit import config
+        from streamlit.logger import set_log_level
+        # AppTest 無 Runtime / ScriptRunContext 的警告每次 run 都會出現
+        config.set_option("logger.level", "error")
+        set_log_level("error")
+    install_fakes(args)
+    share_streamlit_runtime()
+
+    print(f"🧪 System v14 load test (data dir: {_TMP_DIR})", file=out)
+    print(f"  {'並行':>4}  {'推演':>5}  {'次/分鐘':>9}  {'p50 s':>7}  {'p95 s':>7}  {'p99 s':>7}  {'錯誤率':>6}  {'串台':>5}",
+          file=out)
+    results = []
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    for level in levels:
+        with quiet:
+            stats = run_level(level, args)
+        results.append(stats)
+        print_level(stats, out)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if any(s["contaminated"] for s in results):
+        print("\n❌ 偵測到跨 session 的結果串台", file=out)
+        return 1
+    print("\n✅ 沒有跨 session 的結果串台", file=out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+# benchmarks/run_bench.py
+# 離線基準測試：以本地替身 (benchmarks/fakes.py) 取代 Sheets / yfinance / Gemini，
+# 在不同記憶庫大小下量測 smart_search、log_decision、get_stock_info 與完整推演流程，
+# 輸出各階段耗時與記憶體峰值，並與 baseline.json 比較，退步時以非 0 結束碼失敗。
+# 絕對秒數會隨機器與負載浮動，比較時：
+# - 穩態的量測 (重複呼叫) 跑 --rounds 輪取最快一輪 (min-of-N)
+# - 同時量一段固定的純 Python 參考工作 (calibration)，這台機器比建立 baseline 的機器慢時按比例放寬
+# - 差距小於 --min-delta 秒不算退步；--advisory 只列出退步、不以非 0 結束
+#
+#   python -m benchmarks.run_bench                     # 預設 100 ~ 100k 列
+#   python -m benchmarks.run_bench --full              # 加上 1M 列
+#   python -m benchmarks.run_bench --update-baseline   # 以本次結果更新 baseline
+#   python -m benchmarks.run_bench --advisory          # 只回報，不讓 CI 失敗
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# 所有本地檔案 (鏡像 / spool / 快取) 寫到暫存目錄，必須在載入 tools 之前設定
+_TMP_DIR = tempfile.mkdtemp(prefix="system_v14_bench_")
+os.environ["SYSTEM_V14_DATA_DIR"] = _TMP_DIR
+# 假服務沒有配額：放寬限流 (tools/rate_limit.py)，量測的是本身的開銷而不是配額等待
+for _service in ("SHEETS", "YAHOO", "GEMINI"):
+    os.environ.setdefault(f"SYSTEM_V14_{_service}_RPM", "1000000")
+    os.environ.setdefault(f"SYSTEM_V14_{_service}_BURST", "1000000")
+    os.environ.setdefault(f"SYSTEM_V14_{_service}_CONCURRENCY", "64")
+
+from benchmarks import fakes  # noqa: E402
+from tools import batch_runner, market_data, memory_index, memory_logger, memory_mirror, smart_search  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_SIZES = [100, 1_000, 10_000, 100_000]
+FULL_SIZES = DEFAULT_SIZES + [1_000_000]
+QUERIES = ["NVDA", "TSM", "液冷散熱", "#HBM", "物理瓶頸", "T0042", "MFR 壟斷", "CoWoS"]
+
+
+# --- 1. 量測工具 ---
+class Recorder:
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.out = sys.stdout       # 被測函式的 print 會被導走，報表固定寫到這裡
+        self.results = {}
+        self.tracing = False        # 目前這一輪只量記憶體 (tracemalloc 會拖慢，耗時不採計)
+
+    def measure(self, name, fn, repeat=1, rounds=1, setup=None):
+        # 回傳 fn 的最後一次結果；耗時取各輪平均中最快的一輪 (秒)，記憶體取峰值 (MB)
+        # 多輪時最後一輪只開 tracemalloc 量記憶體、不計時；只能跑一次的 (冷啟動) 邊追蹤邊計時
+        # setup: 每輪開始前執行、不計時 (例如先塞好要 drain 的資料)
+        seconds = peak_mb = None
+        for i in range(rounds):
+            trace = self.trace_memory and (rounds == 1 or i == rounds - 1)
+            self.tracing = trace and rounds > 1
+            if setup:
+                setup()
+            if trace:
+                tracemalloc.start()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = fn()
+            elapsed = (time.perf_counter() - start) / repeat
+            if trace:
+                peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+            if not self.tracing:
+                seconds = elapsed if seconds is None else min(seconds, elapsed)
+        self.tracing = False
+        self.results[name] = {"seconds": round(seconds, 6), "peak_mb": None if peak_mb is None else round(peak_mb, 2)}
+        mem = "" if peak_mb is None else f"  peak {peak_mb:8.1f} MB"
+        print(f"  {name:<32} {seconds * 1000:10.2f} ms{mem}", file=self.out)
+        return result
+
+
+def _fresh_memory_store(size):
+    # 每個大小用獨立的鏡像檔、索引與 spool
+    memory_mirror.MIRROR_PATH = os.path.join(_TMP_DIR, f"mirror_{size}.db")
+    memory_index._index = memory_index.MemoryIndex()
+    memory_logger.SPOOL_PATH = os.path.join(_TMP_DIR, f"spool_{size}.jsonl")
+    memory_logger._writer = None
+
+
+# --- 2. 各項基準 ---
+def bench_memory(recorder, size, args):
+    sheet = fakes.FakeWorksheet(size, payload_size=args.payload, latency=args.sheets_latency,
+                                error_rate=args.error_rate)
+    fakes.install(worksheet=sheet)
+    _fresh_memory_store(size)
+
+    recorder.measure(f"search.cold@{size}", lambda: smart_search.search_memory("NVDA"))
+    queries = iter(QUERIES * 100)
+    recorder.measure(f"search.warm@{size}", lambda: smart_search.search_memory(next(queries)),
+                     repeat=len(QUERIES) * 5, rounds=args.rounds)
+    recorder.measure(f"index.query@{size}", lambda: memory_index.get_index().search(next(queries), k=5),
+                     repeat=len(QUERIES) * 5, rounds=args.rounds)
+
+    # 新增 100 列後的增量同步：成本應只跟新增列數有關
+    sheet.append_rows([fakes.make_row(size + i, args.payload) for i in range(100)])
+    memory_mirror.SYNC_INTERVAL, interval = 0, memory_mirror.SYNC_INTERVAL
+    try:
+        recorder.measure(f"search.incremental@{size}", lambda: smart_search.search_memory("NVDA"))
+    finally:
+        memory_mirror.SYNC_INTERVAL = interval
+
+    # 歸檔：enqueue 應與網路無關；drain 為背景批次寫入 100 筆的時間
+    payload = json.dumps({"ticker": "BENCH", "decision": "Watch", "full_analysis": "x" * args.payload})
+    recorder.measure(f"log_decision.enqueue@{size}", lambda: memory_logger.log_decision(payload), repeat=100,
+                     rounds=args.rounds)
+    writer = memory_logger.get_writer()
+    writer.flush(timeout=120)
+
+    def enqueue_batch():
+        for _ in range(100):
+            memory_logger.log_decision(payload)
+
+    recorder.measure(f"log_decision.drain@{size}", lambda: writer.flush(timeout=120), rounds=args.rounds,
+                     setup=enqueue_batch)
+
+
+def bench_market(recorder, args):
+    yf = fakes.FakeYFinance(latency=args.yahoo_latency, error_rate=args.error_rate, payload_size=args.payload)
+    fakes.install(yf=yf)
+    market_data._profiles.clear()
+    symbols = [f"S{i:03d}" for i in range(50)]
+    recorder.measure("get_stock_info.cold", lambda: market_data.fetch_stock_info("NVDA"))
+    recorder.measure("get_stock_info.warm", lambda: market_data.fetch_stock_info("NVDA"), repeat=10, rounds=args.rounds)
+    recorder.measure("quotes.batch1", lambda: market_data.get_quotes(symbols[:1]), repeat=5, rounds=args.rounds)
+    recorder.measure("quotes.batch50", lambda: market_data.get_quotes(symbols), repeat=5, rounds=args.rounds)
+
+
+def bench_pipeline(recorder, size, args):
+    model = fakes.FakeModel(latency=args.gemini_latency, error_rate=args.error_rate, payload_size=args.payload * 10)
+    tickers = iter(fakes.TICKERS * 10)
+
+    def run_once():
+        record = batch_runner.run_ticker(next(tickers), model, timeout=60, archive=True, force_fresh=True)
+        if recorder.tracing:
+            return record
+        for stage, seconds in record["timings"].items():
+            stage_times.setdefault(stage, []).append(seconds)
+        return record
+
+    stage_times = {}
+    recorder.measure(f"pipeline.run_ticker@{size}", run_once, repeat=5, rounds=args.rounds)
+    for stage, values in sorted(stage_times.items()):
+        recorder.results[f"pipeline.{stage}@{size}"] = {"seconds": round(sum(values) / len(values), 6), "peak_mb": None}
+        print(f"    └ {stage:<28} {sum(values) / len(values) * 1000:10.2f} ms", file=recorder.out)
+
+
+# --- 3. 與 baseline 比較 ---
+CALIBRATION = "_calibration"
+
+
+def calibrate(rounds=5):
+    # 固定的純 Python 工作量 (斷詞 + 排序 + JSON)，取最快一次；用來估計這台機器相對 baseline 的快慢
+    text = " ".join(f"{t} {k} 物理瓶頸 產能限制 第 {i} 筆" for i, (t, k) in
+                    enumerate(zip(fakes.TICKERS * 200, fakes.KEYWORDS * 300)))
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        tokens = sorted(memory_index.tokenize(text))
+        json.dumps(tokens, ensure_ascii=False)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def machine_scale(results, baseline):
+    # 只放寬、不收緊：這台比較快時不縮小 baseline (假服務的 sleep 不會跟著變快)
+    old = baseline.get(CALIBRATION, {}).get("seconds")
+    new = results.get(CALIBRATION, {}).get("seconds")
+    if not old or not new:
+        return 1.0
+    return max(1.0, new / old)
+
+
+def compare(results, baseline, tolerance, min_delta, scale=1.0):
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if not current or name == CALIBRATION:
+            continue
+        for metric, floor in (("seconds", min_delta), ("peak_mb", 1.0)):
+            old, new = base.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            if metric == "seconds":
+                old = round(old * scale, 6)
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append(f"{name} {metric}: {old} -> {new} (+{(new / old - 1) * 100 if old else 0:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="System v14 離線基準測試")
+    parser.add_argument("--sizes", help="記憶庫列數，逗號分隔 (預設 100,1000,10000,100000)")
+    parser.add_argument("--full", action="store_true", help="包含 1M 列")
+    parser.add_argument("--payload", type=int, default=200, help="full_analysis / 公司簡介長度 (字元)")
+    parser.add_argument("--sheets-latency", type=float, default=0.02)
+    parser.add_argument("--yahoo-latency", type=float, default=0.02)
+    parser.add_argument("--gemini-latency", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--no-tracemalloc", action="store_true", help="不量測記憶體峰值 (tracemalloc 會拖慢速度)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="允許比 baseline 慢的比例")
+    parser.add_argument("--min-delta", type=float, default=0.02, help="小於此秒數的差異不算退步")
+    parser.add_argument("--rounds", type=int, default=3, help="穩態量測跑幾輪取最快 (min-of-N)")
+    parser.add_argument("--advisory", action="store_true", help="只列出退步，不以非 0 結束碼失敗")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", help="另存本次結果 (JSON)")
+    parser.add_argument("--verbose", action="store_true", help="顯示被測函式自己的輸出")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")] if args.sizes else (FULL_SIZES if args.full else DEFAULT_SIZES)
+    recorder = Recorder(trace_memory=not args.no_tracemalloc)
+
+    print(f"🧪 System v14 benchmark (data dir: {_TMP_DIR})")
+    recorder.results[CALIBRATION] = {"seconds": round(calibrate(), 6), "peak_mb": None}
+    print(f"  {'calibration':<32} {recorder.results[CALIBRATION]['seconds'] * 1000:10.2f} ms")
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        print("\n[market data]", file=recorder.out)
+        bench_market(recorder, args)
+        for size in sizes:
+            print(f"\n[memory log: {size:,} rows]", file=recorder.out)
+            bench_memory(recorder, size, args)
+            bench_pipeline(recorder, size, args)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(recorder.results, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(recorder.results, f, indent=2, sort_keys=True)
+        print(f"\n💾 已更新 baseline: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\n⚠️ 沒有 baseline，略過比較 (可用 --update-baseline 建立)")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    scale = machine_scale(recorder.results, baseline)
+    if scale > 1.0:
+        print(f"\n🐢 這台機器比 baseline 慢約 {scale:.2f}x (calibration)，門檻按比例放寬")
+    regressions = compare(recorder.results, baseline, args.tolerance, args.min_delta, scale)
+    if regressions:
+        print("\n⚠️ 效能可能退步 (僅供參考):" if args.advisory else "\n❌ 效能退步 (相對 baseline):")
+        for line in regressions:
+            print(f"  - {line}")
+        return 0 if args.advisory else 1
+    print("\n✅ 與 baseline 相比沒有退步")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
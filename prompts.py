@@ -43,4 +43,89 @@ SYSTEM_PROMPT = """
    },
    "full_analysis": "這裡請詳細撰寫分析報告。如果是協議 C，請重點分析 L1-L3 坐標與 ARI 四大指標的連動關係。"
 }
-"""
\ No newline at end of file
+"""
+# 協議 G 供應鏈展開 (tools/fanout.py) 第一步：只拆解、不分析，回應越短越好
+TREND_DECOMPOSE_PROMPT = """
+你是指揮官的供應鏈研究員。請把指定的趨勢拆解成供應鏈各層，並列出每一層最具代表性的上市公司代號
+(Yahoo Finance 格式，如 NVDA、VRT、2330.TW)。只做拆解，不要分析。
+每層最多 {per_layer} 檔，總數不超過 {max_candidates} 檔。
+
+【輸出格式 (JSON Only)】
+你必須嚴格遵守 JSON 格式回傳，不要有任何 Markdown 前綴：
+{{"layers": [{{"layer": "層級名稱 (如：晶片 / 散熱模組 / 電源)", "tickers": ["代號"]}}]}}
+"""
+
+# 結構化輸出 (Gemini response_schema)：與上方 SYSTEM_PROMPT 的輸出格式一致
+# 注意：SDK 0.8.6 沒有 property_ordering，schema 轉成 protobuf map 後欄位順序不保證等於生成順序；
+# 串流看板 (json_stream) 依欄位完成的先後更新，不依賴 full_analysis 在最後
+def _enum(*values):
+    return {"type": "STRING", "enum": list(values)}
+
+
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "decision": _enum("Strong Buy", "Buy", "Watch", "Sell", "Risk Off (避險)"),
+        "pacer_type": _enum("P", "A", "C", "E", "R"),
+        "target_price": {"type": "STRING"},
+        "risk_score": {"type": "STRING", "description": "0-100 (ARI 指數)"},
+        "rationale": {"type": "STRING"},
+        "keywords": {"type": "STRING"},
+        "cycle_coords": {
+            "type": "OBJECT",
+            "properties": {
+                "L1_Inventory": _enum("Destocking", "Restocking", "Neutral"),
+                "L2_CapEx": _enum("Expansion", "Contraction"),
+                "L3_Liquidity": _enum("Tightening", "Easing", "Crisis"),
+                "L4_Tech": _enum("Installation", "Deployment"),
+            },
+            "required": ["L1_Inventory", "L2_CapEx", "L3_Liquidity", "L4_Tech"],
+        },
+        "ari_signals": {
+            "type": "OBJECT",
+            "properties": {
+                "status": _enum("Green (Safe)", "Yellow (Caution)", "Red (Danger)"),
+                "main_threat": {"type": "STRING"},
+            },
+            "required": ["status", "main_threat"],
+        },
+        # 協議 G 彙整排名才會用到 (選填)
+        "ranking": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"ticker": {"type": "STRING"}, "layer": {"type": "STRING"}, "reason": {"type": "STRING"}},
+                "required": ["ticker", "reason"],
+            },
+        },
+        "full_analysis": {"type": "STRING"},
+    },
+    "required": ["decision", "pacer_type", "target_price", "risk_score", "rationale", "keywords",
+                 "cycle_coords", "ari_signals", "full_analysis"],
+}
+
+DECOMPOSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "layers": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"layer": {"type": "STRING"}, "tickers": {"type": "ARRAY", "items": {"type": "STRING"}}},
+                "required": ["layer", "tickers"],
+            },
+        },
+    },
+    "required": ["layers"],
+}
+
+# 回應缺欄位或格式錯誤時的小型補件 prompt (tools/structured.py)：不重做分析，只補指定欄位
+REPAIR_PROMPT = """
+以下是你先前完成的投資分析，其中部分欄位缺漏或格式錯誤。不要重新分析，只根據既有內容補齊指定欄位。
+
+【需要補齊的欄位】{fields}
+【既有內容】
+{partial}
+
+你必須嚴格遵守 JSON 格式回傳，只包含需要補齊的欄位，不要有任何 Markdown 前綴。
+"""
@@ -0,0 +1,6 @@
+# tests/conftest.py
+# 所有本地檔案 (鏡像 / spool / 快取 / metrics) 寫到暫存目錄，必須在載入 tools 之前設定
+import os
+import tempfile
+
+os.environ.setdefault("SYSTEM_V14_DATA_DIR", tempfile.mkdtemp(prefix="system_v14_test_"))
@@ -0,0 +1,65 @@
+# tests/test_batch_runner.py
+# 批次推演 checkpoint：重跑失敗的代號只取最後一筆，先前已歸檔的代號不再歸檔
+import json
+
+import pytest
+
+from tools import batch_runner
+
+
+def write_records(path, records):
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    calls = []
+
+    def fake_run_ticker(ticker, model, timeout, archive=True, **kwargs):
+        calls.append((ticker, archive))
+        return {"ticker": ticker, "status": "ok", "archived": archive, "decision": "Buy", "timings": {}}
+
+    monkeypatch.setattr(batch_runner, "run_ticker", fake_run_ticker)
+    monkeypatch.setattr(batch_runner, "get_writer", lambda: type("W", (), {"flush": lambda self, timeout: True})())
+    return calls
+
+
+def test_latest_results_keeps_last_record_per_ticker(tmp_path):
+    out = str(tmp_path / "out.jsonl")
+    write_records(out, [
+        {"ticker": "NVDA", "status": "parse_error"},
+        {"ticker": "TSM", "status": "ok"},
+        {"ticker": "NVDA", "status": "ok"},
+    ])
+    latest = batch_runner.latest_results(out)
+    assert [(r["ticker"], r["status"]) for r in latest] == [("TSM", "ok"), ("NVDA", "ok")]
+
+
+def test_rerun_skips_archive_for_already_archived_ticker(tmp_path, runs):
+    out = str(tmp_path / "out.jsonl")
+    write_records(out, [
+        {"ticker": "NVDA", "status": "parse_error", "archived": True},
+        {"ticker": "AMD", "status": "timeout"},
+        {"ticker": "TSM", "status": "ok", "archived": True},
+    ])
+    batch_runner.run_batch(["NVDA", "AMD", "TSM"], out, concurrency=1, model=object(), fallback=object())
+    assert sorted(runs) == [("AMD", True), ("NVDA", False)]
+    assert {r["ticker"]: r["status"] for r in batch_runner.latest_results(out)} == {
+        "NVDA": "ok", "AMD": "ok", "TSM": "ok"}
+
+
+def test_export_parquet_has_one_row_per_ticker(tmp_path):
+    pytest.importorskip("pyarrow")
+    out = str(tmp_path / "out.jsonl")
+    write_records(out, [
+        {"ticker": "NVDA", "status": "parse_error", "result": {"decision": "Error"}},
+        {"ticker": "NVDA", "status": "ok", "result": {"decision": "Buy"}},
+    ])
+    parquet = str(tmp_path / "out.parquet")
+    batch_runner.export_parquet(out, parquet)
+    import pandas as pd
+    df = pd.read_parquet(parquet)
+    assert df["ticker"].tolist() == ["NVDA"]
+    assert df["status"].tolist() == ["ok"]
@@ -0,0 +1,56 @@
+# tests/test_json_stream.py
+# 串流 JSON 解析器：逐字餵入時頂層欄位依序完成，未完成的字串欄位可取得部分內容
+import json
+
+from tools.json_stream import JsonFieldStream
+
+RESPONSE = {
+    "decision": "Buy",
+    "risk_score": 42,
+    "keywords": ["#HBM", "#CoWoS"],
+    "meta": {"nested": {"a": [1, 2, {"b": "}"}]}},
+    "flag": True,
+    "full_analysis": "第一段 \"引號\" 與 \\ 反斜線\n第二段 液冷",
+}
+
+
+def test_fields_complete_in_order_when_fed_char_by_char():
+    text = json.dumps(RESPONSE, ensure_ascii=False)
+    stream = JsonFieldStream()
+    order = []
+    for c in text:
+        stream.feed(c)
+        order.extend(stream.new_fields())
+    assert order == list(RESPONSE)
+    assert stream.fields == RESPONSE
+    assert stream.done
+
+
+def test_prefix_and_suffix_are_ignored():
+    stream = JsonFieldStream().feed('```json\n{"decision": "Watch", "risk_score": 7.5}\n```')
+    assert stream.fields == {"decision": "Watch", "risk_score": 7.5}
+    assert stream.done
+
+
+def test_partial_string_field():
+    text = json.dumps({"decision": "Buy", "full_analysis": "液冷 \"散熱\" 供應鏈"}, ensure_ascii=True)
+    stream = JsonFieldStream()
+    cut = text.index("\\u6563")     # 停在 \uXXXX 跳脫字元的前半段
+    stream.feed(text[:cut + 3])
+    assert stream.fields == {"decision": "Buy"}
+    assert stream.partial("full_analysis") == '液冷 "'
+    stream.feed(text[cut + 3:])
+    assert stream.partial("full_analysis") == '液冷 "散熱" 供應鏈'
+
+
+def test_partial_for_completed_non_string_is_json():
+    stream = JsonFieldStream().feed('{"keywords": ["#HBM"], "full')
+    assert stream.partial("keywords") == '["#HBM"]'
+    assert stream.partial("full_analysis") is None
+
+
+def test_truncated_object_keeps_completed_fields():
+    stream = JsonFieldStream().feed('{"decision": "Sell", "risk_score": 8')
+    # 數字在逗號 / 結尾大括號出現前都還沒完成
+    assert stream.fields == {"decision": "Sell"}
+    assert not stream.done
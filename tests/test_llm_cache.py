@@ -0,0 +1,58 @@
+# tests/test_llm_cache.py
+# Gemini 回應快取：歸檔了快取結果之後重跑同樣的推演要命中；記憶預算不同不能共用結果
+import pytest
+
+from tools import llm_cache
+from tools.llm_cache import LLMCache, make_key, memory_candidates
+
+K = 10
+TICKER = "NVDA"
+QUOTE = {"price": 120.0}
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    instance = LLMCache(path=str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(llm_cache, "_cache", instance)
+    return instance
+
+
+def history(n):
+    # 檢索結果：最新的排最前面 (與歸檔後新列排進前 k 筆的情況相同)
+    return [{"log_id": f"L{i}", "timestamp": f"2026-01-{i + 1:02d}", "decision": "Watch", "rationale": f"舊紀錄 {i}"}
+            for i in reversed(range(n))]
+
+
+def search(rows, k):
+    return rows[:k]
+
+
+def key_for(rows, budget=1500):
+    hits = search(rows, memory_candidates(TICKER, K))
+    return make_key("system", "協議 F", TICKER, QUOTE, hits, "偵察 NVDA", memory_budget=budget, k=K)
+
+
+def test_repeat_run_hits_after_archiving_the_miss(cache):
+    rows = history(K + 3)
+    first = key_for(rows)
+    assert cache.get(first) is None
+
+    result = {"decision": "Buy", "rationale": "液冷需求爆發"}
+    cache.put(first, result, ticker=TICKER)
+    # 歸檔：新列排在最前面，把原本的第 k 筆擠出前 k 筆
+    rows.insert(0, dict(result, log_id="NEW", timestamp="2026-02-01"))
+
+    second = key_for(rows)
+    assert second == first
+    assert cache.get(second) == result
+
+
+def test_other_tickers_own_rows_do_not_widen_search(cache):
+    cache.put("k", {"decision": "Buy", "rationale": "別檔"}, ticker="AMD")
+    assert memory_candidates(TICKER, K) == K
+    assert memory_candidates("amd", K) == K + 1
+
+
+def test_memory_budget_is_part_of_the_key(cache):
+    rows = history(K)
+    assert key_for(rows, budget=800) != key_for(rows, budget=3000)
@@ -0,0 +1,135 @@
+# tests/test_memory_index.py
+# BM25 倒排索引：斷詞、欄位權重、過濾條件，以及大索引的 threshold algorithm 與逐筆計分一致
+import random
+
+import pytest
+
+from tools import memory_index
+from tools.memory_index import MemoryIndex, tokenize
+
+TICKERS = ["NVDA", "TSM", "AMD", "AVGO", "ASML", "MU"]
+WORDS = ["物理瓶頸", "產能限制", "轉換成本", "估值過高", "液冷散熱", "先進封裝"]
+KEYWORDS = ["#HBM", "#CoWoS", "#液冷散熱", "#電力瓶頸", "#MFR壟斷"]
+
+
+def make_record(i, rng):
+    ticker = rng.choice(TICKERS)
+    return {
+        "ticker": ticker,
+        "timestamp": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} 09:00",
+        "rationale": f"{ticker} {rng.choice(WORDS)} 第 {i} 筆",
+        "keywords": " ".join(rng.sample(KEYWORDS, 2)),
+        "pacer_type": rng.choice("PACER"),
+        "full_analysis": " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 4))),
+    }
+
+
+def build(n, seed=0):
+    rng = random.Random(seed)
+    index = MemoryIndex()
+    for i in range(n):
+        index.add(i + 2, make_record(i, rng))
+    return index
+
+
+def exhaustive(index, query, k, **filters):
+    # 參考答案：所有命中文件逐筆計分後排序
+    ticker = filters.get("ticker")
+    norms = index._norms(len(index))
+    scores = index._score_all(set(tokenize(query)), norms, len(index))
+    accepted = [(r, s) for r, s in scores.items()
+                if index._accepts(r, ticker and ticker.upper(), filters.get("date_from"), None, None)]
+    return sorted(accepted, key=lambda item: (item[1], item[0]), reverse=True)[:k]
+
+
+# --- 1. 斷詞 ---
+def test_tokenize_words_and_cjk_bigrams():
+    assert tokenize("NVDA 液冷散熱 v1.2") == ["nvda", "v1.2", "液冷", "冷散", "散熱"]
+    assert tokenize("冷") == ["冷"]
+    assert tokenize(None) == []
+
+
+# --- 2. 排序與過濾 ---
+def test_ticker_field_outweighs_body_mention():
+    index = MemoryIndex()
+    index.add(2, {"ticker": "NVDA", "rationale": "GPU 供應"})
+    index.add(3, {"ticker": "AMD", "rationale": "對手", "full_analysis": "NVDA"})
+    assert [r for r, _ in index.search("NVDA")] == [2, 3]
+
+
+def test_filters_and_empty_query():
+    index = MemoryIndex()
+    index.add(2, {"ticker": "NVDA", "timestamp": "2025-01-05 10:00", "pacer_type": "P", "rationale": "瓶頸"})
+    index.add(3, {"ticker": "NVDA", "timestamp": "2025-03-01 10:00", "pacer_type": "A", "rationale": "瓶頸"})
+    index.add(4, {"ticker": "TSM", "timestamp": "2025-03-02 10:00", "pacer_type": "P", "rationale": "瓶頸"})
+    assert [r for r, _ in index.search("瓶頸", ticker="nvda")] == [3, 2]
+    assert [r for r, _ in index.search("瓶頸", date_from="2025-02-01")] == [4, 3]
+    assert [r for r, _ in index.search("瓶頸", pacer_type="p")] == [4, 2]
+    # 沒有查詢詞：只依過濾條件回傳最近的幾筆
+    assert index.search("", ticker="NVDA", k=1) == [(3, 0.0)]
+    assert index.search("") == []
+
+
+def test_readd_replaces_previous_terms():
+    index = MemoryIndex()
+    index.add(2, {"ticker": "NVDA", "rationale": "舊理由"})
+    index.add(2, {"ticker": "NVDA", "rationale": "新理由"})
+    assert index.search("舊理") == []
+    assert [r for r, _ in index.search("新理")] == [2]
+    assert len(index) == 1
+
+
+def test_add_body_merges_into_summary_document():
+    index = MemoryIndex()
+    index.add(2, {"ticker": "NVDA", "rationale": "摘要"})
+    assert index.missing_bodies == {2}
+    assert index.search("封裝") == []
+    index.add_body(2, "先進封裝產能")
+    assert index.missing_bodies == set()
+    assert [r for r, _ in index.search("封裝")] == [2]
+
+
+def test_documents_without_terms_do_not_divide_by_zero():
+    index = MemoryIndex()
+    index.add(2, {"ticker": ""})
+    index.add(3, {})
+    assert index.search("nvda") == []
+
+
+# --- 3. threshold algorithm (大索引) ---
+@pytest.fixture
+def small_limits(monkeypatch):
+    # 讓數百列的索引就走 threshold algorithm / fresh 重排的路徑
+    monkeypatch.setattr(memory_index, "EXHAUSTIVE_DOCS", 50)
+    monkeypatch.setattr(memory_index, "FRESH_LIMIT", 40)
+
+
+QUERIES = ["NVDA", "液冷散熱", "物理瓶頸 HBM", "tsm 估值過高", "CoWoS 先進封裝", "第 7 筆", "不存在"]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("k", [1, 5, 30])
+def test_top_k_matches_exhaustive_scoring(small_limits, query, k):
+    index = build(600)
+    for filters in ({}, {"date_from": "2025-06-01"}, {"ticker": "NVDA"}):
+        got = index.search(query, k=k, **filters)
+        want = exhaustive(index, query, k, **filters)
+        assert [r for r, _ in got] == [r for r, _ in want]
+        assert [s for _, s in got] == pytest.approx([s for _, s in want])
+
+
+def test_top_k_stays_exact_after_incremental_updates(small_limits):
+    index = build(600)
+    rng = random.Random(1)
+    for query in QUERIES:
+        index.search(query)     # 先建好排序表
+    for step in range(3):
+        for i in range(30):
+            row = 700 + step * 30 + i
+            index.add(row, make_record(row, rng))
+        for row in rng.sample(sorted(index.doc_len), 10):
+            index.add_body(row, "液冷散熱 先進封裝 NVDA")
+        for query in QUERIES:
+            got = index.search(query, k=5)
+            want = exhaustive(index, query, 5)
+            assert [r for r, _ in got] == [r for r, _ in want]
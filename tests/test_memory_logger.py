@@ -0,0 +1,57 @@
+# tests/test_memory_logger.py
+# 歸檔寫入：append 已經寫進 Sheet 才斷線時，重送前先查 Sheet，不會寫兩次
+import pytest
+
+from tools import memory_logger, sheets
+
+
+class LandThenDrop:
+    # append_rows 先寫入再丟出斷線 (回應在途中遺失)
+    def __init__(self, drops=1):
+        self.rows = []
+        self.drops = drops
+        self.appends = 0
+
+    def append_rows(self, rows, **kwargs):
+        self.appends += 1
+        self.rows.extend(rows)
+        if self.drops:
+            self.drops -= 1
+            raise ConnectionResetError("connection reset after write")
+        return {"updates": {"updatedRange": f"Sheet1!A{len(self.rows) - len(rows) + 1}:K{len(self.rows)}"}}
+
+    def get_values(self, range_name):
+        return [row[:5] for row in self.rows]
+
+
+@pytest.fixture
+def worksheet(monkeypatch):
+    ws = LandThenDrop()
+    sheets.install(ws)
+    monkeypatch.setattr(memory_logger, "_verify_next", False)
+    yield ws
+    sheets.install(None)
+
+
+def row(n):
+    return [f"20260101-T{n}", "2026-01-01 09:00", f"T{n}", "Buy", f"理由 {n}", 50, "Market", "", "", "P", "全文"]
+
+
+def test_retry_after_dropped_append_does_not_duplicate(worksheet):
+    batch = [row(0), row(1)]
+    with pytest.raises(ConnectionResetError):
+        memory_logger._flush_rows(batch)
+    memory_logger._flush_rows(batch)       # spool 的重試
+    assert worksheet.rows == batch
+    assert worksheet.appends == 1
+
+
+def test_retry_sends_only_rows_that_did_not_land(worksheet):
+    with pytest.raises(ConnectionResetError):
+        memory_logger._flush_rows([row(0)])
+    memory_logger._flush_rows([row(0), row(1)])
+    assert worksheet.rows == [row(0), row(1)]
+    # 確認過後不再每批都讀 Sheet
+    memory_logger._flush_rows([row(2)])
+    assert worksheet.rows[-1] == row(2)
+    assert memory_logger._verify_next is False
@@ -0,0 +1,62 @@
+# tests/test_price_store.py
+# 本地價格存放區：存還原權值後的收盤價；增量更新遇到分割 (還原因子改變) 時改抓完整歷史
+import pandas as pd
+import pytest
+
+from tools import market_data, price_store
+
+
+class SplitYF:
+    # 假 yfinance：split_on 之後的日期股價除以 ratio，還原價 (Adj Close) 把之前的價格也一起除掉
+    def __init__(self, days, ratio=10.0):
+        self.dates = pd.bdate_range("2026-01-05", periods=days)
+        self.visible = days - 5        # 目前「已經發生」到第幾天
+        self.ratio = ratio
+        self.split_on = None
+        self.calls = []
+
+    def download(self, tickers, start=None, period=None, **kwargs):
+        self.calls.append(start)
+        dates = self.dates[:self.visible]
+        if start is not None:
+            dates = dates[dates >= pd.Timestamp(start)]
+        raw = pd.Series(100.0, index=dates)
+        adj = raw.copy()
+        if self.split_on is not None:
+            raw[dates >= self.split_on] /= self.ratio
+            adj /= self.ratio
+        symbols = [tickers] if isinstance(tickers, str) else list(tickers)
+        return pd.concat({"Close": pd.DataFrame({s: raw for s in symbols}),
+                          "Adj Close": pd.DataFrame({s: adj for s in symbols})}, axis=1)
+
+
+@pytest.fixture
+def fake_yf(tmp_path, monkeypatch):
+    yf = SplitYF(days=30)
+    monkeypatch.setattr(price_store, "PRICE_DIR", str(tmp_path / "prices"))
+    monkeypatch.setattr(price_store, "_checked", {})
+    monkeypatch.setattr(price_store, "_frames", {})
+    monkeypatch.setattr(market_data, "yf", yf)
+    return yf
+
+
+def test_incremental_refresh_appends_only_new_dates(fake_yf):
+    price_store.refresh(["ABC"], force=True)
+    assert len(price_store.load("ABC")) == 25
+    fake_yf.visible = 27
+    assert price_store.refresh(["ABC"], force=True) == {"ABC": 2}
+    assert fake_yf.calls[-1] == price_store.load("ABC").index[-4]   # 從倒數第二筆 (已收盤) 起補
+    assert len(price_store.load("ABC")) == 27
+
+
+def test_split_triggers_full_redownload_without_fake_crash(fake_yf):
+    price_store.refresh(["ABC"], force=True)
+    fake_yf.visible = 28
+    fake_yf.split_on = fake_yf.dates[26]     # 10:1 分割發生在增量更新的範圍內
+    price_store.refresh(["ABC"], force=True)
+
+    closes = price_store.load("ABC")
+    assert len(closes) == 28
+    assert fake_yf.calls[-1] is None         # 重新下載完整歷史
+    assert closes.pct_change().abs().max() < 1e-9     # 沒有 -90% 的假暴跌
+    assert closes.iloc[0] == pytest.approx(10.0)
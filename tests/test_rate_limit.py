@@ -0,0 +1,142 @@
+# tests/test_rate_limit.py
+# Token bucket 的配額換算、429 / 5xx 的退避重試，以及串流請求的並行名額
+import pytest
+
+from tools import rate_limit
+from tools.rate_limit import Service, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limit.time, "sleep", clock.sleep)
+    monkeypatch.setattr(rate_limit.random, "uniform", lambda a, b: b)
+    return clock
+
+
+class HttpError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+# --- 1. Token bucket ---
+def test_bucket_allows_burst_then_paces_at_rate(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)      # 每秒 2 個，瞬間最多 3 個
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+    clock.now += 10     # 補滿但不超過容量
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() > 0
+
+
+def test_bucket_pause_blocks_and_drops_burst(clock):
+    bucket = TokenBucket(rate=1.0, capacity=5)
+    bucket.pause(4.0)
+    # 桶子原本是滿的，暫停後仍要等到暫停結束
+    assert bucket.reserve() == pytest.approx(4.0)
+    assert bucket.reserve() == pytest.approx(4.0)
+    clock.now += 4.0
+    assert bucket.reserve() == 0.0
+
+
+# --- 2. 重試 ---
+def test_retryable_errors_back_off_then_succeed(clock):
+    service = Service("test", rpm=6000, burst=10, concurrency=2)
+    errors = [HttpError(429), HttpError(503)]
+
+    def fn():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert service.call(fn) == "ok"
+    assert service.stats["retries"] == 2
+    assert service.stats["throttled"] == 2
+    assert service.concurrency.active == 0
+    assert clock.slept == [1.0, 2.0]        # 指數退避
+
+
+def test_adaptive_limit_halves_on_throttle_and_recovers():
+    limit = rate_limit.AdaptiveLimit(8)
+    for _ in range(2):
+        limit.acquire()
+        limit.release(throttled=True)
+    assert limit.limit == 2.0
+    for _ in range(100):
+        limit.acquire()
+        limit.release()
+    assert limit.limit == 8.0       # 成功一次加回 1/limit，上限為配額
+
+
+def test_non_retryable_error_raises_immediately(clock):
+    service = Service("test", rpm=6000, burst=10)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise HttpError(400)
+
+    with pytest.raises(HttpError):
+        service.call(fn)
+    assert len(calls) == 1
+    assert service.stats["failures"] == 1
+
+
+def test_gives_up_after_max_retries(clock):
+    service = Service("test", rpm=6000, burst=10)
+    with pytest.raises(HttpError):
+        service.call(lambda: (_ for _ in ()).throw(HttpError(503)))
+    assert service.stats["retries"] == rate_limit.MAX_RETRIES
+
+
+# --- 3. 串流 ---
+def test_stream_holds_slot_until_consumed_and_retries_first_chunk(clock):
+    service = Service("test", rpm=6000, burst=10, concurrency=2)
+    attempts = []
+
+    def fn(stream=False):
+        attempts.append(1)
+
+        def chunks():
+            if len(attempts) == 1:
+                raise HttpError(503)    # 第一個 chunk 之前失敗：仍可重試
+            yield "a"
+            yield "b"
+        return chunks()
+
+    stream = service.call(fn, stream=True)
+    assert service.concurrency.active == 1
+    assert list(stream) == ["a", "b"]
+    assert len(attempts) == 2
+    assert service.concurrency.active == 0
+
+
+def test_stream_error_after_first_chunk_releases_slot(clock):
+    service = Service("test", rpm=6000, burst=10, concurrency=2)
+
+    def fn(stream=False):
+        yield "a"
+        raise HttpError(500)
+
+    stream = service.call(fn, stream=True)
+    assert next(stream) == "a"
+    with pytest.raises(HttpError):
+        next(stream)
+    assert service.concurrency.active == 0
+    assert service.stats["failures"] == 1
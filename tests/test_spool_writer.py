@@ -0,0 +1,147 @@
+# tests/test_spool_writer.py
+# 寫入佇列：重啟後從 offset 重播尚未送出的列、略過寫到一半的殘行，送完後清空 spool；
+# 永久性錯誤移到 dead-letter、多個行程共用資料夾時各自持有 spool
+import json
+import threading
+
+import pytest
+
+from tools import spool_writer
+from tools.spool_writer import SpoolWriter
+
+
+class Sink:
+    def __init__(self, fail_times=0):
+        self.rows = []
+        self.calls = 0
+        self.fail_times = fail_times
+        self.lock = threading.Lock()
+
+    def __call__(self, rows):
+        with self.lock:
+            self.calls += 1
+            if self.fail_times:
+                self.fail_times -= 1
+                raise ConnectionError("network down")
+            if any(row.get("bad") for row in rows):
+                raise ValueError("invalid row")
+            self.rows.extend(rows)
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(spool_writer, "BACKOFF_BASE", 0.01)
+
+
+def write_spool(path, rows, tail=b""):
+    with open(path, "wb") as f:
+        for row in rows:
+            f.write((json.dumps(row) + "\n").encode("utf-8"))
+        f.write(tail)
+
+
+def test_replays_rows_after_saved_offset(tmp_path):
+    path = str(tmp_path / "spool.jsonl")
+    write_spool(path, [{"n": 0}, {"n": 1}, {"n": 2}])
+    with open(path, "rb") as f:
+        first_line = len(f.readline())
+    with open(path + ".offset", "w") as f:
+        f.write(str(first_line))    # 第 0 列上次已經送出
+
+    sink = Sink()
+    writer = SpoolWriter(path, sink)
+    assert writer.flush(timeout=5)
+    assert sink.rows == [{"n": 1}, {"n": 2}]
+
+
+def test_partial_trailing_line_is_not_replayed(tmp_path):
+    path = str(tmp_path / "spool.jsonl")
+    write_spool(path, [{"n": 0}], tail=b'{"n": 1')
+    sink = Sink()
+    writer = SpoolWriter(path, sink)
+    assert writer.flush(timeout=5)
+    assert sink.rows == [{"n": 0}]
+
+
+def test_enqueue_after_torn_line_is_not_lost(tmp_path):
+    path = str(tmp_path / "spool.jsonl")
+    write_spool(path, [{"n": 0}], tail=b'{"n": 1')
+    # 重啟後送出仍失敗，新的一筆只留在 spool 檔
+    down = SpoolWriter(path, Sink(fail_times=10 ** 6))
+    down.enqueue({"n": 2})
+    down.close()
+    # 再重啟：從檔案重播，新的一筆不能因為接在殘行後面而遺失
+    sink = Sink()
+    writer = SpoolWriter(path, sink)
+    assert writer.flush(timeout=5)
+    assert sink.rows == [{"n": 0}, {"n": 2}]
+
+
+def test_enqueue_survives_restart_before_flush(tmp_path):
+    path = str(tmp_path / "spool.jsonl")
+    # 第一個行程：送出一直失敗，資料只留在 spool
+    down = Sink(fail_times=10 ** 6)
+    first = SpoolWriter(path, down)
+    first.enqueue({"n": 0})
+    first.close()
+    # 重啟：新的行程重播同一筆
+    sink = Sink()
+    writer = SpoolWriter(path, sink)
+    assert writer.flush(timeout=5)
+    assert {"n": 0} in sink.rows
+
+
+def test_transient_failure_is_retried_and_spool_compacted(tmp_path):
+    path = str(tmp_path / "spool.jsonl")
+    sink = Sink(fail_times=2)
+    writer = SpoolWriter(path, sink, batch_size=2)
+    for n in range(5):
+        writer.enqueue({"n": n})
+    assert writer.flush(timeout=5)
+    assert sink.rows == [{"n": n} for n in range(5)]
+    assert writer.get_stats()["failures"] == 2
+    with open(path, "rb") as f:
+        assert f.read() == b""
+
+
+def test_permanent_error_moves_only_poisoned_row_to_dead_letter(tmp_path):
+    path = str(tmp_path / "spool.jsonl")
+    sink = Sink()
+    writer = SpoolWriter(path, sink, batch_size=10)
+    for n in range(4):
+        writer.enqueue({"n": n, "bad": n == 2})
+    assert writer.flush(timeout=5)
+    assert [row["n"] for row in sink.rows] == [0, 1, 3]
+    assert writer.get_stats()["dead_lettered"] == 1
+    with open(writer.dead_path, encoding="utf-8") as f:
+        dead = [json.loads(line) for line in f]
+    assert [d["row"]["n"] for d in dead] == [2]
+    assert "ValueError" in dead[0]["error"]
+
+
+def test_writers_sharing_a_directory_use_separate_spools(tmp_path):
+    path = str(tmp_path / "spool.jsonl")
+    first_sink, second_sink = Sink(fail_times=10 ** 6), Sink()
+    first = SpoolWriter(path, first_sink)
+    first.enqueue({"n": 0})
+    second = SpoolWriter(path, second_sink)
+    assert second.spool_path != first.spool_path
+    second.enqueue({"n": 1})
+    assert second.flush(timeout=5)
+    # 第二個行程不會重播第一個行程 (仍在執行) 的資料
+    assert second_sink.rows == [{"n": 1}]
+    first.close()
+    second.close()
+
+
+def test_orphaned_spool_is_adopted(tmp_path):
+    path = str(tmp_path / "spool.jsonl")
+    orphan = str(tmp_path / "spool.2.jsonl")
+    write_spool(orphan, [{"n": 0}, {"n": 1}])
+    sink = Sink()
+    writer = SpoolWriter(path, sink)
+    assert writer.flush(timeout=5)
+    assert sink.rows == [{"n": 0}, {"n": 1}]
+    with open(orphan, "rb") as f:
+        assert f.read() == b""
+    writer.close()
@@ -0,0 +1,100 @@
+# tests/test_structured.py
+# 結構化輸出：schema 驗證、截斷 JSON 的欄位救回、只重新要壞掉的欄位
+import json
+
+import pytest
+
+from tools import structured
+
+
+def good_result(**overrides):
+    result = {
+        "decision": "Buy",
+        "pacer_type": "P",
+        "target_price": "120",
+        "risk_score": "35",
+        "rationale": "庫存去化接近尾聲",
+        "keywords": "AI, 液冷",
+        "cycle_coords": {"L1_Inventory": "Restocking", "L2_CapEx": "Expansion",
+                         "L3_Liquidity": "Easing", "L4_Tech": "Deployment"},
+        "ari_signals": {"status": "Green (Safe)", "main_threat": "無"},
+        "full_analysis": "完整分析",
+    }
+    result.update(overrides)
+    return result
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def test_valid_result_has_no_broken_fields():
+    assert structured.validate(good_result()) == []
+
+
+@pytest.mark.parametrize("field, value", [
+    ("decision", "Hold"),                                   # 不在 enum
+    ("risk_score", "150"),                                  # 超出 0-100
+    ("risk_score", "高"),
+    ("keywords", ["AI"]),                                   # 型別錯誤
+    ("cycle_coords", {"L1_Inventory": "Restocking"}),       # 巢狀必填缺漏
+])
+def test_invalid_field_is_reported(field, value):
+    assert structured.validate(good_result(**{field: value})) == [field]
+
+
+def test_missing_required_field_is_reported_but_optional_is_not():
+    result = good_result()
+    del result["rationale"]
+    assert structured.validate(result) == ["rationale"]
+    assert "ranking" not in structured.validate(good_result())
+
+
+def test_salvage_complete_json():
+    result, ok = structured.salvage(json.dumps(good_result(), ensure_ascii=False))
+    assert ok
+    assert result == good_result()
+
+
+def test_salvage_truncated_json_keeps_complete_fields_and_partial_analysis():
+    raw = '```json\n{"decision": "Sell", "pacer_type": "R", "full_analysis": "第一段分析，還沒寫完'
+    result, ok = structured.salvage(raw)
+    assert not ok
+    assert result["decision"] == "Sell"
+    assert result["pacer_type"] == "R"
+    assert result["full_analysis"].startswith("第一段分析")
+
+
+def test_complete_result_without_model_marks_unparseable_decision_as_error():
+    result = structured.complete_result("not json at all")
+    assert result["decision"] == "Error"
+    assert result["full_analysis"] == "not json at all"
+
+
+def test_complete_result_repairs_only_broken_fields(monkeypatch):
+    prompts = []
+
+    def fake_generate(model, prompt, fallback=None, schema=None):
+        prompts.append((prompt, schema))
+        return FakeResponse(json.dumps({"decision": "Watch", "risk_score": "40"}))
+
+    monkeypatch.setattr(structured, "generate", fake_generate)
+    raw = json.dumps(good_result(decision="Hold", risk_score="999"), ensure_ascii=False)
+    result = structured.complete_result(raw, model=object())
+
+    assert result["decision"] == "Watch"
+    assert result["risk_score"] == "40"
+    assert result["rationale"] == "庫存去化接近尾聲"
+    assert len(prompts) == 1
+    assert prompts[0][1]["required"] == ["decision", "risk_score"]
+
+
+def test_failed_repair_falls_back_to_error_decision(monkeypatch):
+    def failing_generate(model, prompt, fallback=None, schema=None):
+        raise RuntimeError("quota exhausted")
+
+    monkeypatch.setattr(structured, "generate", failing_generate)
+    result = structured.complete_result(json.dumps(good_result(decision="Hold")), model=object())
+    assert result["decision"] == "Error"
+    assert result["rationale"] == "庫存去化接近尾聲"
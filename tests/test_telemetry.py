@@ -0,0 +1,42 @@
+# tests/test_telemetry.py
+# metrics JSONL：從檔尾讀最近 window 筆、超過大小上限輪替、輪替後從舊檔補足
+import json
+
+from tools import telemetry
+
+
+def write_rows(path, start, stop, tail=""):
+    with open(path, "a", encoding="utf-8") as f:
+        for n in range(start, stop):
+            f.write(json.dumps({"stage": "s", "seconds": n}) + "\n")
+        f.write(tail)
+
+
+def test_tail_reads_only_last_window_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "TAIL_BLOCK", 64)     # 強迫跨多個區塊往回讀
+    path = str(tmp_path / "metrics.jsonl")
+    write_rows(path, 0, 500, tail='{"stage": "s", "sec')
+    rows = telemetry._tail(path, 10)
+    assert [r["seconds"] for r in rows] == list(range(491, 500))   # 殘行被略過
+
+
+def test_tail_fills_from_rotated_file(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    write_rows(path + ".1", 0, 5)
+    write_rows(path, 5, 8)
+    assert [r["seconds"] for r in telemetry._tail(path, 6)] == [2, 3, 4, 5, 6, 7]
+    assert telemetry._tail(str(tmp_path / "missing.jsonl"), 6) == []
+
+
+def test_trace_write_rotates_large_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "METRICS_MAX_BYTES", 100)
+    path = str(tmp_path / "metrics.jsonl")
+    write_rows(path, 0, 10)
+    trace = telemetry.start_trace("協議 F")
+    with telemetry.span("fetch"):
+        pass
+    trace.finish(path=path)
+    with open(path + ".1", encoding="utf-8") as f:
+        assert len(f.readlines()) == 10
+    stages = [r["stage"] for r in telemetry._tail(path, 2)]
+    assert stages == ["fetch", "total"]
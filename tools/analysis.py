@@ -0,0 +1,113 @@
+# tools/analysis.py
+# 推演流程的共用零件：Dashboard 與批次執行 (batch_runner) 共用同一套
+# prompt 組裝、Gemini 呼叫 (結構化輸出)、JSON 解析與歸檔格式。
+import datetime
+import json
+import os
+
+from prompts import RESPONSE_SCHEMA, SYSTEM_PROMPT
+
+try:
+    from tools import hedging, rate_limit
+    from tools.context_builder import estimate_tokens
+except ImportError:
+    import hedging, rate_limit  # 直接在 tools 資料夾執行
+    from context_builder import estimate_tokens
+
+MODEL_NAME = 'gemini-3-flash-preview'
+# 對沖請求改送的備援模型 (未設定時對沖送回同一個模型)
+FALLBACK_MODEL_NAME = os.environ.get("SYSTEM_V14_FALLBACK_MODEL")
+
+PROTOCOL_SCOUT = "協議 F: 個股偵察 (Scout)"
+
+
+# --- 1. Gemini 模型 ---
+def get_api_key():
+    # 環境變數優先 (批次 / 排程)，其次 .streamlit/secrets.toml
+    if os.environ.get("GOOGLE_API_KEY"):
+        return os.environ["GOOGLE_API_KEY"]
+    try:
+        import streamlit as st
+        return st.secrets.get("GOOGLE_API_KEY")
+    except Exception:
+        return None
+
+
+def get_model(model_name=MODEL_NAME):
+    import google.generativeai as genai
+    api_key = get_api_key()
+    if not api_key:
+        raise RuntimeError("找不到 GOOGLE_API_KEY (環境變數或 .streamlit/secrets.toml)")
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+
+def generate(model, prompt, fallback=None, deadline=None, schema=RESPONSE_SCHEMA, **kwargs):
+    # 所有 Gemini 呼叫：外層對沖 (tools/hedging.py，慢了就加送備援請求，有硬性期限)，
+    # 每一個實際送出的請求再各自經過共用限流 (RPM / TPM 配額、429 / 5xx 退避重試)
+    # schema: 要求模型直接輸出符合 schema 的 JSON (response_schema)；None 表示自由文字
+    tokens = estimate_tokens(prompt)
+    if schema is not None:
+        kwargs["generation_config"] = {"response_mime_type": "application/json", "response_schema": schema}
+
+    def attempt(target, timeout):
+        return rate_limit.call(
+            "gemini", target.generate_content, prompt, tokens=tokens, request_options={"timeout": timeout}, **kwargs
+        )
+
+    hedger = hedging.get_hedger("stream" if kwargs.get("stream") else "full")
+    return hedger.run(attempt, model, fallback, deadline)
+
+
+# --- 2. Prompt 組裝 ---
+def scout_input(ticker):
+    return f"分析個股 {ticker}。請評估其物理層瓶頸、護城河與當前估值。"
+
+
+def build_prompt(user_input, ticker_data=None, memory_context="[]"):
+    # memory_context: context_builder.build_memory_context 產生、已控制在 token 預算內的記憶區塊
+    # 將基本面資料加入 Prompt 增強 AI 判斷
+    fundamental_context = ""
+    if ticker_data:
+        fundamental_context = f"""
+                【即時市場數據】
+                - 現價: {ticker_data.get('price')}
+                - 市值: {ticker_data.get('market_cap')}
+                - 產業: {ticker_data.get('sector')}
+                """
+
+    return f"{SYSTEM_PROMPT}\n\n{fundamental_context}\n\n【歷史記憶】{memory_context}\n【指揮官指令】{user_input}"
+
+
+def token_usage(prompt, raw_text, response=None):
+    # (tokens_in, tokens_out)：優先用 API 回傳的 usage_metadata (串流時在最後一個 chunk)，沒有就估算
+    usage = getattr(response, "usage_metadata", None)
+    tokens_in = getattr(usage, "prompt_token_count", None)
+    tokens_out = getattr(usage, "candidates_token_count", None)
+    return (tokens_in or estimate_tokens(prompt), tokens_out or estimate_tokens(raw_text))
+
+
+# --- 3. 回應解析 ---
+def extract_json(raw_text, model=None, fallback=None, schema=RESPONSE_SCHEMA):
+    # 解析 + schema 驗證；有 model 時只把缺漏 / 格式錯誤的欄位再要一次 (tools/structured.py)
+    # 決策欄位仍救不回來時回傳 decision="Error"
+    try:
+        from tools import structured
+    except ImportError:
+        import structured  # 直接在 tools 資料夾執行
+    return structured.complete_result(raw_text, model, fallback, schema)
+
+
+# --- 4. 歸檔格式 ---
+def build_log_payload(ticker, ai_result):
+    return json.dumps({
+        "log_id": f"{datetime.datetime.now().strftime('%Y%m%d')}-{ticker}",
+        "ticker": ticker,
+        "decision": ai_result.get("decision"),
+        "rationale": ai_result.get("rationale"),
+        "keywords": ai_result.get("keywords"),
+        "pacer_type": ai_result.get("pacer_type"),
+        "risk_score": ai_result.get("risk_score"),
+        "entry_price": ai_result.get("target_price"),
+        "full_analysis": ai_result.get("full_analysis", "N/A")
+    })
@@ -0,0 +1,145 @@
+# tools/backtest.py
+# 決策回測：把記憶庫中的每一筆決策，與之後的實際股價比對
+# - 決策當日 (或之後第一個交易日) 的收盤價為基準，計算 5 / 20 / 60 / 250 個交易日後的報酬
+# - 依決策類別、PACER 型態、ARI 風險分數區間統計平均報酬與命中率
+# 全部以 NumPy / pandas 向量化完成 (searchsorted + fancy indexing)，沒有逐筆迴圈。
+#
+#   python -m tools.backtest [--no-refresh]
+import numpy as np
+import pandas as pd
+
+try:
+    from tools import memory_mirror, price_store, sheets
+except ImportError:
+    import memory_mirror, price_store, sheets  # 直接在 tools 資料夾執行
+
+HORIZONS = [5, 20, 60, 250]    # 交易日
+ARI_BINS = [-np.inf, 30, 60, 80, np.inf]
+ARI_LABELS = ["低 (<30)", "中 (30-60)", "高 (60-80)", "極高 (≥80)"]
+
+# 決策文字 -> 類別與方向 (+1 做多 / -1 做空或避險 / 0 觀望)；依序比對，先符合者優先
+DECISION_CLASSES = [
+    ("Strong Buy", r"strong\s*buy|強力買進", 1),
+    ("Buy", r"buy|買", 1),
+    ("Risk Off", r"risk\s*off|避險", -1),
+    ("Sell", r"sell|賣", -1),
+    ("Watch", r"watch|hold|觀望|持有", 0),
+]
+
+
+# --- 1. 決策資料 ---
+def load_decisions(records=None):
+    # 記憶庫 (本地鏡像) -> DataFrame；排除無法對應到股價的列 (宏觀 / 趨勢 / 測試)
+    records = memory_mirror.load_records() if records is None else records
+    df = pd.DataFrame(records, columns=memory_mirror.SUMMARY_COLUMNS).drop(columns=["rationale"])
+    df["date"] = pd.to_datetime(df["timestamp"], errors="coerce").dt.normalize()
+    df["ticker"] = df["ticker"].astype(str).str.strip().str.upper()
+    df["risk_score"] = pd.to_numeric(df["risk_score"], errors="coerce")
+    df["pacer_type"] = df["pacer_type"].astype(str).str.strip().str.upper().str[:1].replace("", "?")
+
+    text = df["decision"].astype(str).str.lower()
+    matches = [text.str.contains(pattern, regex=True) for _, pattern, _ in DECISION_CLASSES]
+    df["decision_class"] = np.select(matches, [name for name, _, _ in DECISION_CLASSES], "Other")
+    df["direction"] = np.select(matches, [d for _, _, d in DECISION_CLASSES], 0)
+    df["ari_bucket"] = pd.cut(df["risk_score"], ARI_BINS, labels=ARI_LABELS, right=False)
+
+    valid = df["date"].notna() & df["ticker"].str.fullmatch(r"[A-Z0-9^][A-Z0-9.\-=^]{0,11}")
+    return df[valid & ~df["ticker"].isin(["MACRO_ARI", "TREND", "SYSTEM_CHECK", "N/A"])].reset_index(drop=True)
+
+
+# --- 2. 向量化前瞻報酬 ---
+def forward_returns(decisions, closes, horizons=HORIZONS, max_gap_days=7):
+    # closes: 長表 (symbol, date, close)，依代號、日期排序 (price_store.load_long)；
+    # 每檔只用自己的交易日計算 h 日後報酬
+    out = decisions.copy()
+    direction = out["direction"].to_numpy()
+    if closes.empty:
+        out["base_date"], out["base_price"] = pd.NaT, np.nan
+        for h in horizons:
+            out[f"ret_{h}d"], out[f"hit_{h}d"] = np.nan, np.nan
+        return out
+
+    # 代號編碼 × 日期合成排序鍵，一次 searchsorted 找到每筆決策的基準列
+    codes = closes["symbol"].cat.codes.to_numpy().astype(np.int64)
+    uniques = closes["symbol"].cat.categories
+    dates = closes["date"].to_numpy(dtype="datetime64[ns]")
+    days = dates.astype("datetime64[D]").astype(np.int64)
+    origin, width = days.min(), days.max() - days.min() + 1
+    keys = codes * width + (days - origin)
+    prices = closes["close"].to_numpy(dtype=float)
+    seg_end = np.searchsorted(codes, np.arange(len(uniques)), side="right")   # 各代號區段結尾 (不含)
+
+    code = uniques.get_indexer(out["ticker"])
+    day = out["date"].to_numpy(dtype="datetime64[D]").astype(np.int64) - origin
+    known = code >= 0
+    code = np.where(known, code, 0)
+    base = np.searchsorted(keys, code * width + np.clip(day, 0, width))
+    end = seg_end[code]
+    known &= base < end
+    base = np.where(known, base, 0)
+    # 基準日必須在決策後幾天內 (決策早於價格歷史起點、或停牌太久的不算)
+    known &= (days[base] - origin - day) <= max_gap_days
+
+    base_price = np.where(known, prices[base], np.nan)
+    out["base_date"] = pd.Series(dates[base], index=out.index).where(known)
+    out["base_price"] = base_price
+    for h in horizons:
+        ok = known & (base + h < end)
+        ret = np.where(ok, prices[np.where(ok, base + h, 0)], np.nan) / base_price - 1
+        out[f"ret_{h}d"] = ret
+        # 命中：方向與報酬同號 (觀望不計)
+        out[f"hit_{h}d"] = np.where(np.isnan(ret) | (direction == 0), np.nan, np.sign(ret) == direction)
+    return out
+
+
+# --- 3. 分組統計 ---
+def summarize(trades, by, horizons=HORIZONS):
+    agg = {"n": ("ticker", "size")}
+    for h in horizons:
+        agg[f"avg_ret_{h}d"] = (f"ret_{h}d", "mean")
+        agg[f"hit_rate_{h}d"] = (f"hit_{h}d", "mean")
+        agg[f"n_{h}d"] = (f"ret_{h}d", "count")
+    table = trades.groupby(by, observed=True, dropna=False).agg(**agg)
+    return table.sort_values("n", ascending=False).round(4)
+
+
+def run_backtest(refresh_prices=True, records=None, horizons=HORIZONS):
+    # 回傳 {"trades", "by_decision", "by_pacer", "by_ari", "coverage"}
+    if records is None:
+        # 先把記憶鏡像同步到最新 (增量)，失敗時用本地資料
+        try:
+            sheets.run(lambda: memory_mirror.sync(sheets.get_worksheet))
+        except Exception as e:
+            print(f"⚠️ 記憶鏡像同步失敗，改用本地資料: {e}")
+    decisions = load_decisions(records)
+    tickers = sorted(decisions["ticker"].unique())
+    if refresh_prices and tickers:
+        price_store.refresh(tickers)
+    closes = price_store.load_long(tickers)
+    trades = forward_returns(decisions, closes, horizons)
+    return {
+        "trades": trades,
+        "by_decision": summarize(trades, "decision_class", horizons),
+        "by_pacer": summarize(trades, "pacer_type", horizons),
+        "by_ari": summarize(trades, "ari_bucket", horizons),
+        "coverage": {
+            "decisions": len(decisions),
+            "tickers": len(tickers),
+            "priced": int(trades["base_price"].notna().sum()),
+        },
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="System v14 決策回測")
+    parser.add_argument("--no-refresh", action="store_true", help="不更新價格，只用本地資料")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    result = run_backtest(refresh_prices=not args.no_refresh)
+    print(f"📈 回測完成 ({time.perf_counter() - t0:.2f}s): {result['coverage']}")
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        for name in ("by_decision", "by_pacer", "by_ari"):
+            print(f"\n[{name}]\n{result[name]}")
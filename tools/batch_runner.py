@@ -0,0 +1,308 @@
+# tools/batch_runner.py
+# 無介面的批次推演：對觀察清單逐檔執行協議 F (個股偵察)
+# 共用 Dashboard 的 prompt 組裝、記憶檢索、Gemini 呼叫、JSON 提取與歸檔。
+#
+#   python -m tools.batch_runner watchlist.txt --out data/scout_results.jsonl
+#
+# - 並行數量有上限 (--concurrency)，每檔有逾時 (--timeout)
+# - 結果逐筆寫入 JSONL，同時作為 checkpoint：重跑時略過已成功的代號
+#   重跑失敗的代號會再附加一筆，匯出 / 摘要只取每個代號最後一筆；先前已歸檔過的代號重跑時不再歸檔
+# - 結束時輸出吞吐量 (檔/分鐘) 與各階段 p50 / p95 延遲
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from tools import hedging, rate_limit, structured, telemetry
+from tools.analysis import (
+    PROTOCOL_SCOUT, FALLBACK_MODEL_NAME, get_model, generate, scout_input, build_prompt, extract_json,
+    build_log_payload, token_usage,
+)
+from tools.llm_cache import get_cache as get_llm_cache, make_key as make_cache_key, memory_candidates
+from tools.context_builder import DEFAULT_BUDGET, MEMORY_CANDIDATES, KEEP_ANALYSIS_FOR, build_memory_context
+from tools.market_data import get_stock_info
+from tools.memory_logger import log_decision, get_writer
+from tools.pipeline import StagePipeline
+from tools.telemetry import percentile
+from tools.smart_search import cached_search
+from prompts import SYSTEM_PROMPT
+
+STAGES = ["memory", "quote", "llm", "parse", "archive", "total"]
+
+
+# --- 1. 觀察清單 / Checkpoint ---
+def load_watchlist(path):
+    # 一行一個代號，可用逗號分隔；# 之後為註解
+    tickers = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            for item in line.split("#")[0].replace(",", " ").split():
+                item = item.strip().upper()
+                if item and item not in tickers:
+                    tickers.append(item)
+    return tickers
+
+
+def read_results(out_path):
+    # 逐筆讀出結果 JSONL
+    if not os.path.exists(out_path):
+        return
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # 上次中斷時寫到一半的殘行
+
+
+def load_checkpoint(out_path):
+    # 已成功完成的代號 (output JSONL 即 checkpoint)
+    return {record["ticker"] for record in read_results(out_path) if record.get("status") == "ok"}
+
+
+def load_archived(out_path):
+    # 先前任何一次執行已寫入記憶庫的代號 (例如 parse_error 也會歸檔)，重跑時不再歸檔
+    return {record["ticker"] for record in read_results(out_path) if record.get("archived")}
+
+
+def latest_results(out_path):
+    # 每個代號只留最後一筆 (依最後寫入的順序)
+    latest = {}
+    for record in read_results(out_path):
+        latest.pop(record.get("ticker"), None)
+        latest[record.get("ticker")] = record
+    return list(latest.values())
+
+
+class ResultWriter:
+    def __init__(self, out_path):
+        self.out_path = out_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.out_path, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class Deadline:
+    # 單檔的逾時狀態：批次端判定逾時 (expire) 與執行緒開始歸檔 (commit) 互斥
+    # 逾時後執行緒仍可能跑完 (Python 執行緒無法中斷)，但不再歸檔；下次重跑時才不會重複寫入記憶庫
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = None   # None / "committed" / "expired"
+
+    def commit(self):
+        with self._lock:
+            if self.state == "expired":
+                return False
+            self.state = "committed"
+            return True
+
+    def expire(self):
+        # 已經在歸檔的就不判逾時，等它寫完結果
+        with self._lock:
+            if self.state == "committed":
+                return False
+            self.state = "expired"
+            return True
+
+
+# --- 2. 單檔推演 (與 Dashboard 相同流程) ---
+def run_ticker(ticker, model, timeout, archive=True, force_fresh=False, memory_budget=DEFAULT_BUDGET, fallback=None,
+               deadline=None):
+    # 每檔一個 trace，各階段 span 附加到 data/metrics.jsonl
+    # deadline: Deadline；批次端已判定逾時就略過歸檔
+    trace = telemetry.start_trace(PROTOCOL_SCOUT, ticker)
+    pipeline = StagePipeline(max_workers=2)
+    try:
+        pipeline.submit("memory", cached_search, ticker, k=memory_candidates(ticker, MEMORY_CANDIDATES), bodies=KEEP_ANALYSIS_FOR)
+        pipeline.submit("quote", get_stock_info, ticker)
+        memory_hits = pipeline.result("memory", timeout=timeout)
+        memory_records = memory_hits[:MEMORY_CANDIDATES]   # 多取的列只給快取 key 用
+        ticker_data = pipeline.result("quote", timeout=timeout)
+
+        user_input = scout_input(ticker)
+        memory_context, context_stats = build_memory_context(memory_records, budget=memory_budget)
+        full_prompt = build_prompt(user_input, ticker_data, memory_context)
+
+        llm_cache = get_llm_cache()
+        cache_key = make_cache_key(SYSTEM_PROMPT, PROTOCOL_SCOUT, ticker, ticker_data, memory_hits, user_input,
+                                   memory_budget=memory_budget, k=MEMORY_CANDIDATES)
+        ai_result = None if force_fresh else llm_cache.get(cache_key)
+        cache_hit = ai_result is not None
+
+        if not cache_hit:
+            with pipeline.stage("llm", bytes_out=telemetry.payload_bytes(full_prompt)) as span:
+                response = generate(model, full_prompt, fallback=fallback, deadline=timeout)
+                raw_text = response.text
+                tokens_in, tokens_out = token_usage(full_prompt, raw_text, response)
+                span.set(bytes_in=telemetry.payload_bytes(raw_text), tokens_in=tokens_in, tokens_out=tokens_out)
+            with pipeline.stage("parse", bytes_in=telemetry.payload_bytes(raw_text)):
+                ai_result = extract_json(raw_text, model, fallback)
+            if ai_result.get("decision") != "Error":
+                llm_cache.put(cache_key, ai_result, ticker=ticker)
+
+        archived = False
+        if archive and not cache_hit:
+            if deadline is None or deadline.commit():
+                pipeline.run("archive", log_decision, build_log_payload(ticker, ai_result))
+                archived = True
+            else:
+                print(f"⌛ {ticker} 已判定逾時，略過歸檔")
+
+        return {
+            "ticker": ticker,
+            "status": "ok" if ai_result.get("decision") != "Error" else "parse_error",
+            "cache_hit": cache_hit,
+            "archived": archived,
+            "price": (ticker_data or {}).get("price"),
+            "decision": ai_result.get("decision"),
+            "risk_score": ai_result.get("risk_score"),
+            "target_price": ai_result.get("target_price"),
+            "pacer_type": ai_result.get("pacer_type"),
+            "rationale": ai_result.get("rationale"),
+            "memory_tokens_saved": context_stats["saved_tokens"],
+            "result": ai_result,
+            "timings": {name: t["seconds"] for name, t in pipeline.timings.items()},
+        }
+    finally:
+        pipeline.shutdown()
+        trace.finish()
+
+
+# --- 3. 批次執行 ---
+def run_batch(tickers, out_path, concurrency=4, timeout=180, archive=True, force_fresh=False, model=None,
+              memory_budget=DEFAULT_BUDGET, fallback=None):
+    done = load_checkpoint(out_path)
+    archived = load_archived(out_path)
+    todo = [t for t in tickers if t not in done]
+    if done:
+        print(f"♻️ Checkpoint: 略過已完成的 {len(tickers) - len(todo)} 檔")
+    if not todo:
+        return []
+    rearchive = [t for t in todo if t in archived]
+    if archive and rearchive:
+        print(f"♻️ 先前已歸檔過，這次不再寫入記憶庫: {', '.join(rearchive)}")
+
+    model = model or get_model()
+    if fallback is None and FALLBACK_MODEL_NAME:
+        fallback = get_model(FALLBACK_MODEL_NAME)
+    writer = ResultWriter(out_path)
+    records = []
+    started = time.perf_counter()
+    started_at = {}
+    deadlines = {ticker: Deadline() for ticker in todo}
+
+    def task(ticker):
+        t0 = started_at[ticker] = time.perf_counter()
+        record = run_ticker(
+            ticker, model, timeout, archive=archive and ticker not in archived, force_fresh=force_fresh, memory_budget=memory_budget,
+            fallback=fallback, deadline=deadlines[ticker],
+        )
+        record["timings"]["total"] = round(time.perf_counter() - t0, 4)
+        return record
+
+    def finish(record):
+        writer.write(record)
+        records.append(record)
+        print(f"{'✅' if record['status'] == 'ok' else '❌'} {record['ticker']}: {record.get('decision') or record['status']}")
+
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    pending = {pool.submit(task, ticker): ticker for ticker in todo}
+    while pending:
+        finished, _ = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+        for future in finished:
+            ticker = pending.pop(future)
+            try:
+                finish(future.result())
+            except Exception as e:
+                finish({"ticker": ticker, "status": "error", "error": str(e), "timings": {}})
+
+        # 逾時從該檔真正開始執行算起 (排隊時間不計)；逾時的執行緒直接放棄 (之後也不會歸檔)
+        now = time.perf_counter()
+        for future, ticker in list(pending.items()):
+            if ticker in started_at and now - started_at[ticker] > timeout and deadlines[ticker].expire():
+                pending.pop(future)
+                finish({"ticker": ticker, "status": "timeout", "timings": {"total": round(now - started_at[ticker], 4)}})
+
+    pool.shutdown(wait=False, cancel_futures=True)
+    elapsed = time.perf_counter() - started
+
+    # 歸檔佇列送完再結束
+    if archive and not get_writer().flush(timeout=120):
+        print("⏳ 歸檔佇列尚未清空，剩餘資料保留在 spool，下次啟動時重播")
+
+    print_summary(records, elapsed)
+    latest = latest_results(out_path)
+    print(f"  累計 (含先前執行，每檔取最後一筆) 成功 {sum(r.get('status') == 'ok' for r in latest)}/{len(latest)} 檔")
+    return records
+
+
+def print_summary(records, elapsed):
+    records = list({r["ticker"]: r for r in records}.values())   # 同一代號只算最後一筆
+    ok = sum(1 for r in records if r["status"] == "ok")
+    rate = len(records) / elapsed * 60 if elapsed else 0
+    print("\n📊 批次摘要")
+    saved = sum(r.get("memory_tokens_saved", 0) for r in records)
+    print(f"  完成 {ok}/{len(records)} 檔，耗時 {elapsed:.1f}s，吞吐量 {rate:.2f} 檔/分鐘")
+    print(f"  記憶上下文共節省約 {saved:,} tokens")
+    for stage in STAGES:
+        values = [r["timings"][stage] for r in records if stage in r.get("timings", {})]
+        if values:
+            print(f"  {stage:<8} p50 {percentile(values, 50):7.3f}s   p95 {percentile(values, 95):7.3f}s   (n={len(values)})")
+    for kind, stats in hedging.get_stats().items():
+        if stats["calls"]:
+            print(f"  對沖 {kind:<7} 對沖率 {stats['hedge_rate']:.1%}，p99 {stats['p99_primary']}s -> {stats['p99_served']}s"
+                  f" (降低 {stats['p99_reduction'] or 0:.1%})")
+    parsed = structured.get_stats()
+    if parsed["responses"]:
+        print(f"  結構化輸出 解析失敗率 {parsed['parse_failure_rate']:.1%}，欄位修補 {parsed['repairs']} 次"
+              f" (成功 {parsed['repaired']}，{parsed['repair_tokens_in'] + parsed['repair_tokens_out']:,} tokens，"
+              f"{parsed['repair_seconds']:.1f}s)")
+    for service, stats in rate_limit.get_stats().items():
+        if stats["calls"]:
+            print(f"  限流 {service:<7} 呼叫 {stats['calls']}，重試 {stats['retries']}，"
+                  f"等待 {stats['wait_seconds']:.1f}s，並行上限 {stats['concurrency_limit']}")
+
+
+def export_parquet(out_path, parquet_path):
+    import pandas as pd
+    rows = latest_results(out_path)    # 重跑過的代號只輸出最後一筆
+    df = pd.json_normalize(rows, max_level=1)
+    df = df.drop(columns=[c for c in df.columns if c.startswith("result.")])
+    df.to_parquet(parquet_path, index=False)
+    print(f"💾 已輸出 Parquet: {parquet_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="System v14 協議 F 批次推演")
+    parser.add_argument("watchlist", help="觀察清單檔案 (一行一個代號)")
+    parser.add_argument("--out", default="data/scout_results.jsonl", help="結果 JSONL (同時作為 checkpoint)")
+    parser.add_argument("--parquet", help="另存 Parquet 檔")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=180, help="單檔逾時 (秒)")
+    parser.add_argument("--no-archive", action="store_true", help="不寫入 Google Sheets 記憶庫")
+    parser.add_argument("--force-fresh", action="store_true", help="略過 AI 回應快取")
+    parser.add_argument("--memory-budget", type=int, default=DEFAULT_BUDGET, help="歷史記憶 token 預算")
+    args = parser.parse_args()
+
+    tickers = load_watchlist(args.watchlist)
+    if not tickers:
+        print("⚠️ 觀察清單是空的")
+        sys.exit(1)
+
+    run_batch(
+        tickers, args.out, concurrency=args.concurrency, timeout=args.timeout,
+        archive=not args.no_archive, force_fresh=args.force_fresh, memory_budget=args.memory_budget,
+    )
+    if args.parquet:
+        export_parquet(args.out, args.parquet)
@@ -0,0 +1,106 @@
+# tools/context_builder.py
+# 歷史記憶 → prompt 上下文 (有 token 預算)
+# 排序 (相關度 > 時間) → 去重 → 只保留需要的欄位 → 較舊的 full_analysis 摘要或捨棄，
+# 依預算貪婪裝填；不論記憶庫多大，每次送進 Gemini 的記憶區塊都有上限。
+import json
+import re
+
+DEFAULT_BUDGET = 1500          # tokens
+MEMORY_CANDIDATES = 10         # 檢索時多取幾筆，交給預算決定實際放入多少
+SUMMARY_CHARS = 400            # 保留 full_analysis 的條目，摘要長度上限 (字元)
+KEEP_ANALYSIS_FOR = 2          # 只有排名最前的幾筆保留 full_analysis 摘要
+
+# 送進 prompt 的欄位 (依序)；log_id / cycle_position 對推演幫助不大
+CONTEXT_FIELDS = [
+    "timestamp", "ticker", "decision", "risk_score", "entry_price",
+    "pacer_type", "keywords", "rationale",
+]
+
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff\u3000-\u303f\uff00-\uffef]")
+_SENTENCE_END_RE = re.compile(r"[。！？!?\n]")
+
+
+# --- 1. Token 估算 ---
+def estimate_tokens(text):
+    # 中文 (含全形標點) 約 1 字 1 token，其餘約 4 字元 1 token
+    text = str(text or "")
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def summarize(text, max_chars=SUMMARY_CHARS):
+    # 取開頭幾句，盡量在句尾截斷
+    text = " ".join(str(text or "").split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    ends = [m.end() for m in _SENTENCE_END_RE.finditer(cut)]
+    if ends and ends[-1] > max_chars // 2:
+        cut = cut[:ends[-1]]
+    return cut.rstrip() + "…"
+
+
+# --- 2. 排序 / 去重 ---
+def _rank(records):
+    # 相關度分數高者優先，同分時較新的優先
+    return sorted(
+        records,
+        key=lambda r: (float(r.get("score") or 0), str(r.get("timestamp", ""))),
+        reverse=True,
+    )
+
+
+def _dedupe(records):
+    seen = set()
+    unique = []
+    for record in records:
+        key = (
+            str(record.get("ticker", "")).upper(),
+            str(record.get("decision", "")).lower(),
+            " ".join(str(record.get("rationale", "")).split()).lower(),
+        )
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(record)
+    return unique
+
+
+# --- 3. 組裝 ---
+def build_memory_context(records, budget=DEFAULT_BUDGET, keep_analysis_for=KEEP_ANALYSIS_FOR):
+    # 回傳 (context_text, stats)
+    records = records or []
+    raw_tokens = estimate_tokens(_dumps(records))
+
+    unique = _dedupe(_rank(records))
+    entries = []
+    used = estimate_tokens("[]")
+    for rank, record in enumerate(unique):
+        entry = {field: record[field] for field in CONTEXT_FIELDS if record.get(field) not in (None, "")}
+        candidates = [entry]
+        if rank < keep_analysis_for and record.get("full_analysis") not in (None, "", "N/A"):
+            candidates.insert(0, dict(entry, analysis_summary=summarize(record["full_analysis"])))
+
+        for candidate in candidates:
+            cost = estimate_tokens(_dumps(candidate)) + 1
+            if used + cost <= budget:
+                entries.append(candidate)
+                used += cost
+                break
+
+    text = _dumps(entries)
+    used_tokens = estimate_tokens(text)
+    stats = {
+        "budget": budget,
+        "raw_tokens": raw_tokens,
+        "used_tokens": used_tokens,
+        "saved_tokens": max(0, raw_tokens - used_tokens),
+        "entries_in": len(records),
+        "entries_kept": len(entries),
+        "entries_dropped": len(records) - len(entries),
+    }
+    return text, stats
@@ -0,0 +1,176 @@
+# tools/fanout.py
+# 協議 G 趨勢獵殺的 map-reduce 展開流程
+# 1. decompose：一次短呼叫，把趨勢拆成各供應鏈層的候選代號
+# 2. 批次取資料：所有候選一次批次報價 (market_data.get_watchlist)，記憶檢索同時在另一條執行緒跑
+# 3. map：每個候選各自做 MFR 審計 (整個行程同時最多 AUDIT_CONCURRENCY 個，經過共用限流與對沖)
+# 4. reduce：把各候選的審計摘要交給最後一次呼叫，排出真正的壟斷者
+# 配額充足時總耗時約為 decompose + 最慢的一個候選 + reduce；實際受 Gemini 配額限制
+# (預設並行 4、60 RPM)：候選數超過並行上限就分批，多個 session 同時展開還會互相排隊，耗時隨候選數增加。
+import contextvars
+import json
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from prompts import DECOMPOSE_SCHEMA, TREND_DECOMPOSE_PROMPT
+
+try:
+    from tools import market_data, smart_search, telemetry
+    from tools.analysis import build_prompt, extract_json, generate
+    from tools.context_builder import MEMORY_CANDIDATES, build_memory_context
+except ImportError:
+    import market_data, smart_search, telemetry  # 直接在 tools 資料夾執行
+    from analysis import build_prompt, extract_json, generate
+    from context_builder import MEMORY_CANDIDATES, build_memory_context
+
+MAX_CANDIDATES = 12
+PER_LAYER = 4
+AUDIT_CONCURRENCY = 8           # 整個行程同時進行的審計上限 (實際送出仍受 rate_limit 的 Gemini 並行上限約束)
+CANDIDATE_MEMORY_BUDGET = 500   # 每個候選的記憶 token 預算 (比單檔偵察小，避免 map 階段 prompt 膨脹)
+SUMMARY_FIELDS = ["decision", "pacer_type", "risk_score", "target_price", "rationale", "keywords"]
+
+# 多個 session 同時展開時共用，避免每次展開各自再開 AUDIT_CONCURRENCY 條執行緒
+_audit_slots = threading.BoundedSemaphore(AUDIT_CONCURRENCY)
+
+
+def _submit(pool, fn, *args, **kwargs):
+    # 背景執行緒沿用目前的 trace，子階段掛在呼叫端的 span 底下
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# --- 1. 拆解供應鏈 ---
+def decompose(trend, model, fallback=None, max_candidates=MAX_CANDIDATES):
+    # 回傳 [{"ticker", "layer"}]，依層級順序，代號不重複
+    prompt = (TREND_DECOMPOSE_PROMPT.format(per_layer=PER_LAYER, max_candidates=max_candidates)
+              + f"\n【指揮官指令】針對趨勢 '{trend}' 進行供應鏈拆解。")
+    with telemetry.span("fanout.decompose") as span:
+        raw_text = generate(model, prompt, fallback=fallback, schema=DECOMPOSE_SCHEMA).text
+        parsed = extract_json(raw_text, model, fallback, schema=DECOMPOSE_SCHEMA)
+        layers = parsed.get("layers")
+        if not isinstance(layers, list):
+            # 沒有分層時退回單層清單
+            layers = [{"layer": "候選", "tickers": parsed.get("tickers") or []}]
+        candidates, seen = [], set()
+        for layer in layers:
+            for ticker in (layer.get("tickers") or [])[:PER_LAYER]:
+                ticker = str(ticker).strip().upper()
+                if ticker and ticker not in seen and len(candidates) < max_candidates:
+                    seen.add(ticker)
+                    candidates.append({"ticker": ticker, "layer": str(layer.get("layer", "候選"))})
+        span.set(candidates=len(candidates))
+    if not candidates:
+        raise ValueError(f"無法把趨勢 '{trend}' 拆解成候選代號")
+    return candidates
+
+
+# --- 2. 批次取資料 ---
+def _clean(value):
+    # pandas 取出的 NumPy 純量轉回 Python 型別 (之後要 JSON 序列化)，NaN 視為缺值
+    value = value.item() if hasattr(value, "item") else value
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def fetch_candidate_data(tickers):
+    # 一次批次報價 + 記憶檢索 (兩者同時進行)；回傳 ({ticker: 行情 dict 或 None}, {ticker: 記憶紀錄})
+    def quotes():
+        with telemetry.span("fanout.quotes", symbols=len(tickers)):
+            table = market_data.get_watchlist(tickers)
+        data = {}
+        for ticker in tickers:
+            row = {k: _clean(v) for k, v in table.loc[ticker].items()} if ticker in table.index else {}
+            data[ticker] = row if row.get("price") is not None else None
+        return data
+
+    def memories():
+        with telemetry.span("fanout.memory", tickers=len(tickers)):
+            return {ticker: smart_search.cached_search(ticker, k=MEMORY_CANDIDATES) for ticker in tickers}
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="fanout-data") as pool:
+        quote_future = _submit(pool, quotes)
+        memory_future = _submit(pool, memories)
+        try:
+            quote_data = quote_future.result()
+        except Exception as e:
+            print(f"⚠️ 候選批次報價失敗，審計不帶行情: {e}")
+            quote_data = {ticker: None for ticker in tickers}
+        try:
+            memory_data = memory_future.result()
+        except Exception as e:
+            print(f"⚠️ 候選記憶檢索失敗，審計不帶歷史記憶: {e}")
+            memory_data = {ticker: [] for ticker in tickers}
+    return quote_data, memory_data
+
+
+# --- 3. map：單一候選審計 ---
+def audit_input(trend, candidate):
+    return (f"針對趨勢 '{trend}' 的供應鏈層「{candidate['layer']}」，對 {candidate['ticker']} 進行 MFR 物理審計："
+            f"它是否佔據這一層的物理瓶頸？是收過路費的還是苦力？")
+
+
+def audit(trend, candidate, quote, memory_records, model, fallback=None, memory_budget=CANDIDATE_MEMORY_BUDGET):
+    with _audit_slots, telemetry.span("fanout.audit", ticker=candidate["ticker"]) as span:
+        memory_context, _ = build_memory_context(memory_records, budget=memory_budget)
+        prompt = build_prompt(audit_input(trend, candidate), quote, memory_context)
+        raw_text = generate(model, prompt, fallback=fallback).text
+        span.set(bytes_out=telemetry.payload_bytes(prompt), bytes_in=telemetry.payload_bytes(raw_text))
+        return extract_json(raw_text, model, fallback)
+
+
+# --- 4. reduce：排名 ---
+def reduce_input(trend, summaries):
+    return (f"針對趨勢 '{trend}' 進行獵殺分析，尋找供應鏈中的壟斷者。以下是各候選已完成的 MFR 審計摘要 (JSON)，"
+            f"請比較各層的物理瓶頸與定價權，排出真正的壟斷者，並依既定 JSON 格式回傳；"
+            f"另外加上 \"ranking\": [{{\"ticker\": \"代號\", \"layer\": \"層級\", \"reason\": \"一句話理由\"}}]，依壟斷程度排序。\n"
+            f"{json.dumps(summaries, ensure_ascii=False)}")
+
+
+def summarize(candidate, quote, result):
+    summary = {"ticker": candidate["ticker"], "layer": candidate["layer"]}
+    if quote:
+        summary.update(price=quote.get("price"), pct_change=quote.get("pct_change"), market_cap=quote.get("market_cap"))
+    summary.update({field: result.get(field) for field in SUMMARY_FIELDS})
+    return summary
+
+
+# --- 5. 對外介面 ---
+def run_hunt(trend, model, fallback=None, memory_context="[]", concurrency=AUDIT_CONCURRENCY,
+             max_candidates=MAX_CANDIDATES, on_progress=None):
+    # on_progress(stage, done, total)：在呼叫端執行緒回呼 (Dashboard 可直接更新元件)
+    # 回傳 {"result": 最終 JSON, "candidates": [候選摘要]}；個別候選失敗只標記，不中斷整體
+    progress = on_progress or (lambda stage, done, total: None)
+
+    progress("decompose", 0, 1)
+    candidates = decompose(trend, model, fallback, max_candidates)
+    tickers = [c["ticker"] for c in candidates]
+
+    progress("data", 0, len(tickers))
+    quote_data, memory_data = fetch_candidate_data(tickers)
+
+    summaries = {}
+    progress("audit", 0, len(candidates))
+    workers = max(1, min(concurrency, AUDIT_CONCURRENCY, len(candidates)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout-audit") as pool:
+        futures = {
+            _submit(pool, audit, trend, c, quote_data.get(c["ticker"]), memory_data.get(c["ticker"]), model, fallback): c
+            for c in candidates
+        }
+        for future in as_completed(futures):
+            candidate = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"decision": "Error", "rationale": f"審計失敗: {e}"}
+            summaries[candidate["ticker"]] = summarize(candidate, quote_data.get(candidate["ticker"]), result)
+            progress("audit", len(summaries), len(candidates))
+
+    ordered = [summaries[t] for t in tickers]
+    audited = [s for s in ordered if s["decision"] != "Error"]
+    if not audited:
+        raise RuntimeError("所有候選的審計都失敗")
+
+    progress("reduce", 0, 1)
+    with telemetry.span("fanout.reduce", candidates=len(audited)):
+        prompt = build_prompt(reduce_input(trend, audited), None, memory_context)
+        result = extract_json(generate(model, prompt, fallback=fallback).text, model, fallback)
+    progress("reduce", 1, 1)
+    return {"result": result, "candidates": ordered}
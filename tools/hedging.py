@@ -0,0 +1,148 @@
+# tools/hedging.py
+# Gemini 請求對沖 (hedged requests)：壓低長尾延遲
+# - 主請求超過「過去延遲的第 p 百分位」仍未回應，就再送一個備援請求 (可指定另一個模型)
+# - 主請求直接失敗時立即送備援，不等門檻
+# - 先完成的勝出；另一個還沒開始就取消，已送出的讓它在背景跑完後丟棄 (Python 執行緒無法中斷)
+# - 整體有硬性期限，逾時丟出 TimeoutError
+# 串流模式比的是第一個 chunk 到達的時間 (SDK 在第一個 chunk 到達時才返回)，因此串流與非串流各自統計。
+# 主請求即使輸掉也會在背景完成並記錄延遲 (失敗的也算，到失敗為止的時間)，用來估算「沒有對沖時」的 p99。
+# 主請求與備援請求各用一個執行緒池 (大小 = Gemini 並行上限 + 餘裕)：備援不會排在忙碌 / 輸掉的主請求後面。
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    from tools import rate_limit, telemetry
+except ImportError:
+    import rate_limit, telemetry  # 直接在 tools 資料夾執行
+
+HEDGE_PERCENTILE = float(os.environ.get("SYSTEM_V14_HEDGE_PERCENTILE", 95))
+DEADLINE = float(os.environ.get("SYSTEM_V14_LLM_DEADLINE", 120))   # 秒
+DEFAULT_HEDGE_AFTER = 20.0     # 樣本不足時的對沖門檻 (秒)
+MIN_HEDGE_AFTER = 1.0          # 門檻下限，避免延遲很低時每個請求都對沖
+MIN_SAMPLES = 20
+WINDOW = 500                   # 保留最近幾次的延遲
+POOL_HEADROOM = 4              # 輸掉的請求仍在背景跑完，執行緒多留一些
+
+_pool_size = rate_limit.get_service("gemini").concurrency.maximum + POOL_HEADROOM
+_executors = {
+    "primary": ThreadPoolExecutor(max_workers=_pool_size, thread_name_prefix="hedge-primary"),
+    "hedge": ThreadPoolExecutor(max_workers=_pool_size, thread_name_prefix="hedge-backup"),
+}
+
+
+class Hedger:
+    def __init__(self, percentile=HEDGE_PERCENTILE, deadline=DEADLINE):
+        self.percentile = percentile
+        self.deadline = deadline
+        self._primary = deque(maxlen=WINDOW)    # 主請求延遲 (含輸掉後在背景完成的)
+        self._served = deque(maxlen=WINDOW)     # 實際交給呼叫端的延遲
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "failures": 0, "timeouts": 0}
+        self._lock = threading.Lock()
+
+    def hedge_after(self):
+        with self._lock:
+            samples = list(self._primary)
+        if len(samples) < MIN_SAMPLES:
+            return DEFAULT_HEDGE_AFTER
+        return max(MIN_HEDGE_AFTER, telemetry.percentile(samples, self.percentile))
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _observe_primary(self, t0, future):
+        # 失敗也記錄 (逾時 / 重試耗盡正是長尾)，只有還沒開始就被取消的不算
+        if not future.cancelled():
+            with self._lock:
+                self._primary.append(time.perf_counter() - t0)
+
+    def run(self, attempt, primary, fallback=None, deadline=None):
+        # attempt(target, timeout) -> 回應；target 為主模型或備援模型，timeout 為剩餘秒數
+        deadline = deadline or self.deadline
+        t0 = time.perf_counter()
+        end = t0 + deadline
+        hedge_at = t0 + self.hedge_after()
+        pending = {}    # future -> "primary" / "hedge"
+        error = None
+        self._count("calls")
+
+        def launch(label, target):
+            # 每個請求各自複製 context，rate_limit / telemetry 記到目前的 span
+            future = _executors[label].submit(contextvars.copy_context().run, attempt, target, max(0.1, end - time.perf_counter()))
+            pending[future] = label
+            return future
+
+        launch("primary", primary).add_done_callback(lambda f: self._observe_primary(t0, f))
+        hedged = False
+        while pending:
+            now = time.perf_counter()
+            if now >= end:
+                break
+            wake = end if hedged else min(end, hedge_at)
+            done, _ = wait(list(pending), timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                label = pending.pop(future)
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    with self._lock:
+                        self._served.append(time.perf_counter() - t0)
+                        self.stats["hedge_wins"] += label == "hedge"
+                    telemetry.current_span().set(hedged=int(hedged), hedge_won=int(label == "hedge"))
+                    return future.result()
+                error = future.exception()
+                print(f"⚠️ Gemini {label} 請求失敗: {error}")
+            if not hedged and (time.perf_counter() >= hedge_at or not pending):
+                if not self._can_hedge():
+                    hedge_at = end      # 限流中不對沖，只等主請求
+                    continue
+                hedged = True
+                self._count("hedged")
+                launch("hedge", fallback or primary)
+
+        if pending:
+            for future in pending:
+                future.cancel()
+            self._count("timeouts")
+            raise TimeoutError(f"Gemini 超過 {deadline:g}s 沒有回應")
+        self._count("failures")
+        raise error
+
+    def _can_hedge(self):
+        # 正在被限流 (並行上限已被調降) 時不加送請求，避免對沖放大壅塞
+        limit = rate_limit.get_service("gemini").concurrency
+        return limit.limit >= limit.maximum
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            primary, served = list(self._primary), list(self._served)
+        p99_primary = telemetry.percentile(primary, 99)
+        p99_served = telemetry.percentile(served, 99)
+        reduction = None
+        if p99_primary and p99_served is not None:
+            reduction = round(1 - p99_served / p99_primary, 3)
+        return dict(
+            stats,
+            hedge_rate=round(stats["hedged"] / stats["calls"], 3) if stats["calls"] else None,
+            hedge_after=round(self.hedge_after(), 3),
+            p99_primary=None if p99_primary is None else round(p99_primary, 3),
+            p99_served=None if p99_served is None else round(p99_served, 3),
+            p99_reduction=reduction,
+        )
+
+
+# --- 行程內共用實例：串流 (第一個 chunk) 與完整回應的延遲分佈不同，分開統計 ---
+_hedgers = {"stream": Hedger(), "full": Hedger()}
+
+
+def get_hedger(kind="full"):
+    return _hedgers[kind]
+
+
+def get_stats():
+    return {kind: hedger.get_stats() for kind, hedger in _hedgers.items()}
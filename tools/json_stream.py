@@ -0,0 +1,127 @@
+# tools/json_stream.py
+# 串流 JSON 解析器：邊收 token 邊解析最外層物件的欄位
+# 每個頂層欄位的值一結束就可以取用 (fields)，尚未結束的字串欄位
+# (例如 full_analysis) 也能透過 partial() 取得目前已收到的內容。
+import json
+
+
+class JsonFieldStream:
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.fields = {}          # 已完整解析的頂層欄位
+        self.done = False
+
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = "key"      # key / key_str / colon / value / in_value / comma
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self._value_kind = None   # string / container / primitive
+        self._reported = set()
+
+    # --- 1. 餵資料 ---
+    def feed(self, text):
+        self.buf += text
+        buf = self.buf
+        for i in range(self.pos, len(buf)):
+            if self.done:
+                break
+            self._step(buf, i, buf[i])
+        self.pos = len(buf)
+        return self
+
+    def _step(self, buf, i, c):
+        if not self._started:
+            # 略過 ```json 之類的前綴，從第一個 { 開始
+            if c == "{":
+                self._started = True
+                self._depth = 1
+            return
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif c == "\\":
+                self._escape = True
+            elif c == '"':
+                self._in_string = False
+                if self._depth == 1 and self._expect == "key_str":
+                    self._key = json.loads(buf[self._key_start:i + 1], strict=False)
+                    self._expect = "colon"
+                elif self._depth == 1 and self._value_kind == "string":
+                    self._complete(buf[self._value_start:i + 1])
+            return
+
+        if c == '"':
+            self._in_string = True
+            if self._depth == 1 and self._expect == "key":
+                self._key_start = i
+                self._expect = "key_str"
+            elif self._depth == 1 and self._expect == "value":
+                self._begin(i, "string")
+        elif c in "{[":
+            if self._depth == 1 and self._expect == "value":
+                self._begin(i, "container")
+            self._depth += 1
+        elif c in "}]":
+            self._depth -= 1
+            if self._depth == 1 and self._value_kind == "container":
+                self._complete(buf[self._value_start:i + 1])
+            elif self._depth == 0:
+                if self._value_kind == "primitive":
+                    self._complete(buf[self._value_start:i])
+                self.done = True
+        elif self._depth == 1:
+            if c == ",":
+                if self._value_kind == "primitive":
+                    self._complete(buf[self._value_start:i])
+                self._expect = "key"
+            elif c == ":" and self._expect == "colon":
+                self._expect = "value"
+            elif not c.isspace() and self._expect == "value":
+                self._begin(i, "primitive")
+
+    def _begin(self, i, kind):
+        self._value_start = i
+        self._value_kind = kind
+        self._expect = "in_value"
+
+    def _complete(self, text):
+        try:
+            self.fields[self._key] = json.loads(text.strip(), strict=False)
+        except ValueError:
+            self.fields[self._key] = text.strip()
+        self._value_kind = None
+        self._value_start = None
+        self._expect = "comma"
+
+    # --- 2. 讀取 ---
+    def new_fields(self):
+        # 回傳上次呼叫之後新完成的欄位名稱
+        fresh = [k for k in self.fields if k not in self._reported]
+        self._reported.update(fresh)
+        return fresh
+
+    def partial(self, key):
+        # 已完成就回傳完整值；正在接收的字串欄位回傳目前解碼得到的部分
+        if key in self.fields:
+            value = self.fields[key]
+            return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        if self._key == key and self._value_kind == "string":
+            return _decode_partial(self.buf[self._value_start + 1:])
+        return None
+
+
+def _decode_partial(raw):
+    # 尾端可能停在跳脫字元中間 (\ 或 \uXX)，逐步裁掉再解碼
+    for cut in range(0, 7):
+        chunk = raw[:len(raw) - cut] if cut else raw
+        try:
+            return json.loads('"' + chunk + '"', strict=False)
+        except ValueError:
+            continue
+    return ""
@@ -0,0 +1,191 @@
+# tools/llm_cache.py
+# Gemini 回應快取 (content-addressed)
+# key = 正規化後 prompt 組成部分的雜湊：SYSTEM_PROMPT 版本、協議、代號、
+# 市場數據快照 (依時間分桶)、記憶摘要、指令內容。
+# 記憶摘要略過「快取裡的結果自己歸檔出來的列」：每次推演都會把新決策寫回鏡像，
+# 下一次檢索就會撈到它；若照算進 key，同樣的輸入永遠不會命中。
+# 自己的列要在截成前 k 筆「之前」略過：檢索時多取 own_rows(ticker) 筆 (memory_candidates)，
+# 否則新歸檔的列會把第 k 筆擠出去，key 一樣會變。記憶預算也算進 key (它決定 prompt 裡放多少記憶)。
+# 支援 TTL、容量上限 (LRU 淘汰) 與磁碟持久化 (SQLite)，並記錄命中率。
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from tools.memory_mirror import DATA_DIR
+except ImportError:
+    from memory_mirror import DATA_DIR  # 直接在 tools 資料夾執行
+
+CACHE_PATH = os.path.join(DATA_DIR, "llm_cache.db")
+
+DEFAULT_TTL = 15 * 60          # 秒
+DEFAULT_MAX_ENTRIES = 500
+MARKET_BUCKET_SECONDS = 5 * 60  # 市場數據快照分桶：同一桶內視為同一份行情
+
+
+# --- 1. Key 組成 ---
+def _digest(value):
+    text = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _normalize_text(text):
+    # 忽略空白差異 (縮排、換行) 造成的 key 不同
+    return " ".join(str(text or "").split())
+
+
+def market_bucket(market_data, now=None):
+    # 同一時間桶內、相同價格 (取到小數兩位) 視為同一份快照
+    bucket = int((now or time.time()) // MARKET_BUCKET_SECONDS)
+    if not market_data:
+        return [bucket, None]
+    price = market_data.get("price")
+    return [bucket, round(price, 2) if isinstance(price, (int, float)) else price]
+
+
+def row_fingerprint(record):
+    # 歸檔列與快取結果共用的指紋：決策 + 核心理由 (歸檔後不會變，log_id / timestamp 是寫入時才產生的)
+    return _digest([str(record.get("decision") or ""), _normalize_text(record.get("rationale"))])
+
+
+def memory_digest(memory_records, own_rows=(), k=None):
+    # 只取識別欄位，避免長篇 full_analysis 影響雜湊成本；
+    # 先略過 own_rows 內的指紋 (快取自己寫的列)，再取前 k 筆
+    kept = [(r.get("log_id"), r.get("timestamp")) for r in memory_records or [] if row_fingerprint(r) not in own_rows]
+    return _digest(kept if k is None else kept[:k])
+
+
+def memory_candidates(ticker, k):
+    # 檢索要取幾筆：k 加上這個代號 TTL 內由快取結果歸檔出來的列數
+    return k + len(get_cache().own_rows(ticker))
+
+
+def make_key(system_prompt, protocol, ticker, market_data, memory_records, user_input, memory_budget=None, k=None):
+    # memory_records 依 memory_candidates(ticker, k) 檢索；k 為實際使用的筆數
+    return _digest({
+        "system_prompt": hashlib.sha256(system_prompt.encode("utf-8")).hexdigest(),
+        "protocol": protocol,
+        "ticker": str(ticker).upper(),
+        "market": market_bucket(market_data),
+        "memory": memory_digest(memory_records, get_cache().own_rows(ticker), k),
+        "memory_budget": memory_budget,
+        "input": _normalize_text(user_input),
+    })
+
+
+# --- 2. 快取本體 ---
+class LLMCache:
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "bypassed": 0}
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT, created_at REAL, last_access REAL)"
+        )
+        # 快取過的結果會被歸檔成記憶列，記下它們的指紋 (與代號)，算 key 時略過
+        conn.execute("CREATE TABLE IF NOT EXISTS own_rows (fingerprint TEXT PRIMARY KEY, created_at REAL, ticker TEXT)")
+        try:
+            conn.execute("ALTER TABLE own_rows ADD COLUMN ticker TEXT")   # 舊版資料庫沒有 ticker 欄
+        except sqlite3.OperationalError:
+            pass
+        return conn
+
+    def get(self, key):
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self.stats["misses"] += 1
+                    return None
+                value, created_at = row
+                if time.time() - created_at > self.ttl:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    self.stats["expired"] += 1
+                    self.stats["misses"] += 1
+                    return None
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+                self.stats["hits"] += 1
+                return json.loads(value)
+            finally:
+                conn.close()
+
+    def put(self, key, value, ticker=None):
+        # ticker: 這個結果會歸檔到哪個代號 (memory_candidates 依代號計算要多取幾筆)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now, now),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO own_rows (fingerprint, created_at, ticker) VALUES (?, ?, ?)",
+                    (row_fingerprint(value), now, None if ticker is None else str(ticker).upper()),
+                )
+                # 先清掉過期的，再依 last_access 淘汰最久沒用到的 (LRU)
+                conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+                conn.execute("DELETE FROM own_rows WHERE created_at < ?", (now - self.ttl,))
+                overflow = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    conn.execute(
+                        "DELETE FROM llm_cache WHERE key IN ("
+                        " SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)",
+                        (overflow,),
+                    )
+                    self.stats["evicted"] += overflow
+                conn.commit()
+            finally:
+                conn.close()
+
+    def own_rows(self, ticker=None):
+        # TTL 內由快取結果歸檔出來的記憶列指紋；指定 ticker 時只取該代號的
+        query, params = "SELECT fingerprint FROM own_rows WHERE created_at >= ?", [time.time() - self.ttl]
+        if ticker is not None:
+            query += " AND ticker = ?"
+            params.append(str(ticker).upper())
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(query, params).fetchall()
+            finally:
+                conn.close()
+        return {r[0] for r in rows}
+
+    def bypass(self):
+        # 「強制重新推演」時記錄一次略過
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            hit_rate = round(self.stats["hits"] / lookups, 3) if lookups else None
+            return dict(self.stats, hit_rate=hit_rate, ttl=self.ttl, max_entries=self.max_entries)
+
+
+# --- 3. 行程內共用實例 (TTL / 容量可由環境變數調整) ---
+_cache = LLMCache(
+    ttl=int(os.environ.get("SYSTEM_V14_LLM_CACHE_TTL", DEFAULT_TTL)),
+    max_entries=int(os.environ.get("SYSTEM_V14_LLM_CACHE_SIZE", DEFAULT_MAX_ENTRIES)),
+)
+
+
+def get_cache():
+    return _cache
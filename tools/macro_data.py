@@ -0,0 +1,176 @@
+# tools/macro_data.py
+# 協議 C 宏觀指標：HYG / BTC / 銅金比的趨勢狀態與 SOFR - IORB 利差
+# 價格來自本地價格存放區 (tools/price_store.py，只增量補缺的日期)，
+# 利率由使用者匯入的 CSV (date, sofr, iorb) 存成 Parquet；指標一律以向量化 rolling 計算。
+#
+#   python -m tools.macro_data                          # 更新價格並印出目前讀數
+#   python -m tools.macro_data --import-rates rates.csv # 匯入 / 合併 SOFR、IORB 利率
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    from tools import price_store
+except ImportError:
+    import price_store  # 直接在 tools 資料夾執行
+
+MACRO_SYMBOLS = {"hyg": "HYG", "btc": "BTC-USD", "copper": "HG=F", "gold": "GC=F"}
+RATES_PATH = os.path.join(price_store.PRICE_DIR, "_rates.parquet")
+
+# 與 Dashboard 協議 C 的選項一致 (Dashboard 直接引用這裡的清單)
+HYG_STATES = ["上漲 (風險偏好)", "下跌 (避險)", "盤整"]
+BTC_STATES = ["強勢", "弱勢", "崩盤"]
+COGO_STATES = ["上升 (復甦)", "下降 (衰退/滯脹)"]
+
+FAST, SLOW, RATIO_SLOW = 20, 50, 60    # rolling 視窗 (交易日)
+BTC_CRASH = -0.20                      # 20 日跌幅超過 20% 視為崩盤
+
+_refresh_lock = threading.Lock()
+_refresh_thread = None
+_refreshed_at = 0.0
+
+
+# --- 1. 利率 (SOFR / IORB) ---
+def import_rates(csv_path):
+    # CSV 需有 date 與 sofr / iorb 欄 (大小寫不拘，單位: %)；與既有資料合併，同日期以新檔為準
+    df = pd.read_csv(csv_path)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    missing = {"date", "sofr", "iorb"} - set(df.columns)
+    if missing:
+        raise ValueError(f"利率 CSV 缺少欄位: {sorted(missing)}")
+    df["date"] = pd.to_datetime(df["date"]).dt.normalize()
+    df = df.set_index("date")[["sofr", "iorb"]].apply(pd.to_numeric, errors="coerce").dropna(how="all")
+
+    existing = load_rates()
+    merged = pd.concat([existing, df])
+    merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+    os.makedirs(os.path.dirname(RATES_PATH), exist_ok=True)
+    merged.to_parquet(RATES_PATH)
+    return len(merged) - len(existing)
+
+
+def load_rates():
+    if not os.path.exists(RATES_PATH):
+        return pd.DataFrame(columns=["sofr", "iorb"], index=pd.DatetimeIndex([], name="date"), dtype=float)
+    return pd.read_parquet(RATES_PATH)
+
+
+# --- 2. 向量化指標 ---
+def compute_indicators(closes):
+    # closes: 寬表 (欄位 = hyg / btc / copper / gold)；回傳同樣以日期為 index 的指標表
+    closes = closes.sort_index()
+    # 各市場交易日不同 (BTC 週末也有價)，先前值填補再算，避免 NaN 擴散
+    filled = closes.ffill()
+    sma_fast = filled.rolling(FAST, min_periods=FAST // 2).mean()
+    sma_slow = filled.rolling(SLOW, min_periods=SLOW // 2).mean()
+    ret_fast = filled.pct_change(FAST, fill_method=None)
+
+    out = pd.DataFrame(index=closes.index)
+    for name in ("hyg", "btc"):
+        if name in filled:
+            out[f"{name}_close"] = filled[name]
+            out[f"{name}_ret_{FAST}"] = ret_fast[name]
+            out[f"{name}_vs_sma{SLOW}"] = filled[name] / sma_slow[name] - 1
+
+    if "hyg" in filled:
+        up = (filled["hyg"] > sma_slow["hyg"]) & (ret_fast["hyg"] > 0)
+        down = (filled["hyg"] < sma_slow["hyg"]) & (ret_fast["hyg"] < 0)
+        out["hyg_trend"] = np.select([up, down], HYG_STATES[:2], HYG_STATES[2])
+        out.loc[sma_slow["hyg"].isna(), "hyg_trend"] = None
+
+    if "btc" in filled:
+        crash = ret_fast["btc"] <= BTC_CRASH
+        strong = (filled["btc"] > sma_slow["btc"]) & (ret_fast["btc"] > 0)
+        out["btc_trend"] = np.select([crash, strong], [BTC_STATES[2], BTC_STATES[0]], BTC_STATES[1])
+        out.loc[sma_slow["btc"].isna(), "btc_trend"] = None
+
+    if {"copper", "gold"} <= set(filled.columns):
+        ratio = filled["copper"] / filled["gold"]
+        ratio_fast = ratio.rolling(FAST, min_periods=FAST // 2).mean()
+        ratio_slow = ratio.rolling(RATIO_SLOW, min_periods=RATIO_SLOW // 2).mean()
+        out["cogo_ratio"] = ratio
+        out[f"cogo_ret_{FAST}"] = ratio.pct_change(FAST, fill_method=None)
+        out["cogo_trend"] = np.where(ratio_fast >= ratio_slow, COGO_STATES[0], COGO_STATES[1])
+        out.loc[ratio_slow.isna(), "cogo_trend"] = None
+    return out
+
+
+def _last_valid(series):
+    series = series.dropna()
+    if series.empty:
+        return None, None
+    return series.iloc[-1], series.index[-1].strftime("%Y-%m-%d")
+
+
+def _round(value, digits=4):
+    return None if value is None else round(float(value), digits)
+
+
+# --- 3. 對外介面 ---
+def get_snapshot(refresh=True):
+    # 協議 C 表單預設值；抓不到的項目為 None (Dashboard 改用手動預設)
+    if refresh:
+        price_store.refresh(list(MACRO_SYMBOLS.values()))
+    closes = price_store.load_many(list(MACRO_SYMBOLS.values()))
+    closes = closes.rename(columns={v: k for k, v in MACRO_SYMBOLS.items()})
+    indicators = compute_indicators(closes) if not closes.empty else pd.DataFrame()
+
+    snapshot = {"readings": {}, "as_of": {}}
+    for key, column in (("hyg_trend", "hyg_trend"), ("btc_trend", "btc_trend"), ("cogo_ratio", "cogo_trend")):
+        value, as_of = _last_valid(indicators[column]) if column in indicators else (None, None)
+        snapshot[key] = value
+        snapshot["as_of"][key] = as_of
+    for column in indicators.columns:
+        if not column.endswith("_trend"):
+            snapshot["readings"][column] = _round(_last_valid(indicators[column])[0])
+
+    rates = load_rates()
+    spread, as_of = _last_valid(rates["sofr"] - rates["iorb"]) if not rates.empty else (None, None)
+    snapshot["sofr_iorb"] = None if spread is None else f"{spread:.2f}"
+    snapshot["as_of"]["sofr_iorb"] = as_of
+    return snapshot
+
+
+def _refresh():
+    try:
+        price_store.refresh(list(MACRO_SYMBOLS.values()))
+    except Exception as e:
+        print(f"⚠️ 宏觀數據更新失敗: {e}")
+
+
+def refresh_in_background():
+    # Dashboard 用：在背景執行緒補抓價格 (頁面只讀本地檔，不等 Yahoo)；
+    # 同一行程同時只跑一個，REFRESH_INTERVAL 內不重複啟動。回傳是否正在更新
+    global _refresh_thread, _refreshed_at
+    with _refresh_lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return True
+        if time.time() - _refreshed_at < price_store.REFRESH_INTERVAL:
+            return False
+        _refreshed_at = time.time()
+        _refresh_thread = threading.Thread(target=_refresh, name="macro-refresh", daemon=True)
+        _refresh_thread.start()
+        return True
+
+
+def refreshing():
+    thread = _refresh_thread
+    return thread is not None and thread.is_alive()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description="System v14 宏觀指標 (協議 C)")
+    parser.add_argument("--import-rates", help="SOFR / IORB 利率 CSV (date, sofr, iorb)")
+    parser.add_argument("--force", action="store_true", help="忽略更新間隔，立即補抓價格")
+    args = parser.parse_args()
+
+    if args.import_rates:
+        print(f"✅ 已匯入利率 {import_rates(args.import_rates)} 筆")
+    if args.force:
+        price_store.refresh(list(MACRO_SYMBOLS.values()), force=True)
+    print(json.dumps(get_snapshot(refresh=not args.force), ensure_ascii=False, indent=2))
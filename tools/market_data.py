@@ -0,0 +1,236 @@
+# tools/market_data.py
+# 市場數據 (yfinance) 批次報價引擎
+# - 價格：一次 yf.download 批次抓多檔日線，只取收盤價計算漲跌 (輕量、可向量化)
+# - 公司檔案 (名稱 / 產業 / 簡介 / 市值)：變動很慢，個別查 Ticker.info 後長時間快取
+# - 單檔報價 (get_stock_info) 走跨行程共用快取，多個副本 / session 同時查同一檔只抓一次
+# - 即時報價 (get_live_quotes)：行程內所有 session 關注的代號合併成一次批次輪詢，只回傳有變動的代號
+# 與 Streamlit 無關的純函式，Dashboard 的快取版本與背景執行緒都呼叫這裡
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import yfinance as yf
+
+try:
+    from tools import rate_limit, shared_cache, telemetry
+except ImportError:
+    import rate_limit, shared_cache, telemetry  # 直接在 tools 資料夾執行
+
+PROFILE_TTL = 24 * 3600       # 公司檔案快取 (秒)
+QUOTE_TTL = 5 * 60            # 單檔報價共用快取 (秒)
+PROFILE_WORKERS = 8
+LIVE_INTERVAL = 15            # 即時報價輪詢間隔 (秒)
+LIVE_IDLE = 120               # 超過這段時間沒有 session 關注的代號就停止輪詢 (秒)
+
+_profiles = {}                # symbol -> (fetched_at, profile)
+_profile_lock = threading.Lock()
+
+
+def _normalize_symbols(symbols):
+    seen = []
+    for symbol in symbols:
+        symbol = str(symbol).strip().upper()
+        if symbol and symbol not in seen:
+            seen.append(symbol)
+    return seen
+
+
+# --- 1. 批次價格 ---
+def get_quotes(symbols):
+    # 回傳 DataFrame (index = symbol)：price / previous_close / change / pct_change
+    symbols = _normalize_symbols(symbols)
+    columns = ["price", "previous_close", "change", "pct_change"]
+    if not symbols:
+        return pd.DataFrame(columns=columns)
+
+    with telemetry.span("yahoo.quotes", symbols=len(symbols)) as span:
+        data = rate_limit.call(
+            "yahoo", yf.download, symbols, period="5d", interval="1d", group_by="column",
+            auto_adjust=False, progress=False, threads=True,
+        )
+        span.set(rows=0 if data is None else len(data))
+    if data is None or data.empty:
+        return pd.DataFrame(index=symbols, columns=columns, dtype=float)
+
+    close = data["Close"]
+    if isinstance(close, pd.Series):
+        close = close.to_frame(symbols[0])
+
+    # 各市場交易日不同 (例如 BTC 週末也有報價)，各自取最後兩個有效收盤
+    stacked = close.stack().dropna()
+    from_end = stacked.groupby(level=1).cumcount(ascending=False)
+    quotes = pd.DataFrame({
+        "price": stacked[from_end == 0].droplevel(0),
+        "previous_close": stacked[from_end == 1].droplevel(0),
+    })
+    quotes = quotes.reindex(symbols)
+    quotes["change"] = quotes["price"] - quotes["previous_close"]
+    quotes["pct_change"] = quotes["change"] / quotes["previous_close"] * 100
+    return quotes[columns]
+
+
+# --- 2. 公司檔案 (長 TTL) ---
+def _fetch_profile(symbol):
+    with telemetry.span("yahoo.profile", symbol=symbol) as span:
+        info = rate_limit.call("yahoo", lambda: yf.Ticker(symbol).info)
+        span.set(bytes_in=telemetry.payload_bytes(info))
+    return {
+        "name": info.get('shortName', symbol),
+        "sector": info.get('sector', 'N/A'),
+        "market_cap": info.get('marketCap', 0),
+        "summary": info.get('longBusinessSummary', '無描述'),
+    }
+
+
+def get_profile(symbol):
+    symbol = symbol.upper()
+    with _profile_lock:
+        cached = _profiles.get(symbol)
+    if cached and time.time() - cached[0] < PROFILE_TTL:
+        return cached[1]
+    try:
+        profile = _fetch_profile(symbol)
+    except Exception:
+        # 查不到時沿用過期資料，都沒有就給預設值
+        return cached[1] if cached else {"name": symbol, "sector": "N/A", "market_cap": 0, "summary": "無描述"}
+    with _profile_lock:
+        _profiles[symbol] = (time.time(), profile)
+    return profile
+
+
+def get_profiles(symbols):
+    symbols = _normalize_symbols(symbols)
+    with ThreadPoolExecutor(max_workers=PROFILE_WORKERS) as pool:
+        return dict(zip(symbols, pool.map(get_profile, symbols)))
+
+
+# --- 3. 對外介面 ---
+def get_watchlist(symbols, with_profile=True):
+    # 觀察清單：一次批次報價，公司檔案走長 TTL 快取
+    quotes = get_quotes(symbols)
+    if with_profile and not quotes.empty:
+        profiles = pd.DataFrame.from_dict(get_profiles(quotes.index), orient="index")
+        quotes = quotes.join(profiles[["name", "sector", "market_cap"]])
+    return quotes
+
+
+def fetch_stock_info(symbol):
+    try:
+        quote = get_quotes([symbol]).iloc[0]
+        price = quote["price"]
+        if pd.isna(price):
+            return None
+        change = 0 if pd.isna(quote["change"]) else float(quote["change"])
+        pct_change = 0 if pd.isna(quote["pct_change"]) else float(quote["pct_change"])
+        return dict(
+            get_profile(symbol),
+            price=float(price),
+            change=change,
+            pct_change=pct_change,
+        )
+    except Exception as e:
+        return None
+
+
+def get_stock_info(symbol):
+    # fetch_stock_info 的共用快取版本 (跨行程 single-flight)；抓不到 (None) 不快取
+    symbol = str(symbol).strip().upper()
+    return shared_cache.get_cache().get_or_fetch(
+        f"stock_info:{symbol}", lambda: fetch_stock_info(symbol), ttl=QUOTE_TTL
+    )
+
+
+# --- 4. 即時報價 (共用批次輪詢) ---
+class LivePoller:
+    # 行程內所有 session 共用：關注中的代號合併成一次 get_quotes (只抓價格)，最多每 interval 秒一次
+    # 每輪輪詢 version 加 1，只有價格變動的代號會標上新的 version；session 帶著上次的 version 來只拿變動
+    def __init__(self, interval=LIVE_INTERVAL, idle=LIVE_IDLE):
+        self.interval = interval
+        self.idle = idle
+        self.version = 0
+        self.polled_at = 0.0
+        self.stats = {"requests": 0, "polls": 0, "symbols_polled": 0, "changed": 0, "errors": 0}
+        self._watch = {}        # symbol -> 最後一次被關注的時間
+        self._polled = set()    # 上一輪輪詢過的代號 (查不到價格的也算，避免一直重打)
+        self._quotes = {}       # symbol -> (version, quote)
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+
+    def _due(self, symbols, now):
+        return now - self.polled_at >= self.interval or any(s not in self._polled for s in symbols)
+
+    def _poll(self, symbols):
+        # 同一時間只有一個執行緒輪詢；排隊的執行緒拿到鎖後再檢查一次，通常已經不用再抓
+        with self._poll_lock:
+            now = time.time()
+            with self._lock:
+                if not self._due(symbols, now):
+                    return
+                self._watch = {s: t for s, t in self._watch.items() if now - t < self.idle}
+                self._quotes = {s: q for s, q in self._quotes.items() if s in self._watch}
+                watched = sorted(self._watch)
+            try:
+                table = get_quotes(watched)
+            except Exception as e:
+                print(f"⚠️ 即時報價輪詢失敗: {e}")
+                table = None
+            with self._lock:
+                # 失敗也算輪詢過，下一輪再試 (不讓每個 session 各自重打)
+                self.polled_at = now
+                self._polled = set(watched)
+                self.stats["polls"] += 1
+                self.stats["symbols_polled"] += len(watched)
+                if table is None:
+                    self.stats["errors"] += 1
+                    return
+                self.version += 1
+                for symbol in watched:
+                    quote = _live_quote(table, symbol)
+                    if quote is not None and quote != self._quotes.get(symbol, (0, None))[1]:
+                        self._quotes[symbol] = (self.version, quote)
+                        self.stats["changed"] += 1
+
+    def get(self, symbols, since=0):
+        # 回傳 (version, {symbol: quote})：只含 since 之後有變動的代號；查不到價格的代號不會出現
+        symbols = _normalize_symbols(symbols)
+        now = time.time()
+        with self._lock:
+            self.stats["requests"] += 1
+            for symbol in symbols:
+                self._watch[symbol] = now
+            due = self._due(symbols, now)
+        if due:
+            self._poll(symbols)
+        with self._lock:
+            if since > self.version:
+                since = 0   # 行程重啟過，session 記得的 version 已無意義
+            changed = {s: self._quotes[s][1] for s in symbols if s in self._quotes and self._quotes[s][0] > since}
+            return self.version, changed
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, version=self.version, watching=len(self._watch),
+                        age=round(time.time() - self.polled_at, 1) if self.polled_at else None)
+
+
+def _live_quote(table, symbol):
+    if symbol not in table.index or pd.isna(table.loc[symbol, "price"]):
+        return None
+    row = table.loc[symbol]
+    return {
+        "price": float(row["price"]),
+        "change": 0.0 if pd.isna(row["change"]) else float(row["change"]),
+        "pct_change": 0.0 if pd.isna(row["pct_change"]) else float(row["pct_change"]),
+    }
+
+
+_live = LivePoller()
+
+
+def get_live_quotes(symbols, since=0):
+    return _live.get(symbols, since)
+
+
+def get_live_stats():
+    return _live.get_stats()
@@ -1,61 +1,100 @@
 # tools/memory_logger.py
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import sys
 import json
 import datetime
 import os
-import streamlit as st # 記得引入這個
+import re
+import threading
 
-# --- 1. 自動路徑修正 (Path Logic) ---
-# 確保無論是從 dashboard 呼叫還是直接執行，都能找到金鑰
-KEY_PATH = 'config/service_account.json'
-if not os.path.exists(KEY_PATH):
-    # 如果找不到，試試看上一層目錄 (針對直接在 tools 資料夾執行的情況)
-    KEY_PATH = '../config/service_account.json'
-
-# --- 2. Google Sheets 連接設定 ---
-# tools/memory_logger.py 修正版
+try:
+    from tools import memory_mirror, rate_limit, shared_cache, sheets, telemetry
+    from tools.spool_writer import SpoolWriter
+except ImportError:
+    import memory_mirror, rate_limit, shared_cache, sheets, telemetry  # 直接在 tools 資料夾執行
+    from spool_writer import SpoolWriter
 
+# --- 1. Google Sheets 連接設定 ---
+# 連線由 tools/sheets.py 統一提供，授權與 worksheet handle 跨呼叫沿用
 def get_sheet():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    
     try:
-        # --- 優先嘗試：從 Streamlit 雲端保險箱讀取 ---
-        if "gcp_service_account" in st.secrets:
-            # 這是雲端模式
-            creds_dict = dict(st.secrets["gcp_service_account"])
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        else:
-            # --- 備案：本地模式 (讀取檔案) ---
-            key_path = 'config/service_account.json'
-            if not os.path.exists(key_path):
-                key_path = '../config/service_account.json'
-            creds = ServiceAccountCredentials.from_json_keyfile_name(key_path, scope)
-
-        client = gspread.authorize(creds)
-        sheet = client.open("System_v14_Memory_Log").sheet1
-        return sheet
-
+        return sheets.get_worksheet()
     except Exception as e:
         print(f"連線失敗: {str(e)}")
         return None
 
+# --- 2. 背景批次寫入 (Write-Behind) ---
+# log_decision 只負責把資料寫進本地 spool 檔，真正的 Sheets 寫入在背景批次完成
+SPOOL_PATH = os.path.join(memory_mirror.DATA_DIR, "memory_spool.jsonl")
+
+# append 不是冪等的：送出後斷線 / 逾時，資料可能其實已經寫進 Sheet。
+# 因此 append 不走 sheets.run 的重連重送，失敗時交給 spool 退避重試；
+# 上一次結果不明 (失敗，或行程重啟後第一次送出重播的資料) 時，先讀 Sheet 略過已經寫入的列。
+_verify_next = True
+VERIFY_COLUMNS = "A:E"     # ID | Time | Ticker | Decision | Rationale
+
+def _row_key(row):
+    return tuple(str(v) for v in row[:5])
+
+def _unsent(ws, rows):
+    values = rate_limit.call("sheets", ws.get_values, VERIFY_COLUMNS)
+    landed = {_row_key(v) for v in values}
+    pending = [r for r in rows if _row_key(r) not in landed]
+    if len(pending) < len(rows):
+        print(f"♻️ {len(rows) - len(pending)} 筆資料上次其實已寫入 Sheet，不重複寫入")
+    return pending
+
+def _flush_rows(rows):
+    global _verify_next
+    try:
+        ws = sheets.get_worksheet()
+        if _verify_next:
+            rows = _unsent(ws, rows)
+            if not rows:
+                _verify_next = False
+                return
+        response = rate_limit.call("sheets", ws.append_rows, rows)
+    except Exception as e:
+        _verify_next = True
+        sheets.discard_if_stale(e)
+        raise
+    _verify_next = False
+
+    # 同步併入本地鏡像，下一次檢索的索引即可增量收錄這些決策
+    try:
+        updated_range = response.get("updates", {}).get("updatedRange", "")
+        match = re.search(r"![A-Z]+(\d+)", updated_range)
+        if match:
+            memory_mirror.append_local(int(match.group(1)), rows)
+        # 其他 session / 行程快取的檢索結果已不完整
+        shared_cache.get_cache().invalidate("memory:")
+    except Exception as e:
+        print(f"⚠️ 本地鏡像更新略過: {e}")
+
+    for row in rows:
+        print(f"✅ [System Logged] ID: {row[0]} | Type: {row[9]}")
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    # 第一次使用時建立，並重播上次未送出的 spool 資料
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = SpoolWriter(SPOOL_PATH, _flush_rows)
+    return _writer
+
+def spool_stats():
+    # 佇列深度與寫入延遲 (秒)
+    return get_writer().get_stats()
+
 # --- 3. 寫入邏輯 (Append Logic) ---
 def log_decision(data_json):
-    sheet = get_sheet()
-    if not sheet:
-        return "Connection Failed"
-    
-    # --- 新增這行：印出它到底連到哪裡去了 ---
-    print(f"🔗 寫入目標網址: {sheet.spreadsheet.url}") 
-    # -------------------------------------
-
     try:
         data = json.loads(data_json)
         
-        # 準備寫入的資料列 (Row) - 對應 Google Sheet 的 10 個欄位
-        # 順序：ID | Time | Ticker | Decision | Rationale | Risk | Entry | Cycle | Keywords | PACER
+        # 準備寫入的資料列 (Row) - 對應 Google Sheet 的 11 個欄位 (memory_mirror.MEMORY_COLUMNS)
+        # 順序：ID | Time | Ticker | Decision | Rationale | Risk | Entry | Cycle | Keywords | PACER | Analysis
         row = [
             data.get('log_id', f"AUTO-{datetime.datetime.now().strftime('%Y%m%d%H%M')}"),
             str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M')),
@@ -70,10 +109,10 @@ def log_decision(data_json):
             data.get('full_analysis', 'N/A')
         ]
         
-        # 寫入最後一列
-        sheet.append_row(row)
-        print(f"✅ [System Logged] ID: {row[0]} | Type: {row[9]}")
-        return "Success"
+        # 先落地到 spool 檔再立即返回，連線失敗也不會遺失
+        with telemetry.span("archive.spool", bytes_out=telemetry.payload_bytes(data_json)):
+            get_writer().enqueue(row)
+        return "Queued"
         
     except Exception as e:
         print(f"❌ Error logging data: {str(e)}")
@@ -105,5 +144,13 @@ if __name__ == "__main__":
             "pacer_type": "T"
         })
         
+        sheet = get_sheet()
+        if sheet:
+            print(f"🔗 寫入目標網址: {sheet.spreadsheet.url}")
+
         print(f"📡 正在嘗試寫入測試數據...")
-        log_decision(test_payload)
\ No newline at end of file
+        log_decision(test_payload)
+
+    # CLI 結束前等背景佇列送完，未送完的資料留在 spool 下次重播
+    if not get_writer().flush(timeout=60):
+        print(f"⏳ 尚有資料未寫入，已保留在 {SPOOL_PATH}: {spool_stats()}")
@@ -0,0 +1,346 @@
+# tools/memory_mirror.py
+# Google Sheets 記憶庫的本地鏡像 (SQLite)
+# 首次建立時完整下載一次，之後每次同步只抓「上次已知列數」之後新增的列，
+# 搜尋一律在本地副本上執行，同步成本只跟新增列數有關，而不是整個歷史。
+# 同步只讀 A ~ J 摘要欄；K 欄 full_analysis (報告全文，佔大部分資料量) 存在另一張表，
+# 依列號以批次範圍請求補抓 (load_bodies)，本機寫入的決策則直接帶入全文。
+# 全文索引 (memory_index) 會在同步後把新列的全文補進來，摘要讀取 (回測 / 統計) 則完全不碰全文。
+import sqlite3
+import threading
+import time
+import os
+
+try:
+    from tools import rate_limit, telemetry
+except ImportError:
+    import rate_limit, telemetry  # 直接在 tools 資料夾執行
+
+# 與 memory_logger 寫入順序一致的 11 個欄位 (Sheet 的 A ~ K 欄)
+MEMORY_COLUMNS = [
+    "log_id", "timestamp", "ticker", "decision", "rationale", "risk_score",
+    "entry_price", "cycle_position", "keywords", "pacer_type", "full_analysis",
+]
+LAST_COLUMN = chr(ord("A") + len(MEMORY_COLUMNS) - 1)  # "K"
+
+# 摘要欄 (同步 / 搜尋用) 與全文欄 (延遲載入)
+BODY_COLUMN_NAME = "full_analysis"
+SUMMARY_COLUMNS = [c for c in MEMORY_COLUMNS if c != BODY_COLUMN_NAME]
+SUMMARY_LAST_COLUMN = chr(ord("A") + len(SUMMARY_COLUMNS) - 1)  # "J"
+BODY_COLUMN = LAST_COLUMN  # "K"
+BODY_BATCH_ROWS = 2000     # 一次 batch_get 最多幾列全文 (連續列合併成同一個範圍)
+BODY_BATCH_RUNS = 100      # 一次 batch_get 最多幾段不連續的範圍 (請求 URL 長度限制)
+
+# 本地資料路徑 (與 config/ 相同，以執行目錄為準)
+DATA_DIR = os.environ.get("SYSTEM_V14_DATA_DIR", "data")
+MIRROR_PATH = os.path.join(DATA_DIR, "memory_mirror.db")
+
+# 兩次同步之間的最短間隔 (秒)；間隔內的搜尋直接使用本地副本，不連線
+SYNC_INTERVAL = 30
+
+_lock = threading.Lock()
+
+
+# --- 1. 本地資料庫 ---
+def _connect():
+    os.makedirs(os.path.dirname(MIRROR_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(MIRROR_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    existing = [r[1] for r in conn.execute("PRAGMA table_info(memory)")]
+    if BODY_COLUMN_NAME in existing:
+        # 舊版鏡像 (全文與摘要同表)：直接丟掉，下次同步重建
+        conn.executescript("DROP TABLE memory; DROP TABLE IF EXISTS meta;")
+    cols = ", ".join(f"{c} TEXT" for c in SUMMARY_COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS memory (row_num INTEGER PRIMARY KEY, {cols})")
+    conn.execute("CREATE TABLE IF NOT EXISTS bodies (row_num INTEGER PRIMARY KEY, log_id TEXT, full_analysis TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+
+def _get_meta(conn):
+    return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+
+
+def _set_meta(conn, **values):
+    conn.executemany(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        [(k, str(v)) for k, v in values.items()],
+    )
+
+
+def _normalize(row, width=len(SUMMARY_COLUMNS)):
+    # Sheets 會省略尾端空白儲存格，補齊欄數 (摘要 10 欄；完整列 11 欄)
+    row = [("" if v is None else str(v)) for v in row[:width]]
+    return row + [""] * (width - len(row))
+
+
+def _insert_rows(conn, first_row_num, rows):
+    # rows: 摘要列 (A ~ J)，或本機寫入的完整列 (A ~ K，全文一併存入 bodies)
+    placeholders = ", ".join("?" * (len(SUMMARY_COLUMNS) + 1))
+    params, bodies = [], []
+    for i, row in enumerate(rows):
+        if not any(str(v).strip() for v in row):
+            continue  # 跳過整列空白
+        summary = _normalize(row)
+        params.append([first_row_num + i] + summary)
+        if len(row) > len(SUMMARY_COLUMNS):
+            bodies.append((first_row_num + i, summary[0], str(row[len(SUMMARY_COLUMNS)] or "")))
+    conn.executemany(f"INSERT OR REPLACE INTO memory VALUES ({placeholders})", params)
+    conn.executemany("INSERT OR REPLACE INTO bodies VALUES (?, ?, ?)", bodies)
+    return len(params)
+
+
+# --- 2. 同步邏輯 (Full / Incremental) ---
+def _read(sheet, range_name):
+    with telemetry.span("sheets.read", range=range_name) as span:
+        values = rate_limit.call("sheets", sheet.get_values, range_name)
+        span.set(rows=len(values), bytes_in=telemetry.payload_bytes(values))
+    return values
+
+
+def _full_sync(conn, sheet):
+    values = _read(sheet, f"A2:{SUMMARY_LAST_COLUMN}")
+    conn.execute("DELETE FROM memory")
+    conn.execute("DELETE FROM bodies")
+    added = _insert_rows(conn, 2, values)
+    return "full", added, 1 + len(values)
+
+
+def _incremental_sync(conn, sheet, last_row, last_log_id):
+    # 從最後一筆已知列開始抓：第一列用來驗證 log_id，其餘即為新增列
+    values = _read(sheet, f"A{last_row}:{SUMMARY_LAST_COLUMN}")
+    if not values or _normalize(values[0])[0] != last_log_id:
+        return None  # 資料表被改寫或刪列，交給 full sync
+    added = _insert_rows(conn, last_row + 1, values[1:])
+    return "incremental", added, last_row + len(values) - 1
+
+
+def sync(get_sheet, force=False):
+    """get_sheet: 回傳 gspread worksheet 的函式，只有在真的需要同步時才會被呼叫"""
+    with _lock:
+        conn = _connect()
+        try:
+            meta = _get_meta(conn)
+            last_row = int(meta.get("last_row", 0))
+            if not force and last_row and time.time() - float(meta.get("last_sync", 0)) < SYNC_INTERVAL:
+                return {"mode": "skipped", "new_rows": 0, "total_rows": count()}
+
+            sheet = get_sheet()
+            result = None
+            if not force and last_row > 1:
+                result = _incremental_sync(conn, sheet, last_row, meta.get("last_log_id", ""))
+            if result is None:
+                result = _full_sync(conn, sheet)
+                _set_meta(conn, generation=int(meta.get("generation", 0)) + 1)
+
+            mode, added, new_last_row = result
+            tail = conn.execute(
+                "SELECT row_num, log_id FROM memory ORDER BY row_num DESC LIMIT 1"
+            ).fetchone()
+            _set_meta(
+                conn,
+                last_row=tail[0] if tail else new_last_row,
+                last_log_id=tail[1] if tail else "",
+                last_sync=time.time(),
+            )
+            conn.commit()
+            return {"mode": mode, "new_rows": added, "total_rows": count(conn)}
+        finally:
+            conn.close()
+
+
+def append_local(first_row_num, rows):
+    # log_decision 寫入成功後直接併入鏡像，省下一次同步；不連續時留給下次 sync
+    with _lock:
+        conn = _connect()
+        try:
+            meta = _get_meta(conn)
+            last_row = int(meta.get("last_row", 0))
+            if not last_row or not rows or first_row_num != last_row + 1:
+                return False
+            _insert_rows(conn, first_row_num, rows)
+            _set_meta(conn, last_row=first_row_num + len(rows) - 1, last_log_id=_normalize(rows[-1])[0])
+            conn.commit()
+            return True
+        finally:
+            conn.close()
+
+
+# --- 3. 讀取介面 ---
+def count(conn=None):
+    own = conn is None
+    conn = conn or _connect()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+    finally:
+        if own:
+            conn.close()
+
+
+def generation():
+    # 每次 full sync 加一，索引據此判斷是否需要整個重建
+    conn = _connect()
+    try:
+        return int(_get_meta(conn).get("generation", 0))
+    finally:
+        conn.close()
+
+
+# 摘要欄 + 已載入的全文 (沒有載入的紀錄不含 full_analysis 鍵)
+_SELECT = (
+    f"SELECT m.row_num, {', '.join('m.' + c for c in SUMMARY_COLUMNS)}, b.full_analysis "
+    "FROM memory m LEFT JOIN bodies b ON b.row_num = m.row_num"
+)
+
+
+def _record(row):
+    record = dict(zip(SUMMARY_COLUMNS, row[1:-1]))
+    if row[-1] is not None:
+        record[BODY_COLUMN_NAME] = row[-1]
+    return record
+
+
+def load_records():
+    # 只有摘要欄 (回測 / 統計用)
+    conn = _connect()
+    try:
+        cur = conn.execute(f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM memory ORDER BY row_num")
+        return [dict(zip(SUMMARY_COLUMNS, row)) for row in cur]
+    finally:
+        conn.close()
+
+
+def rows_since(row_num):
+    # 回傳 (row_num, record) ，供索引增量更新
+    conn = _connect()
+    try:
+        cur = conn.execute(f"{_SELECT} WHERE m.row_num > ? ORDER BY m.row_num", (row_num,))
+        return [(row[0], _record(row)) for row in cur]
+    finally:
+        conn.close()
+
+
+def load_rows(row_nums):
+    # 依 row_num 取回紀錄 -> {row_num: record}
+    if not row_nums:
+        return {}
+    conn = _connect()
+    try:
+        marks = ", ".join("?" * len(row_nums))
+        cur = conn.execute(f"{_SELECT} WHERE m.row_num IN ({marks})", list(row_nums))
+        return {row[0]: _record(row) for row in cur}
+    finally:
+        conn.close()
+
+
+def find_rows(log_ids):
+    # log_id -> row_num (同一 log_id 出現多次時取最新一列)
+    if not log_ids:
+        return {}
+    conn = _connect()
+    try:
+        marks = ", ".join("?" * len(log_ids))
+        cur = conn.execute(
+            f"SELECT log_id, MAX(row_num) FROM memory WHERE log_id IN ({marks}) GROUP BY log_id", list(log_ids)
+        )
+        return dict(cur.fetchall())
+    finally:
+        conn.close()
+
+
+# --- 4. 全文延遲載入 ---
+def _runs(row_nums):
+    # 排序後的列號切成連續區段 [(first, last)]，每段不超過 BODY_BATCH_ROWS 列
+    runs = []
+    for r in row_nums:
+        if runs and r == runs[-1][1] + 1 and r - runs[-1][0] < BODY_BATCH_ROWS:
+            runs[-1][1] = r
+        else:
+            runs.append([r, r])
+    return runs
+
+
+def _batches(runs):
+    # 區段打包成請求：每個請求的總列數與區段數都有上限
+    batch, rows = [], 0
+    for first, last in runs:
+        size = last - first + 1
+        if batch and (rows + size > BODY_BATCH_ROWS or len(batch) >= BODY_BATCH_RUNS):
+            yield batch
+            batch, rows = [], 0
+        batch.append((first, last))
+        rows += size
+    if batch:
+        yield batch
+
+
+def _cell(values, i):
+    # Sheets 會省略範圍尾端的空白列 / 空白儲存格
+    return str(values[i][0]) if i < len(values) and values[i] else ""
+
+
+def _fetch_bodies(sheet, expected):
+    # expected: {row_num: log_id}；每個連續區段讀 A (驗證 log_id) 與 K (全文) 兩個範圍，批次送出
+    bodies = {}
+    for batch in _batches(_runs(sorted(expected))):
+        ranges = []
+        for first, last in batch:
+            ranges += [f"A{first}:A{last}", f"{BODY_COLUMN}{first}:{BODY_COLUMN}{last}"]
+        with telemetry.span("sheets.read_bodies", rows=sum(b - a + 1 for a, b in batch), ranges=len(batch)) as span:
+            results = rate_limit.call("sheets", sheet.batch_get, ranges)
+            span.set(bytes_in=telemetry.payload_bytes(results))
+        for j, (first, last) in enumerate(batch):
+            log_ids, texts = results[2 * j], results[2 * j + 1]
+            for i, r in enumerate(range(first, last + 1)):
+                if r not in expected or _cell(log_ids, i) != expected[r]:
+                    continue  # 不是要的列，或資料表已被改寫 (列位移)，留給下次 full sync
+                bodies[r] = _cell(texts, i)
+    return bodies
+
+
+def load_bodies(row_nums, get_sheet=None):
+    # {row_num: full_analysis}；本地沒有的依列號向 Sheets 批次補抓並存下 (get_sheet=None 時只查本地)
+    row_nums = sorted({int(r) for r in row_nums})
+    if not row_nums:
+        return {}
+    conn = _connect()
+    try:
+        marks = ", ".join("?" * len(row_nums))
+        found = dict(conn.execute(
+            f"SELECT row_num, full_analysis FROM bodies WHERE row_num IN ({marks})", row_nums
+        ).fetchall())
+        missing = [r for r in row_nums if r not in found]
+        if not missing or get_sheet is None:
+            return found
+        marks = ", ".join("?" * len(missing))
+        expected = dict(conn.execute(
+            f"SELECT row_num, log_id FROM memory WHERE row_num IN ({marks})", missing
+        ).fetchall())
+    finally:
+        conn.close()
+
+    if not expected:
+        return found
+    fetched = _fetch_bodies(get_sheet(), expected)
+    with _lock:
+        conn = _connect()
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO bodies VALUES (?, ?, ?)",
+                [(r, expected[r], body) for r, body in fetched.items()],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    found.update(fetched)
+    return found
+
+
+if __name__ == "__main__":
+    # 同步鏡像：python tools/memory_mirror.py [--full]  (--full 強制完整重建)
+    import sys
+    try:
+        from tools import sheets
+    except ImportError:
+        import sheets
+    stats = sync(sheets.get_worksheet, force="--full" in sys.argv)
+    print(f"✅ 記憶鏡像同步完成: {stats}")
@@ -0,0 +1,79 @@
+# tools/pipeline.py
+# 推演流程的並行執行器
+# 互不相依的 I/O 階段 (記憶檢索、行情刷新、額外情報) 丟進執行緒池同時跑，
+# 需要結果時才等待；每個階段都記錄起訖時間，總耗時約等於最慢的階段。
+# 每個階段同時是一個 telemetry span，背景執行緒沿用送出時的 context (trace)。
+import contextlib
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from tools import telemetry
+except ImportError:
+    import telemetry  # 直接在 tools 資料夾執行
+
+
+class StagePipeline:
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self.timings = {}   # name -> {"start": 秒, "end": 秒, "seconds": 秒}，相對於流程開始
+
+    def _record(self, name, start, end):
+        with self._lock:
+            self.timings[name] = {
+                "start": round(start - self._t0, 4),
+                "end": round(end - self._t0, 4),
+                "seconds": round(end - start, 4),
+            }
+
+    def _timed(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with telemetry.span(name):
+                return fn(*args, **kwargs)
+        finally:
+            self._record(name, start, time.perf_counter())
+
+    def submit(self, name, fn, *args, **kwargs):
+        # 背景執行；之後用 result(name) 取回
+        ctx = contextvars.copy_context()
+        self._futures[name] = self._executor.submit(ctx.run, self._timed, name, fn, *args, **kwargs)
+        return self._futures[name]
+
+    def run(self, name, fn, *args, **kwargs):
+        # 在目前執行緒執行 (例如需要更新 Streamlit 元件的 LLM 串流)，同樣計時
+        return self._timed(name, fn, *args, **kwargs)
+
+    @contextlib.contextmanager
+    def stage(self, name, **attrs):
+        # 行內程式碼區塊的計時版本：with pipeline.stage("llm") as span: span.set(tokens_in=...)
+        start = time.perf_counter()
+        try:
+            with telemetry.span(name, **attrs) as span:
+                yield span
+        finally:
+            self._record(name, start, time.perf_counter())
+
+    def has(self, name):
+        return name in self._futures
+
+    def result(self, name, timeout=None):
+        # 階段內的例外會在這裡重新拋出
+        return self._futures[name].result(timeout=timeout)
+
+    def elapsed(self):
+        return round(time.perf_counter() - self._t0, 4)
+
+    def summary(self):
+        # 依開始時間排序的階段清單，加上整體耗時
+        with self._lock:
+            stages = sorted(self.timings.items(), key=lambda item: item[1]["start"])
+        return {"total_seconds": self.elapsed(), "stages": [dict(v, stage=k) for k, v in stages]}
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
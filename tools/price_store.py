@@ -0,0 +1,162 @@
+# tools/price_store.py
+# 本地日收盤價存放區 (Parquet，每個代號一個檔)，存的是還原權值 (分割 + 股利) 後的收盤價 (Adj Close)
+# 第一次抓 DEFAULT_HISTORY 的歷史，之後只從「倒數第二筆」起下載並附加 (最後一筆可能是盤中價，一併覆蓋)；
+# 倒數第二筆是已收盤的價格，重新下載的值與存的不同，代表之後發生分割 / 除息、整段還原價都變了，
+# 這時改抓該代號的完整歷史取代舊檔 (只附加新日期會在分割日出現假的暴跌 / 暴漲)。
+# 同一批需要更新的代號合併成一次 yf.download。讀取不需連線，宏觀指標 / 回測都從這裡取價。
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    from tools import market_data, rate_limit, telemetry
+    from tools.memory_mirror import DATA_DIR
+except ImportError:
+    import market_data, rate_limit, telemetry  # 直接在 tools 資料夾執行
+    from memory_mirror import DATA_DIR
+
+PRICE_DIR = os.path.join(DATA_DIR, "prices")
+DEFAULT_HISTORY = "3y"          # 第一次下載的歷史長度 (yfinance period)
+REFRESH_INTERVAL = 15 * 60      # 同一代號兩次更新之間的最短間隔 (秒)
+ADJUST_TOLERANCE = 1e-5         # 重疊日的還原價相對誤差超過這個值，視為還原因子改變
+
+_lock = threading.Lock()
+_checked = {}                   # symbol -> 上次檢查更新的時間
+_frames = {}                    # symbol -> (mtime, Series)，避免重複讀檔
+
+
+def _path(symbol):
+    return os.path.join(PRICE_DIR, re.sub(r"[^A-Za-z0-9.\-=^]", "_", symbol.upper()) + ".parquet")
+
+
+# --- 1. 讀取 ---
+def load(symbol):
+    # 回傳收盤價 Series (index = 日期)；沒有資料時回傳空 Series
+    path = _path(symbol)
+    if not os.path.exists(path):
+        return pd.Series(dtype=float, name=symbol.upper())
+    mtime = os.path.getmtime(path)
+    cached = _frames.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    series = pd.read_parquet(path)["close"].rename(symbol.upper())
+    _frames[path] = (mtime, series)
+    return series
+
+
+def load_many(symbols):
+    # 寬表：每個代號一欄，依日期對齊 (各市場交易日不同，缺值保留 NaN)
+    return pd.concat([load(s) for s in symbols], axis=1).sort_index()
+
+
+def load_long(symbols):
+    # 長表 (symbol, date, close)，依代號、日期排序；symbol 為 Categorical (回測用，不需對齊日期)
+    names = sorted({s.upper() for s in symbols})
+    series = [load(s).dropna() for s in names]
+    lengths = [len(v) for v in series]
+    # 直接串接 numpy 陣列，數千檔時比 pd.concat / MultiIndex 快很多
+    return pd.DataFrame({
+        "symbol": pd.Categorical.from_codes(np.repeat(np.arange(len(names)), lengths), categories=names),
+        "date": np.concatenate([v.index.to_numpy(dtype="datetime64[ns]") for v in series] or [np.array([], "datetime64[ns]")]),
+        "close": np.concatenate([v.to_numpy(dtype=float) for v in series] or [np.array([])]),
+    })
+
+
+def _save(symbol, series):
+    os.makedirs(PRICE_DIR, exist_ok=True)
+    path = _path(symbol)
+    tmp = path + ".tmp"
+    series.rename("close").to_frame().to_parquet(tmp)
+    os.replace(tmp, path)
+
+
+# --- 2. 增量更新 ---
+def _download(yf, symbols, start=None):
+    kwargs = {"start": start} if start is not None else {"period": DEFAULT_HISTORY}
+    with telemetry.span("yahoo.history", symbols=len(symbols)) as span:
+        data = rate_limit.call(
+            "yahoo", yf.download, symbols, interval="1d", group_by="column", auto_adjust=False,
+            progress=False, threads=True, **kwargs,
+        )
+        span.set(rows=0 if data is None else len(data))
+    if data is None or data.empty:
+        return pd.DataFrame()
+    close = data["Adj Close"] if "Adj Close" in data else data["Close"]
+    if isinstance(close, pd.Series):
+        close = close.to_frame(symbols[0])
+    close.index = pd.to_datetime(close.index).tz_localize(None).normalize()
+    return close
+
+
+def refresh(symbols, force=False):
+    # 只抓缺少的日期；回傳 {symbol: 新增 / 更新筆數}
+    symbols = [s.upper() for s in symbols]
+    now = time.time()
+    with _lock:
+        due = [s for s in symbols if force or now - _checked.get(s, 0) >= REFRESH_INTERVAL]
+        for s in due:
+            _checked[s] = now
+    if not due:
+        return {}
+
+    # 依「從哪天開始補」分組，同組一次下載 (與報價共用 market_data.yf)
+    groups = {}
+    for symbol in due:
+        existing = load(symbol)
+        groups.setdefault(None if existing.empty else existing.index[max(-2, -len(existing))], []).append(symbol)
+
+    added, resync = {}, []
+    for start, group in groups.items():
+        try:
+            fresh = _download(market_data.yf, group, start)
+        except Exception as e:
+            print(f"⚠️ 價格更新失敗 {group}: {e}")
+            continue
+        for symbol in group:
+            if symbol not in fresh:
+                continue
+            new = fresh[symbol].dropna()
+            existing = load(symbol)
+            if start is not None:
+                if start in new.index and not np.isclose(new[start], existing[start], rtol=ADJUST_TOLERANCE, atol=0):
+                    resync.append(symbol)   # 還原因子變了：舊的整段歷史都要重抓
+                    continue
+                new = pd.concat([existing, new[new.index > start]])
+            merged = new[~new.index.duplicated(keep="last")].sort_index()
+            if merged.equals(existing):
+                continue
+            _save(symbol, merged)
+            added[symbol] = len(merged) - len(existing)
+
+    if resync:
+        print(f"♻️ 還原因子改變 (分割 / 除息)，重新下載完整歷史: {resync}")
+        try:
+            fresh = _download(market_data.yf, resync)
+        except Exception as e:
+            print(f"⚠️ 價格重新下載失敗 {resync}: {e}")
+            return added
+        for symbol in resync:
+            if symbol not in fresh or fresh[symbol].dropna().empty:
+                continue
+            existing = load(symbol)
+            merged = fresh[symbol].dropna().sort_index()
+            _save(symbol, merged)
+            added[symbol] = len(merged) - len(existing)
+    return added
+
+
+def get_closes(symbols, refresh_first=True):
+    if refresh_first:
+        refresh(symbols)
+    return load_many([s.upper() for s in symbols])
+
+
+if __name__ == "__main__":
+    # 更新指定代號：python -m tools.price_store HYG BTC-USD HG=F GC=F [--force]
+    import sys
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    print(f"✅ 價格更新完成: {refresh(args, force='--force' in sys.argv)}")
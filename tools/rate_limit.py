@@ -0,0 +1,241 @@
+# tools/rate_limit.py
+# 外部服務 (Google Sheets / Yahoo / Gemini) 的共用限流器
+# - Token bucket：依各服務配額 (每分鐘請求數；Gemini 另有每分鐘 token 數) 平滑送出請求
+# - 429 / 5xx：jittered 指數退避後重試，同一服務的 bucket 一起暫停，避免其他執行緒繼續撞牆
+# - 自適應並行 (AIMD)：被限流時並行上限減半，成功一次加回 1/limit，慢慢回到配額上限
+# 限流狀態在同一行程內共用；多個副本時以環境變數 SYSTEM_V14_<SERVICE>_RPM 等把配額分給各行程。
+# 串流請求 (stream=True)：第一個 chunk 到達前的錯誤照常重試，並行名額保留到串流讀完或關閉才歸還。
+import os
+import random
+import threading
+import time
+
+try:
+    from tools import telemetry
+except ImportError:
+    import telemetry  # 直接在 tools 資料夾執行
+
+# rpm: 每分鐘請求數 / tpm: 每分鐘 token 數 / burst: 瞬間可連發的請求數 / concurrency: 並行上限
+QUOTAS = {
+    "sheets": {"rpm": 60, "burst": 10, "concurrency": 4},      # Sheets API 每使用者每分鐘 60 次
+    "yahoo": {"rpm": 120, "burst": 10, "concurrency": 4},
+    "gemini": {"rpm": 60, "tpm": 1_000_000, "burst": 5, "concurrency": 4},
+}
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0     # 秒
+BACKOFF_MAX = 60.0     # 秒
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 沒有 HTTP 狀態碼的限流例外 (yfinance / google.api_core) 依類別名稱判斷
+RETRY_NAMES = ("RateLimit", "TooManyRequests", "ResourceExhausted", "ServiceUnavailable")
+
+
+# --- 1. 錯誤分類 ---
+def _status(exc):
+    for value in (getattr(exc, "code", None), getattr(exc, "status_code", None),
+                  getattr(getattr(exc, "response", None), "status_code", None)):
+        if isinstance(value, int):
+            return int(value)
+    return None
+
+
+def is_retryable(exc):
+    status = _status(exc)
+    if status is not None:
+        return status in RETRY_STATUS
+    return any(name in type(exc).__name__ for name in RETRY_NAMES)
+
+
+def _retry_after(exc):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def backoff(attempt, floor=0.0):
+    # 指數退避 + jitter (0.5x ~ 1x)，多個執行緒不會同時醒來再撞一次
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+    return max(delay, floor)
+
+
+# --- 2. Token bucket 與自適應並行上限 ---
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate            # 每秒補充的 token
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, cost=1):
+        # 先扣再等：回傳需要等待的秒數 (不足的部分依補充速度換算，也算進暫停時間)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= cost
+            return max(0.0, -self.tokens / self.rate, self.paused_until - now)
+
+    def pause(self, seconds):
+        # 被限流：整個服務暫停 seconds 秒，累積的 burst 也一併清空
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0.0)
+
+
+class AdaptiveLimit:
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.active -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class Stream:
+    # 串流回應的包裝：先讀第一個 chunk (限流 / 5xx 通常在這裡出現，仍在重試範圍內)，
+    # 讀完、讀到錯誤或被丟棄時才歸還並行名額。已交出 chunk 後的錯誤無法重送，記為失敗後丟給呼叫端。
+    def __init__(self, service, response):
+        self._open = False      # 第一個 chunk 就失敗時名額由 Service.call 歸還
+        self._service = service
+        self._chunks = iter(response)
+        self._head = [next(self._chunks, _END)]
+        self._open = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._head:
+            chunk = self._head.pop()
+            if chunk is not _END:
+                return chunk
+            self.close()
+        if not self._open:
+            raise StopIteration
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception as e:
+            throttled = is_retryable(e)
+            if throttled:
+                self._service.requests.pause(backoff(0, _retry_after(e)))
+            self._service._count(failures=1, throttled=int(throttled))
+            self.close(throttled)
+            raise
+
+    def close(self, throttled=False):
+        if self._open:
+            self._open = False
+            self._service.concurrency.release(throttled)
+
+    def __del__(self):
+        # 對沖輸掉、沒人讀的串流也要還名額
+        self.close()
+
+
+_END = object()
+
+
+# --- 3. 服務 ---
+class Service:
+    def __init__(self, name, rpm, burst=1, concurrency=1, tpm=None):
+        self.name = name
+        self.requests = TokenBucket(rpm / 60, burst)
+        self.tokens = TokenBucket(tpm / 60, tpm) if tpm else None
+        self.concurrency = AdaptiveLimit(concurrency)
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "failures": 0, "wait_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def _wait(self, tokens):
+        wait = self.requests.reserve(1)
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > 0:
+            self._count(wait_seconds=wait)
+            telemetry.current_span().set(throttle_wait=round(wait, 4))
+            time.sleep(wait)
+
+    def call(self, fn, *args, tokens=0, **kwargs):
+        # fn(*args, **kwargs)；tokens: 這次請求預估的 token 數 (只有設定 tpm 的服務會用到)
+        # stream=True 時回傳 Stream，並行名額交給它在讀完後歸還
+        self._count(calls=1)
+        for attempt in range(MAX_RETRIES + 1):
+            self._wait(tokens)
+            self.concurrency.acquire()
+            throttled = False
+            streaming = False
+            try:
+                result = fn(*args, **kwargs)
+                if kwargs.get("stream"):
+                    result = Stream(self, result)
+                    streaming = True
+                return result
+            except Exception as e:
+                throttled = is_retryable(e)
+                if not throttled or attempt == MAX_RETRIES:
+                    self._count(failures=1)
+                    raise
+                delay = backoff(attempt, _retry_after(e))
+                self.requests.pause(delay)
+                self._count(retries=1, throttled=1)
+                telemetry.current_span().set(retries=1)
+                print(f"⏳ {self.name} 被限流 ({e.__class__.__name__})，{delay:.1f}s 後重試 ({attempt + 1}/{MAX_RETRIES})")
+            finally:
+                if not streaming:
+                    self.concurrency.release(throttled)
+            time.sleep(delay)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats, wait_seconds=round(self.stats["wait_seconds"], 3))
+        return dict(stats, concurrency_limit=round(self.concurrency.limit, 2), active=self.concurrency.active)
+
+
+# --- 4. 行程內共用實例 (配額可由環境變數覆寫，例如 SYSTEM_V14_GEMINI_RPM=1000) ---
+def _quota(name):
+    quota = dict(QUOTAS[name])
+    for key in ("rpm", "tpm", "burst", "concurrency"):
+        value = os.environ.get(f"SYSTEM_V14_{name.upper()}_{key.upper()}")
+        if value:
+            quota[key] = int(value)
+    return quota
+
+
+_services = {name: Service(name, **_quota(name)) for name in QUOTAS}
+
+
+def get_service(name):
+    return _services[name]
+
+
+def call(name, fn, *args, tokens=0, **kwargs):
+    return _services[name].call(fn, *args, tokens=tokens, **kwargs)
+
+
+def get_stats():
+    return {name: service.get_stats() for name, service in _services.items()}
@@ -0,0 +1,217 @@
+# tools/shared_cache.py
+# 跨行程共用快取 (SQLite)：報價、記憶檢索等多個 Streamlit 副本 / 批次行程共用同一份結果
+# - 每個 key 各自的 TTL
+# - Single-flight：同一個 key 同時間只有一個抓取在進行
+#   同一行程內的執行緒等 leader 的結果；不同行程之間以 inflight 租約表協調，
+#   沒拿到租約的行程輪詢結果，租約過期 (持有者當掉) 才接手
+#   抓取期間每 lease / 3 秒續約一次；等待的一方 (同行程或別的行程) 看到續約就繼續等，
+#   冷同步跑得比租約 / 等待上限久也不會被重複抓，只有持有者停止續約 wait_timeout 秒後才自己抓
+# 每個執行緒沿用自己的連線 (WAL + synchronous=NORMAL)：快取遺失只代表重抓，不需要每次寫入都 fsync
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from tools.memory_mirror import DATA_DIR
+except ImportError:
+    from memory_mirror import DATA_DIR  # 直接在 tools 資料夾執行
+
+CACHE_PATH = os.path.join(DATA_DIR, "shared_cache.db")
+
+DEFAULT_TTL = 5 * 60        # 秒
+LEASE_SECONDS = 30          # 抓取租約；超過仍未完成視為持有者已失效
+WAIT_TIMEOUT = 30           # 持有者超過這麼久沒有續約就不再等，自己抓
+POLL_INTERVAL = 0.05
+
+
+class _Flight:
+    # 行程內進行中的一次抓取
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.beat = time.time()     # leader 最後一次續約的時間
+
+
+# --- 1. 快取本體 ---
+class SharedCache:
+    def __init__(self, path=CACHE_PATH, lease=LEASE_SECONDS, wait_timeout=WAIT_TIMEOUT):
+        self.path = path
+        self.lease = lease
+        self.wait_timeout = wait_timeout
+        self.owner = f"{os.getpid()}"
+        self.stats = {"hits": 0, "misses": 0, "fetches": 0, "coalesced": 0, "timeouts": 0}
+        self._flights = {}      # key -> _Flight
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        # 同一執行緒重複使用連線 (path 變了才重開)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.path == self.path:
+            return conn
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS inflight (key TEXT PRIMARY KEY, owner TEXT, lease_until REAL)")
+        self._local.conn, self._local.path = conn, self.path
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        # 過期或不存在時回傳 None
+        row = self._connect().execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, value, ttl=DEFAULT_TTL):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False, default=str), now + ttl),
+            )
+            conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def invalidate(self, prefix):
+        # 刪除所有以 prefix 開頭的 key (例如寫入新決策後清掉 "memory:")
+        self._connect().execute("DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    # --- 2. 跨行程租約 ---
+    def _acquire(self, key):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT lease_until FROM inflight WHERE key = ?", (key,)).fetchone()
+            if row and row[0] > now:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute("INSERT OR REPLACE INTO inflight VALUES (?, ?, ?)", (key, self.owner, now + self.lease))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _renew(self, key):
+        # 仍持有租約才延長 (租約過期被別人接手就不搶回來)
+        self._connect().execute(
+            "UPDATE inflight SET lease_until = ? WHERE key = ? AND owner = ?",
+            (time.time() + self.lease, key, self.owner),
+        )
+
+    def _keep_alive(self, key, stop, flight):
+        # 背景續約，直到抓取結束
+        while not stop.wait(self.lease / 3):
+            flight.beat = time.time()
+            try:
+                self._renew(key)
+            except sqlite3.Error as e:
+                print(f"⚠️ 快取租約續約失敗 ({key}): {e}")
+
+    def _lease_until(self, key):
+        row = self._connect().execute("SELECT lease_until FROM inflight WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _release(self, key):
+        self._connect().execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (key, self.owner))
+
+    def _fetch_shared(self, key, fetch, ttl, flight):
+        deadline = time.time() + self.wait_timeout
+        seen_lease = None
+        while True:
+            if self._acquire(key):
+                stop = threading.Event()
+                try:
+                    # 等租約的期間別的行程可能已經寫入
+                    value = self.get(key)
+                    if value is None:
+                        self._count("fetches")
+                        threading.Thread(target=self._keep_alive, args=(key, stop, flight), name="cache-lease",
+                                         daemon=True).start()
+                        value = fetch()
+                        if value is not None:
+                            self.put(key, value, ttl)
+                    return value
+                finally:
+                    stop.set()
+                    self._release(key)
+            time.sleep(POLL_INTERVAL)
+            value = self.get(key)
+            if value is not None:
+                self._count("coalesced")
+                return value
+            lease_until = self._lease_until(key)
+            if lease_until is not None and lease_until != seen_lease:
+                # 持有者還在續約：從這次續約起重新計算等待上限
+                seen_lease = lease_until
+                deadline = time.time() + self.wait_timeout
+            flight.beat = time.time()   # 自己也還在正常等待，同行程的執行緒繼續等
+            if time.time() > deadline:
+                self._count("timeouts")
+                return fetch()
+
+    # --- 3. 對外介面 ---
+    def get_or_fetch(self, key, fetch, ttl=DEFAULT_TTL):
+        # fetch 回傳 None 視為失敗，不寫入快取 (下一位呼叫者會重抓)
+        value = self.get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+        self._count("misses")
+
+        # 同一行程內：每個 key 只有一個執行緒去抓，其餘等它
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            while not flight.event.wait(POLL_INTERVAL * 10):
+                if time.time() - flight.beat > self.wait_timeout:
+                    self._count("timeouts")
+                    return fetch()
+            self._count("coalesced")
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._fetch_shared(key, fetch, ttl, flight)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            hit_rate = round(self.stats["hits"] / lookups, 3) if lookups else None
+            return dict(self.stats, hit_rate=hit_rate, inflight=len(self._flights))
+
+
+# --- 4. 行程內共用實例 ---
+_cache = SharedCache()
+
+
+def get_cache():
+    return _cache
@@ -0,0 +1,117 @@
+# tools/sheets.py
+# 共用的 Google Sheets 連線 (memory_logger / smart_search / memory_mirror 共用)
+# 授權、HTTP 連線池與 worksheet handle 在同一個行程內只建立一次，
+# Streamlit rerun 不會重新執行模組，因此跨 rerun 沿用同一條連線。
+import os
+import threading
+import time
+
+import gspread
+import requests
+from oauth2client.service_account import ServiceAccountCredentials
+import streamlit as st
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+SHEET_NAME = "System_v14_Memory_Log"
+
+# handle 超過這個時間沒用到就視為可能失效，下次使用前重新開啟 (秒)
+IDLE_RECONNECT = 30 * 60
+
+
+# --- 1. 憑證 (雲端保險箱優先，本地金鑰檔備案) ---
+def load_credentials():
+    if "gcp_service_account" in st.secrets:
+        creds_dict = dict(st.secrets["gcp_service_account"])
+        return ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+
+    # 相容 Dashboard (config/...) 與直接在 tools 資料夾執行 (../config/...)
+    key_path = 'config/service_account.json'
+    if not os.path.exists(key_path):
+        key_path = '../config/service_account.json'
+    return ServiceAccountCredentials.from_json_keyfile_name(key_path, SCOPE)
+
+
+# --- 2. 連線提供者 ---
+class SheetProvider:
+    def __init__(self, sheet_name=SHEET_NAME):
+        self.sheet_name = sheet_name
+        self._lock = threading.Lock()
+        self._client = None
+        self._worksheet = None
+        self._last_used = 0.0
+        self._installed = False
+        self.connects = 0
+
+    def get_worksheet(self):
+        with self._lock:
+            if not self._installed and (self._worksheet is None or time.time() - self._last_used > IDLE_RECONNECT):
+                self._connect()
+            self._last_used = time.time()
+            return self._worksheet
+
+    def _connect(self):
+        # gspread 以 AuthorizedSession 包裝憑證：token 只在過期時自動 refresh，
+        # 底層 requests.Session 的連線池也跟著 client 一起保留
+        if self._client is None:
+            self._client = gspread.authorize(load_credentials())
+        self._worksheet = self._client.open(self.sheet_name).sheet1
+        self.connects += 1
+
+    def install(self, worksheet):
+        # 基準測試 / 壓力測試用：直接指定 worksheet (例如本地假物件)，不連線 Google
+        with self._lock:
+            self._worksheet = worksheet
+            self._installed = worksheet is not None
+
+    def reset(self):
+        with self._lock:
+            if self._installed:
+                return
+            self._client = None
+            self._worksheet = None
+
+    def run(self, fn):
+        # 執行 fn()；連線失效 (斷線 / 401) 時丟掉舊連線重連一次
+        try:
+            return fn()
+        except Exception as e:
+            if not _is_stale(e):
+                raise
+            print(f"🔄 Google Sheets 連線失效，重新連線: {e}")
+            self.reset()
+            return fn()
+
+
+def _is_stale(exc):
+    if isinstance(exc, (requests.exceptions.ConnectionError, ConnectionResetError)):
+        return True
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None) == 401
+
+
+# --- 3. 行程內共用的單一實例 ---
+_provider = SheetProvider()
+
+
+def get_worksheet():
+    return _provider.get_worksheet()
+
+
+def run(fn):
+    return _provider.run(fn)
+
+
+def reset():
+    _provider.reset()
+
+
+def discard_if_stale(exc):
+    # 連線失效時只丟掉舊連線 (下一次 get_worksheet 重連)，不重送請求：給 append 這類不能重複執行的寫入用
+    if _is_stale(exc):
+        _provider.reset()
+        return True
+    return False
+
+
+def install(worksheet):
+    _provider.install(worksheet)
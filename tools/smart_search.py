@@ -1,73 +1,121 @@
 # tools/smart_search.py
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import sys
 import json
-import pandas as pd
-import os
-import streamlit as st
 
-# 自動判斷金鑰路徑 (相容 Dashboard 和 獨立執行)
-# 如果是從上層目錄呼叫，路徑是 config/...
-# 如果是直接執行，路徑是 ../config/...
-KEY_PATH = 'config/service_account.json'
-if not os.path.exists(KEY_PATH):
-    KEY_PATH = '../config/service_account.json'
-    
-def get_client():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    
-    # --- 優先嘗試：從 Streamlit 雲端保險箱讀取 ---
-    if "gcp_service_account" in st.secrets:
-        creds_dict = dict(st.secrets["gcp_service_account"])
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    else:
-        # --- 備案：本地模式 ---
-        key_path = 'config/service_account.json'
-        if not os.path.exists(key_path):
-            key_path = '../config/service_account.json'
-        creds = ServiceAccountCredentials.from_json_keyfile_name(key_path, scope)
-        
-    return gspread.authorize(creds)
+try:
+    from tools import memory_mirror, memory_index, shared_cache, sheets, telemetry
+except ImportError:
+    import memory_mirror, memory_index, shared_cache, sheets, telemetry  # 直接在 tools 資料夾執行
 
-def smart_search(query):
-    try:
-        client = get_client()
-        sheet = client.open("System_v14_Memory_Log").sheet1
-        
-        # 獲取所有紀錄
-        data = sheet.get_all_records()
-        df = pd.DataFrame(data)
-        
-        if df.empty:
-            print(json.dumps([]))
-            return
+MEMORY_CACHE_TTL = 60   # 檢索結果共用快取 (秒)；寫入新決策時整批失效
+
+def open_sheet():
+    # 共用連線 (tools/sheets.py)，不再每次重新授權
+    return sheets.get_worksheet()
+
+def search_memory(query, force_sync=False, k=5, ticker=None, date_from=None, date_to=None, pacer_type=None,
+                  as_frame=False, bodies=0):
+    # 直接回傳紀錄 (list of dict)；as_frame=True 時回傳 DataFrame
+    # 先做增量同步 (只抓新增列，不含 full_analysis)，失敗時仍以本地鏡像回答；
+    # 本地鏡像也是空的就直接拋出，不把「連不上」當成「沒有記憶」
+    # bodies: 前幾筆結果補上 full_analysis 全文 (prompt 只摘要排名最前的幾筆)
+    with telemetry.span("memory.sync") as span:
+        try:
+            span.set(**sheets.run(lambda: memory_mirror.sync(open_sheet, force=force_sync)))
+        except Exception as e:
+            if not memory_mirror.count():
+                raise
+            span.set(stale=1)
+            print(f"⚠️ 記憶鏡像同步失敗，改用本地資料: {e}", file=sys.stderr)
 
-        # 轉為小寫進行模糊搜尋
-        query_lower = query.lower()
-        
-        # 搜尋邏輯
-        mask = (
-            df['ticker'].astype(str).str.lower().str.contains(query_lower) | 
-            df['keywords'].astype(str).str.lower().str.contains(query_lower) |
-            df['rationale'].astype(str).str.lower().str.contains(query_lower) |
-            df['pacer_type'].astype(str).str.lower().str.contains(query_lower)
+    # BM25 索引只加入新列 (全文依列號批次補抓後一起索引)，查詢依相關度取前 k 筆
+    with telemetry.span("memory.search") as span:
+        index = memory_index.get_index()
+        index.catch_up(fetch_bodies=fetch_bodies)
+        hits = index.search(
+            query, k=k, ticker=ticker, date_from=date_from, date_to=date_to, pacer_type=pacer_type
         )
-        
-        results = df[mask]
-        
-        if not results.empty:
-            # 只回傳最近的 5 筆
-            print(results.tail(5).to_json(orient='records', force_ascii=False))
-        else:
-            print(json.dumps([]))
-            
+
+        found = memory_mirror.load_rows([row_num for row_num, _ in hits])
+        records = []
+        for row_num, score in hits:
+            if row_num in found:
+                records.append(dict(found[row_num], row_num=row_num, score=round(score, 4)))
+        span.set(hits=len(records), bytes_out=telemetry.payload_bytes(records))
+
+    if bodies:
+        with telemetry.span("memory.bodies", rows=min(bodies, len(records))):
+            attach_bodies(records[:bodies])
+
+    if as_frame:
+        import pandas as pd  # 只有要 DataFrame 時才載入
+        return pd.DataFrame(records)
+    return records
+
+def cached_search(query, **kwargs):
+    # search_memory 的跨行程共用快取版本：同一查詢同時只跑一次 Sheets 同步 + 檢索
+    if kwargs.get("force_sync") or kwargs.get("as_frame"):
+        return search_memory(query, **kwargs)
+    key = "memory:" + json.dumps([query, kwargs], ensure_ascii=False, sort_keys=True)
+    return shared_cache.get_cache().get_or_fetch(
+        key, lambda: search_memory(query, **kwargs), ttl=MEMORY_CACHE_TTL
+    )
+
+def fetch_bodies(row_nums):
+    # 索引用：本地沒有的全文向 Sheets 批次補抓 (連續列合併成範圍請求)，抓到的存進鏡像
+    return sheets.run(lambda: memory_mirror.load_bodies(row_nums, get_sheet=open_sheet))
+
+def attach_bodies(records):
+    # 依需要補上 full_analysis (本地沒有的才向 Sheets 批次補抓)；直接修改傳入的紀錄
+    wanted = [r for r in records if "full_analysis" not in r]
+    if not wanted:
+        return records
+    missing_rows = memory_mirror.find_rows([r["log_id"] for r in wanted if "row_num" not in r])
+    row_of = {id(r): r.get("row_num") or missing_rows.get(r.get("log_id")) for r in wanted}
+    try:
+        bodies = sheets.run(lambda: memory_mirror.load_bodies(
+            [row for row in row_of.values() if row], get_sheet=open_sheet
+        ))
     except Exception as e:
-        # 回傳空的 JSON 陣列，避免 Dashboard 報錯
-        print(json.dumps({"error": str(e)}))
+        print(f"⚠️ 全文載入失敗，只使用摘要: {e}", file=sys.stderr)
+        bodies = memory_mirror.load_bodies([row for row in row_of.values() if row])
+    for record in wanted:
+        row = row_of[id(record)]
+        if row in bodies:
+            record["full_analysis"] = bodies[row]
+    return records
+
+def get_analysis(log_id):
+    # 依 log_id 取回單筆決策的完整報告 (找不到時回傳 None)
+    record = {"log_id": log_id}
+    attach_bodies([record])
+    return record.get("full_analysis")
+
+def smart_search(query, **kwargs):
+    # CLI 版本：把 search_memory 的結果印成 JSON (錯誤照常丟出，由呼叫端決定怎麼處理)
+    print(json.dumps(search_memory(query, **kwargs), ensure_ascii=False))
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        smart_search(sys.argv[1])
+    import argparse
+    parser = argparse.ArgumentParser(description="System v14 記憶檢索")
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("-k", type=int, default=5, help="回傳筆數")
+    parser.add_argument("--ticker", help="只看指定代號")
+    parser.add_argument("--since", help="起始日期 YYYY-MM-DD")
+    parser.add_argument("--until", help="結束日期 YYYY-MM-DD")
+    parser.add_argument("--pacer", help="PACER 型態 (P/A/C/E/R)")
+    parser.add_argument("--resync", action="store_true", help="強制完整重建本地鏡像")
+    args = parser.parse_args()
+
+    if args.query or args.ticker or args.since or args.until or args.pacer:
+        try:
+            smart_search(
+                args.query, force_sync=args.resync, k=args.k, ticker=args.ticker,
+                date_from=args.since, date_to=args.until, pacer_type=args.pacer,
+            )
+        except Exception as e:
+            # 失敗時以非 0 結束碼回報，呼叫端不會把錯誤誤認為空的記憶
+            print(json.dumps({"error": str(e)}))
+            sys.exit(1)
     else:
-        print(json.dumps({"error": "No query provided"}))
\ No newline at end of file
+        print(json.dumps({"error": "No query provided"}))
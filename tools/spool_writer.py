@@ -0,0 +1,310 @@
+# tools/spool_writer.py
+# 非阻塞的寫入佇列 (write-behind)
+# enqueue 只把資料追加到本地 spool 檔 (append-only, fsync) 就立即返回，
+# 背景執行緒再批次送出；失敗時以指數退避重試，程式重啟時會重播尚未送出的資料。
+# - 錯誤分類：只有暫時性錯誤 (429 / 5xx / 網路) 會無限重試；其他錯誤把批次拆成單列重送，
+#   仍失敗的那一列移到 dead-letter 檔 (<spool>.dead.jsonl)，不會卡住後面的資料
+# - 多個副本共用資料夾：每個行程以 flock 鎖住自己的 spool 檔 (memory_spool.jsonl、memory_spool.1.jsonl ...)，
+#   啟動時把沒有人持有的 spool (上一個行程留下的) 併入自己的佇列，同一筆不會被兩個行程各送一次
+import glob
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows：不做跨行程鎖定 (單一行程使用)
+
+try:
+    from tools.rate_limit import is_retryable
+except ImportError:
+    from rate_limit import is_retryable  # 直接在 tools 資料夾執行
+
+BATCH_SIZE = 50
+BACKOFF_BASE = 1.0     # 秒
+BACKOFF_MAX = 60.0     # 秒
+MAX_SLOTS = 64         # 同一個資料夾最多幾個行程各自持有 spool
+
+
+def is_transient(exc):
+    # 值得重試的錯誤：限流 / 5xx (rate_limit 的分類)、網路層錯誤，以及授權失效 (與資料列無關，不能整批丟進 dead-letter)
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    return is_retryable(exc) or status in (401, 403) or isinstance(exc, (ConnectionError, TimeoutError, OSError))
+
+
+def _slot_path(base, slot):
+    if slot == 0:
+        return base
+    root, ext = os.path.splitext(base)
+    return f"{root}.{slot}{ext}"
+
+
+def _try_lock(path):
+    # 取得 path 的獨佔鎖；別的行程持有時回傳 None
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handle = open(path + ".lock", "a")
+    if fcntl is None:
+        return handle
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+class SpoolWriter:
+    def __init__(self, spool_path, flush_fn, batch_size=BATCH_SIZE, transient=is_transient):
+        # flush_fn(rows): 一次送出多列，失敗時丟出例外；transient(exc): 該錯誤是否值得重試
+        self.base_path = spool_path
+        self.dead_path = os.path.splitext(spool_path)[0] + ".dead.jsonl"
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.transient = transient
+        self._closed = False
+        self.spool_path, self._lock_handle = self._claim_slot()
+        self.offset_path = self.spool_path + ".offset"
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()
+        self._pending = deque()   # (spool 檔內結束位置, row)
+        self._thread = None
+        self._idle.set()
+
+        self.stats = {
+            "queue_depth": 0,
+            "flushed": 0,
+            "failures": 0,
+            "last_flush_latency": None,
+            "avg_flush_latency": None,
+            "last_error": None,
+            "dead_lettered": 0,
+        }
+        self._trim_torn_tail()
+        self._replay()
+        self._adopt_orphans()
+
+    # --- 1. Spool 檔 ---
+    def _claim_slot(self):
+        # 取第一個沒有別的行程持有的 spool 檔
+        for slot in range(MAX_SLOTS):
+            path = _slot_path(self.base_path, slot)
+            handle = _try_lock(path)
+            if handle is not None:
+                return path, handle
+        raise RuntimeError(f"spool 檔都被其他行程持有: {self.base_path}")
+
+    @staticmethod
+    def _read_offset_of(offset_path):
+        try:
+            with open(offset_path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _read_offset(self):
+        return self._read_offset_of(self.offset_path)
+
+    @staticmethod
+    def _write_offset_to(offset_path, offset):
+        tmp = offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp, offset_path)
+
+    def _write_offset(self, offset):
+        self._write_offset_to(self.offset_path, offset)
+
+    @classmethod
+    def _unsent(cls, path):
+        # (結束位置, row)：path 在 offset 之後的完整行
+        rows = []
+        if not os.path.exists(path):
+            return rows
+        offset = cls._read_offset_of(path + ".offset")
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                if not line.endswith(b"\n"):
+                    break  # 寫到一半的殘行，略過
+                try:
+                    rows.append((offset, json.loads(line)))
+                except ValueError:
+                    continue
+        return rows
+
+    def _trim_torn_tail(self):
+        # 上次當掉時寫到一半的殘行截掉 (已持有這個 spool 的鎖)；否則下一筆會接在殘行後面，重播時整行解析失敗而遺失
+        try:
+            f = open(self.spool_path, "r+b")
+        except FileNotFoundError:
+            return
+        with f:
+            end = size = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                print(f"✂️ 截掉 spool 尾端寫到一半的 {size - end} bytes")
+                f.truncate(end)
+                os.fsync(f.fileno())
+
+    def _replay(self):
+        # 重播上次沒送出的資料 (offset 之後的每一行)
+        unsent = self._unsent(self.spool_path)
+        if unsent:
+            self._pending.extend(unsent)
+            self._idle.clear()
+            print(f"♻️ 重播 spool 中尚未寫入的 {len(self._pending)} 筆資料")
+            self._ensure_thread()
+            self._wakeup.set()
+
+    def _adopt_orphans(self):
+        # 其他 spool 檔沒有人持有 (行程已結束)：把未送出的列搬進自己的 spool 後清空
+        root, ext = os.path.splitext(self.base_path)
+        for path in sorted(set(glob.glob(f"{glob.escape(root)}.*{ext}") + [self.base_path])):
+            suffix = path[len(root) + 1:-len(ext)] if path != self.base_path else "0"
+            if path == self.spool_path or not suffix.isdigit():
+                continue
+            handle = _try_lock(path)
+            if handle is None:
+                continue    # 還有行程在用
+            try:
+                unsent = self._unsent(path)
+                for _, row in unsent:
+                    self.enqueue(row)
+                if unsent:
+                    print(f"♻️ 接手 {os.path.basename(path)} 中尚未寫入的 {len(unsent)} 筆資料")
+                open(path, "wb").close()
+                self._write_offset_to(path + ".offset", 0)
+            finally:
+                handle.close()
+
+    def enqueue(self, row):
+        line = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+            with open(self.spool_path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                end = f.tell()
+            self._pending.append((end, row))
+            self._idle.clear()
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def _dead_letter(self, row, error):
+        # 無法寫入的列另存，人工檢查後可再補寫
+        record = {"ts": time.strftime("%Y-%m-%d %H:%M:%S"), "error": f"{error.__class__.__name__}: {error}", "row": row}
+        with open(self.dead_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.stats["dead_lettered"] += 1
+        print(f"☠️ spool 資料無法寫入，已移到 {os.path.basename(self.dead_path)}: {error}")
+
+    def _compact(self, offset):
+        # 全部送出後清空 spool，避免檔案無限成長
+        with self._lock:
+            if not self._pending and os.path.getsize(self.spool_path) == offset:
+                open(self.spool_path, "wb").close()
+                self._write_offset(0)
+                self._idle.set()
+                return
+        self._write_offset(offset)
+
+    # --- 2. 背景送出 ---
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="spool-writer", daemon=True)
+                self._thread.start()
+
+    def _done(self, batch, latency=None):
+        # batch 已送出 (或移到 dead-letter)：前進 offset
+        with self._lock:
+            for _ in batch:
+                self._pending.popleft()
+        self._compact(batch[-1][0])
+        if latency is None:
+            return
+        flushed = self.stats["flushed"]
+        avg = self.stats["avg_flush_latency"] or latency
+        self.stats["flushed"] = flushed + len(batch)
+        self.stats["last_flush_latency"] = round(latency, 3)
+        self.stats["avg_flush_latency"] = round(avg * 0.8 + latency * 0.2, 3)
+        self.stats["last_error"] = None
+
+    def _send(self, batch):
+        # 送出 batch；暫時性錯誤往上丟 (退避後重試)，其他錯誤拆成單列找出有問題的那幾列
+        start = time.perf_counter()
+        try:
+            self.flush_fn([row for _, row in batch])
+        except Exception as e:
+            if self.transient(e):
+                raise
+            self.stats["failures"] += 1
+            self.stats["last_error"] = str(e)
+            if len(batch) == 1:
+                self._dead_letter(batch[0][1], e)
+                self._done(batch)
+                return
+            for item in batch:
+                self._send([item])
+            return
+        self._done(batch, time.perf_counter() - start)
+
+    def _run(self):
+        attempt = 0
+        while not self._closed:
+            self._wakeup.wait(timeout=5)
+            self._wakeup.clear()
+            while not self._closed:
+                with self._lock:
+                    batch = list(itertools.islice(self._pending, self.batch_size))
+                    if not batch:
+                        self._idle.set()
+                        break
+
+                try:
+                    self._send(batch)
+                except Exception as e:
+                    attempt += 1
+                    self.stats["failures"] += 1
+                    self.stats["last_error"] = str(e)
+                    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+                    time.sleep(delay * random.uniform(0.5, 1.0))
+                    continue
+                attempt = 0
+
+    # --- 3. 狀態 / 等待 ---
+    def get_stats(self):
+        with self._lock:
+            depth = len(self._pending)
+        return dict(self.stats, queue_depth=depth)
+
+    def flush(self, timeout=None):
+        # 阻塞直到佇列清空 (CLI 結束前使用)；逾時回傳 False
+        self._wakeup.set()
+        return self._idle.wait(timeout)
+
+    def close(self):
+        # 停止背景執行緒並釋放 spool 檔 (未送出的列留在檔案裡，下一個行程接手)
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._lock_handle is not None:
+            self._lock_handle.close()
+            self._lock_handle = None
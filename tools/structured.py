@@ -0,0 +1,162 @@
+# tools/structured.py
+# 結構化輸出的驗證與局部修補
+# 模型呼叫已要求 JSON + response_schema (prompts.RESPONSE_SCHEMA)，這裡負責收尾：
+# 1. 解析：完整 JSON 直接 json.loads；壞掉的 (截斷、多了前後綴) 改用串流解析器救回已完整的頂層欄位
+# 2. 驗證：依 schema 檢查型別 / enum / 必填，回傳有問題的頂層欄位
+# 3. 修補：只把壞掉或缺少的欄位用小 prompt 重新要一次 (full_analysis 不重做，用救回的部分內容)
+# 解析失敗率與修補成本 (次數 / token / 秒) 記在 stats，並附加到 telemetry span。
+import json
+import threading
+import time
+
+from prompts import REPAIR_PROMPT, RESPONSE_SCHEMA
+
+try:
+    from tools import telemetry
+    from tools.analysis import generate, token_usage
+    from tools.json_stream import JsonFieldStream
+except ImportError:
+    import telemetry  # 直接在 tools 資料夾執行
+    from analysis import generate, token_usage
+    from json_stream import JsonFieldStream
+
+NOT_REPAIRED = {"full_analysis"}    # 長文欄位不重新生成 (成本等同整份分析)
+REPAIR_CONTEXT_CHARS = 2000         # 修補 prompt 附上的既有內容上限
+
+_stats = {"responses": 0, "parse_failures": 0, "invalid": 0, "repairs": 0, "repaired": 0,
+          "repair_failed": 0, "repair_tokens_in": 0, "repair_tokens_out": 0, "repair_seconds": 0.0}
+_lock = threading.Lock()
+
+
+def _count(**deltas):
+    with _lock:
+        for key, value in deltas.items():
+            _stats[key] += value
+
+
+# --- 1. 解析 ---
+def salvage(raw_text):
+    # 回傳 (dict, ok)；ok=False 表示不是完整合法的 JSON，dict 只含救回的欄位
+    try:
+        value = json.loads(raw_text)
+        if isinstance(value, dict):
+            return value, True
+    except (TypeError, ValueError):
+        pass
+    stream = JsonFieldStream().feed(str(raw_text or ""))
+    fields = dict(stream.fields)
+    for key in NOT_REPAIRED:
+        if key not in fields and stream.partial(key):
+            fields[key] = stream.partial(key)
+    return fields, False
+
+
+# --- 2. 驗證 ---
+def _score(value):
+    try:
+        return 0 <= float(value) <= 100
+    except (TypeError, ValueError):
+        return False
+
+
+# schema 表達不了的額外規則
+CHECKS = {"risk_score": _score}
+
+
+def _valid(value, schema):
+    kind = schema.get("type", "").upper()
+    if kind == "OBJECT":
+        if not isinstance(value, dict):
+            return False
+        properties = schema.get("properties", {})
+        return all(k in value for k in schema.get("required", [])) and all(
+            _valid(v, properties[k]) for k, v in value.items() if k in properties
+        )
+    if kind == "ARRAY":
+        return isinstance(value, list) and all(_valid(v, schema.get("items", {})) for v in value)
+    if kind == "STRING":
+        return isinstance(value, str) and ("enum" not in schema or value in schema["enum"])
+    if kind in ("NUMBER", "INTEGER"):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return True
+
+
+def validate(result, schema=RESPONSE_SCHEMA):
+    # 回傳有問題的頂層欄位 (缺少或不合格)，依 schema 順序
+    properties = schema["properties"]
+    required = set(schema.get("required", []))
+    broken = []
+    for key, sub in properties.items():
+        if key not in result:
+            if key in required:
+                broken.append(key)
+        elif not _valid(result[key], sub) or (key in CHECKS and not CHECKS[key](result[key])):
+            broken.append(key)
+    return broken
+
+
+# --- 3. 修補 ---
+def repair_prompt(result, broken):
+    known = {k: v for k, v in result.items() if k not in broken or k in NOT_REPAIRED}
+    partial = json.dumps(known, ensure_ascii=False)[:REPAIR_CONTEXT_CHARS]
+    return REPAIR_PROMPT.format(fields=", ".join(broken), partial=partial)
+
+
+def sub_schema(broken, schema=RESPONSE_SCHEMA):
+    return {
+        "type": "OBJECT",
+        "properties": {k: schema["properties"][k] for k in broken},
+        "required": list(broken),
+    }
+
+
+def repair(result, broken, model, fallback=None, schema=RESPONSE_SCHEMA):
+    # 只重新要 broken 欄位；回傳 (合併後的結果, 仍有問題的欄位)
+    prompt = repair_prompt(result, broken)
+    start = time.perf_counter()
+    with telemetry.span("repair", fields=len(broken)) as span:
+        try:
+            response = generate(model, prompt, fallback=fallback, schema=sub_schema(broken, schema))
+            raw_text = response.text
+        except Exception as e:
+            print(f"⚠️ 欄位修補失敗: {e}")
+            _count(repairs=1, repair_failed=1, repair_seconds=time.perf_counter() - start)
+            return result, broken
+        tokens_in, tokens_out = token_usage(prompt, raw_text, response)
+        span.set(tokens_in=tokens_in, tokens_out=tokens_out)
+
+    patch, _ = salvage(raw_text)
+    merged = dict(result, **{k: patch[k] for k in broken if k in patch})
+    still_broken = [k for k in validate(merged, schema) if k not in NOT_REPAIRED]
+    _count(repairs=1, repaired=int(not still_broken), repair_failed=int(bool(still_broken)),
+           repair_tokens_in=tokens_in, repair_tokens_out=tokens_out, repair_seconds=time.perf_counter() - start)
+    return merged, still_broken
+
+
+# --- 4. 對外介面 ---
+def complete_result(raw_text, model=None, fallback=None, schema=RESPONSE_SCHEMA):
+    # 解析 + 驗證 + (有 model 時) 局部修補；決策欄位仍無法取得才標記為 Error
+    result, ok = salvage(raw_text)
+    broken = validate(result, schema)
+    _count(responses=1, parse_failures=int(not ok), invalid=int(bool(broken)))
+    span = telemetry.current_span()
+    span.set(parse_failed=int(not ok), broken_fields=len(broken))
+
+    if "full_analysis" in broken:
+        # 長文救不回來就保留原始回應，不重新生成
+        result["full_analysis"] = result.get("full_analysis") or str(raw_text or "")
+    repairable = [k for k in broken if k not in NOT_REPAIRED]
+    if repairable and model is not None:
+        result, repairable = repair(result, repairable, model, fallback, schema)
+    if "decision" in repairable:
+        result.update(decision="Error", rationale=result.get("rationale") or "無法解析 JSON")
+    return result
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats, repair_seconds=round(_stats["repair_seconds"], 3))
+    responses = stats["responses"]
+    stats["parse_failure_rate"] = round(stats["parse_failures"] / responses, 3) if responses else None
+    stats["invalid_rate"] = round(stats["invalid"] / responses, 3) if responses else None
+    return stats
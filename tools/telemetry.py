@@ -0,0 +1,263 @@
+# tools/telemetry.py
+# 輕量計時 span：每次推演建立一個 trace，各階段 (Sheets / Yahoo / Gemini / 解析 / 歸檔)
+# 以 with span(...) 記錄起訖時間、傳輸量 (bytes) 與 token 數。
+# trace 結束後逐筆附加到本地 JSONL (data/metrics.jsonl)，可依階段 / 協議計算滾動 p50/p95/p99。
+# 檔案超過 METRICS_MAX_BYTES 就輪替成 metrics.jsonl.1 (只留一份舊檔)；滾動統計從檔尾往回讀，不掃整個檔案。
+# 沒有進行中的 trace 時 span 不做任何事，tools/ 內的函式在 CLI / 背景執行緒呼叫也不受影響。
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+
+DATA_DIR = os.environ.get("SYSTEM_V14_DATA_DIR", "data")
+METRICS_PATH = os.path.join(DATA_DIR, "metrics.jsonl")
+ROLLING_WINDOW = 1000          # 滾動百分位數取最近幾筆 span
+METRICS_MAX_BYTES = 5 * 1024 * 1024
+TAIL_BLOCK = 64 * 1024
+
+_current_trace = contextvars.ContextVar("system_v14_trace", default=None)
+_current_span = contextvars.ContextVar("system_v14_span", default=None)
+_write_lock = threading.Lock()
+
+
+def percentile(values, q):
+    # 線性內插的百分位數 (q: 0 ~ 100)；沒有資料回傳 None
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    pos = (len(values) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+def payload_bytes(value):
+    # 估算傳輸量：字串取 UTF-8 長度，其餘先轉 JSON
+    if value is None:
+        return 0
+    if isinstance(value, bytes):
+        return len(value)
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, default=str)
+    return len(value.encode("utf-8"))
+
+
+# --- 1. Span / Trace ---
+class Span:
+    def __init__(self, trace, name, parent=None):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.attrs = {}
+        self.thread = threading.current_thread().name
+        self.error = None
+        self._start = time.perf_counter()
+        self._end = None
+
+    def set(self, **attrs):
+        # 例：span.set(bytes_in=..., tokens_out=...)；數值型屬性重複設定時累加
+        for key, value in attrs.items():
+            if isinstance(value, (int, float)) and isinstance(self.attrs.get(key), (int, float)):
+                self.attrs[key] += value
+            else:
+                self.attrs[key] = value
+        return self
+
+    @property
+    def seconds(self):
+        end = self._end if self._end is not None else time.perf_counter()
+        return end - self._start
+
+    def to_dict(self):
+        return dict(
+            self.attrs,
+            stage=self.name,
+            parent=self.parent.name if self.parent else None,
+            start=round(self._start - self.trace.t0, 4),
+            seconds=round(self.seconds, 4),
+            thread=self.thread,
+            error=self.error,
+        )
+
+
+class _NullSpan:
+    # 沒有 trace 時的替身，呼叫端不用判斷
+    def set(self, **attrs):
+        return self
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    def __init__(self, protocol, ticker=None):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.protocol = protocol
+        self.ticker = ticker
+        self.t0 = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._token = None
+        self._finished = None
+
+    def _add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def elapsed(self):
+        end = self._finished if self._finished is not None else time.perf_counter()
+        return end - self.t0
+
+    def waterfall(self):
+        # 依開始時間排序的 span 清單 (dict)，供 Dashboard 畫瀑布圖
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s._start)
+        return [s.to_dict() for s in spans]
+
+    def totals(self):
+        # 整個 trace 的傳輸量與 token 合計
+        totals = {}
+        for span in self.waterfall():
+            for key in ("bytes_in", "bytes_out", "tokens_in", "tokens_out"):
+                if isinstance(span.get(key), (int, float)):
+                    totals[key] = totals.get(key, 0) + span[key]
+        return totals
+
+    def finish(self, path=None, write=True):
+        # 結束 trace：還原 context，並把各 span 附加到 metrics JSONL
+        if self._finished is not None:
+            return self
+        self._finished = time.perf_counter()
+        if self._token is not None:
+            try:
+                _current_trace.reset(self._token)
+            except ValueError:
+                _current_trace.set(None)  # 在別的 context 結束 (例如 Streamlit 例外中斷)
+            self._token = None
+        if write:
+            try:
+                self._write(path or METRICS_PATH)
+            except OSError as e:
+                print(f"⚠️ metrics 寫入失敗: {e}")
+        return self
+
+    def _write(self, path):
+        base = {"ts": round(self.wall_start, 3), "trace_id": self.trace_id, "protocol": self.protocol, "ticker": self.ticker}
+        lines = [json.dumps(dict(span, **base), ensure_ascii=False) for span in self.waterfall()]
+        lines.append(json.dumps(dict(base, stage="total", seconds=round(self.elapsed(), 4), **self.totals()), ensure_ascii=False))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with _write_lock:
+            _rotate(path)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+
+def _rotate(path):
+    try:
+        if os.path.getsize(path) >= METRICS_MAX_BYTES:
+            os.replace(path, path + ".1")
+    except FileNotFoundError:
+        pass
+
+
+def start_trace(protocol, ticker=None):
+    # 在目前的 context (Streamlit script 執行緒 / 批次工作執行緒) 開始一個 trace
+    trace = Trace(protocol, ticker)
+    trace._token = _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_span():
+    return _current_span.get() or _NULL_SPAN
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NULL_SPAN
+        return
+    s = Span(trace, name, parent=_current_span.get())
+    s.set(**attrs)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = type(e).__name__
+        raise
+    finally:
+        s._end = time.perf_counter()
+        _current_span.reset(token)
+        trace._add(s)
+
+
+# --- 2. 滾動統計 ---
+def _tail_lines(path, window):
+    # 從檔尾往回一塊一塊讀，拿到最後 window 行就停
+    if window <= 0:
+        return []
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return []
+    with f:
+        end = f.seek(0, os.SEEK_END)
+        data = b""
+        while end > 0 and data.count(b"\n") <= window:
+            start = max(0, end - TAIL_BLOCK)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+    lines = data.split(b"\n")
+    if end > 0:
+        lines = lines[1:]   # 第一行可能只讀到一半
+    return [line.decode("utf-8", "replace") for line in lines if line][-window:]
+
+
+def _tail(path, window):
+    lines = _tail_lines(path, window)
+    if len(lines) < window:
+        lines = _tail_lines(path + ".1", window - len(lines)) + lines   # 剛輪替過，從舊檔補足
+    rows = []
+    for line in lines:
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            continue  # 寫到一半的最後一行
+    return rows
+
+
+def rolling_stats(path=None, window=ROLLING_WINDOW, protocol=None):
+    # 最近 window 筆 span，依 (stage, protocol) 分組的 p50/p95/p99 (秒)
+    groups = {}
+    for row in _tail(path or METRICS_PATH, window):
+        if protocol and row.get("protocol") != protocol:
+            continue
+        groups.setdefault((row.get("stage"), row.get("protocol")), []).append(row.get("seconds"))
+    stats = []
+    for (stage, proto), values in sorted(groups.items(), key=lambda item: (str(item[0][1]), str(item[0][0]))):
+        stats.append({
+            "stage": stage,
+            "protocol": proto,
+            "n": len(values),
+            "p50": round(percentile(values, 50), 4),
+            "p95": round(percentile(values, 95), 4),
+            "p99": round(percentile(values, 99), 4),
+        })
+    return stats
+
+
+if __name__ == "__main__":
+    # 印出滾動百分位數：python tools/telemetry.py [metrics.jsonl]
+    import sys
+    for row in rolling_stats(sys.argv[1] if len(sys.argv) > 1 else None):
+        print(f"{row['protocol'] or '-':<24} {row['stage']:<16} n={row['n']:<5} "
+              f"p50 {row['p50']:.3f}s  p95 {row['p95']:.3f}s  p99 {row['p99']:.3f}s")